@@ -4,10 +4,13 @@
 
 from adam.auth import Auth
 from adam.batch import Batch
+from adam.batch import ResultRetention
 from adam.batch_propagation import BatchPropagation
 from adam.batch_propagation import BatchPropagations
 from adam.batch_run_manager import BatchRunManager
 from adam.batches import Batches
+from adam.bulk_opm import BulkOpmGenerator
+from adam.bulk_opm import RenderedOpm
 from adam.comparison import Comparison
 from adam.config_manager import ConfigManager
 from adam.group import Groups
@@ -21,14 +24,27 @@ from adam.adam_processing_results_processor import ApsRestServiceResultsProcesso
 from adam.batch_propagation_results import OrbitEventType, MonteCarloResults, ResultsClient
 from adam.opm_params import OpmParams
 from adam.opm_params import OpmParams
+from adam.opm_parser import iter_opm_files
+from adam.opm_parser import load_opm_arrays
+from adam.opm_parser import parse_opm
+from adam.opm_parser import parse_opm_arrays
 from adam.permission import Permission
 from adam.permission import Permissions
 from adam.propagation_params import PropagationParams
 from adam.propagator_config import PropagatorConfigs
+from adam.result_cache import ResultCache
+from adam.retry_policy import RetryPolicy
+from adam.run_manifest import RunManifest
+from adam.run_scheduler import RunScheduler
 from adam.runnable_manager import RunnableManager
 from adam.service import Service
 from adam.stk import *
+from adam.stm_propagation_module import DifferenceScheme
 from adam.stm_propagation_module import StmPropagationModule
+from adam.linear_covariance import LinearCovariancePropagation
+from adam.linear_covariance import LinearCovarianceResults
+from adam.unscented_propagation import UnscentedPropagation
+from adam.unscented_propagation import UnscentedResults
 from adam.targeted_propagation import TargetedPropagation
 from adam.targeted_propagation import TargetedPropagations
 from adam.targeted_propagation import TargetingParams
@@ -2,6 +2,32 @@
     adam_objects.py
 """
 
+from adam.value_type import ValueType
+
+import logging
+from multiprocessing.dummy import Pool as ThreadPool
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Bound on the number of concurrent requests made to retrieve children, over all the
+# parents whose children are being retrieved at once, e.g. from several threads.
+CHILD_FETCH_WORKERS = 16
+_child_fetch_slots = threading.BoundedSemaphore(CHILD_FETCH_WORKERS)
+
+
+def _fetch_child(function, uuid, rate_limiter=None):
+    """Makes a request for a child, within the process-wide bound on concurrent child
+    requests and, if given, the rate of the rate limiter (a TokenBucket)."""
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    with _child_fetch_slots:
+        return function(uuid)
+
+
+def _uuid_only(uuid):
+    return {'uuid': uuid}
+
 
 class AdamObject(object):
     def __init__(self):
@@ -28,7 +54,9 @@ class AdamObject(object):
         return self._children
 
 
-class AdamObjectRunnableState(object):
+class AdamObjectRunnableState(ValueType):
+    __slots__ = ('_uuid', '_calc_state', '_error')
+
     def __init__(self, response):
         self._uuid = response['uuid']
         self._calc_state = response['calculationState']
@@ -114,7 +142,22 @@ class AdamObjects(object):
 
         return response['items']
 
-    def _get_children_json(self, uuid):
+    def _get_children_json(self, uuid, max_workers=CHILD_FETCH_WORKERS, with_json=True,
+                           rate_limiter=None):
+        """Retrieves the json, runnable state and type of every child of the given parent.
+
+        Args:
+            uuid (str): the uuid of the parent.
+            max_workers (int): bound on the number of concurrent requests of this call.
+                All calls together also make at most CHILD_FETCH_WORKERS at once.
+            with_json (boolean): if false, only the runnable states are retrieved, and
+                the json of each child is just {'uuid': <uuid of the child>}.
+            rate_limiter (TokenBucket): if given, limits the rate of the requests for
+                the children.
+
+        Returns:
+            list: [json, AdamObjectRunnableState, type] of each child.
+        """
         code, response = self._rest.get(
             '/adam_object/by_parent/' + self._type + '/' + uuid)
 
@@ -127,14 +170,34 @@ class AdamObjects(object):
         if response is None:
             return []
 
-        child_json_list = []
+        # Each child takes two requests, one for its json and one for its runnable state.
+        # They are all independent, so they are made concurrently.
+        requests = []
         for child_type, child_uuid in zip(response['childTypes'], response['childUuids']):
-            print('Fetching ' + child_uuid + ' of type ' + child_type)
+            logger.debug('Fetching %s of type %s', child_uuid, child_type)
             retriever = AdamObjects(self._rest, child_type)
-            child_json_list.append([retriever._get_json(child_uuid),
-                                    retriever.get_runnable_state(child_uuid),
-                                    child_type])
-        return child_json_list
+            if with_json:
+                requests.append((retriever._get_json, child_uuid))
+            else:
+                requests.append((_uuid_only, child_uuid))
+            requests.append((retriever.get_runnable_state, child_uuid))
+
+        def _request(request):
+            if request[0] is _uuid_only:
+                return _uuid_only(request[1])
+            return _fetch_child(request[0], request[1], rate_limiter)
+
+        if max_workers <= 1 or len(requests) <= 1:
+            results = [_request(r) for r in requests]
+        else:
+            pool = ThreadPool(min(max_workers, CHILD_FETCH_WORKERS, len(requests)))
+            results = pool.map(_request, requests)
+            pool.close()
+            pool.join()
+        logger.info('Fetched %s children of %s', len(requests) // 2, uuid)
+
+        return [[results[2 * i], results[2 * i + 1], child_type]
+                for i, child_type in enumerate(response['childTypes'])]
 
     def delete(self, uuid):
         code, _ = self._rest.delete(
@@ -1,13 +1,23 @@
 from adam import PropagationParams, OpmParams, Project
 from adam import ApsRestServiceResultsProcessor, MonteCarloResults
 from adam import AuthenticatingRestProxy, RestRequests
+from adam.bulk_opm import BulkOpmGenerator
 
 
 class AdamProcessingService:
     """The ADAM service handling operations related to jobs."""
 
-    def __init__(self, rest=AuthenticatingRestProxy(RestRequests())):
+    def __init__(self, rest=AuthenticatingRestProxy(RestRequests()), result_cache=None):
+        """
+        Args:
+            rest (RestProxy): proxy used to communicate with the server.
+            result_cache (ResultCache): if given, submitting a job identical to one
+                submitted before (and still in the cache), or earlier in the same call,
+                returns a reference to that job instead of creating a new one, unless
+                that job has since failed or been deleted.
+        """
         self._rest = rest
+        self._result_cache = result_cache
 
     def __repr__(self):
         return "Adam Processing Service Class"
@@ -31,22 +41,97 @@ class AdamProcessingService:
             MonteCarloResults: a reference to batch propagation object.
         """
 
-        project_id = project.get_uuid() if type(project) is Project else project
-        data = self._build_batch_creation_data(propagation_params, opm_params,
-                                               object_id, user_defined_id)
+        def _build_data():
+            return self._build_batch_creation_data(propagation_params, opm_params,
+                                                   object_id, user_defined_id)
+        key = self._get_cache_key(project, propagation_params, opm_params, object_id,
+                                  user_defined_id)
+        return self._submit_job(project, _build_data, key)
+
+    def execute_batch_propagations(self,
+                                   project,
+                                   propagation_params: PropagationParams,
+                                   opm_template: OpmParams,
+                                   states,
+                                   covariances=None,
+                                   maneuvers=None,
+                                   processes=None) -> list:
+        """Create one job per state vector to run batch propagations which differ only
+        by their initial state (and optionally covariance and initial maneuver).
+
+        The OPMs are rendered in bulk from the template (see BulkOpmGenerator), and the
+        propagation parameters are serialized once for all jobs.
 
-        code, response = self._rest.post(f'/projects/{project_id}/jobs', data)
+        Args:
+            project (str | Project): The workspace (project) id or project object
+            propagation_params (PropagationParams): Parameters for the propagations.
+            opm_template (OpmParams): OPM parameters shared by all propagations.
+            states (array-like): (N, 6) initial state vectors, one per job.
+            covariances (array-like): optional (N, 21) cartesian covariances.
+            maneuvers (array-like): optional (N, 3) initial maneuvers.
+            processes (int): number of processes to render the OPMs with.
+
+        Returns:
+            list<MonteCarloResults>: references to the jobs, in the order of the states.
+        """
+        opms = BulkOpmGenerator(opm_template).generate(states, covariances, maneuvers,
+                                                       processes)
+        propagation_params_json = self._build_propagation_params_json(propagation_params)
+
+        results = []
+        for opm in opms:
+            def _build_data(opm=opm):
+                return {
+                    'templatePropagationParameters': propagation_params_json,
+                    'opm_string': opm.generate_opm(),
+                    'description': propagation_params.get_description(),
+                }
+            key = self._get_cache_key(project, propagation_params, opm, None, None)
+            results.append(self._submit_job(project, _build_data, key))
+        return results
+
+    def _get_project_id(self, project):
+        return project.get_uuid() if type(project) is Project else project
+
+    def _get_cache_key(self, project, propagation_params, opm_params, object_id,
+                       user_defined_id):
+        if self._result_cache is None:
+            return None
+        return self._result_cache.key('job', self._get_project_id(project), propagation_params,
+                                      opm_params, object_id, user_defined_id)
+
+    def _submit_job(self, project, build_data, key=None):
+        """Creates a job from the data returned by build_data(), unless the result cache
+        holds a job for the given key which has not failed or been deleted since."""
+        results_processor = ApsRestServiceResultsProcessor(self._rest, project)
+        if key is not None:
+            job_uuid = self._result_cache.get(key)
+            if job_uuid is not None:
+                if self._is_reusable(results_processor, job_uuid):
+                    return MonteCarloResults(results_processor, job_uuid)
+                self._result_cache.delete(key)
+
+        project_id = self._get_project_id(project)
+        code, response = self._rest.post(f'/projects/{project_id}/jobs', build_data())
 
         if code != 200:
             raise RuntimeError("Server status code: %s; Response: %s" % (code, response))
 
-        results_processor = ApsRestServiceResultsProcessor(self._rest, project)
         job_uuid = response['uuid']
+        if key is not None:
+            self._result_cache.put(key, job_uuid)
 
         return MonteCarloResults(results_processor, job_uuid)
 
-    def _build_batch_creation_data(self, propagation_params, opm_params, object_id,
-                                   user_defined_id):
+    def _is_reusable(self, results_processor, job_uuid):
+        try:
+            status = results_processor.check_status(job_uuid)['status']
+        except RuntimeError:
+            # E.g. the job was deleted.
+            return False
+        return status != 'FAILED'
+
+    def _build_propagation_params_json(self, propagation_params):
         propagation_params_json = {
             'start_time': propagation_params.get_start_time(),
             'end_time': propagation_params.get_end_time(),
@@ -74,8 +159,13 @@ class AdamProcessingService:
         if propagation_params.get_keplerian_sigma() is not None:
             propagation_params_json['keplerianSigma'] = propagation_params.get_keplerian_sigma()
 
+        return propagation_params_json
+
+    def _build_batch_creation_data(self, propagation_params, opm_params, object_id,
+                                   user_defined_id):
         data = {
-            'templatePropagationParameters': propagation_params_json,
+            'templatePropagationParameters':
+                self._build_propagation_params_json(propagation_params),
             'opm_string': opm_params.generate_opm(),
             'description': propagation_params.get_description(),
         }
@@ -0,0 +1,233 @@
+"""
+    adaptive_submitter.py
+"""
+
+from adam.errors import RequestTimeoutError
+
+from collections import deque
+import threading
+import time
+
+
+class AdaptiveSubmitter(object):
+    """Submits a list of items to the server in chunks whose size and concurrency adapt
+    to how the server is actually behaving.
+
+    Each chunk is sized so that its expected latency stays under a target, using the
+    observed seconds per payload byte of previous chunks. A chunk that times out is split
+    in half and both halves are retried, and the estimate is made more conservative.
+    Concurrency starts low and grows by one thread while throughput keeps improving,
+    backing off when it degrades or when chunks time out.
+
+    Note that a timed-out request may still have been processed by the server, so a
+    retried chunk can create duplicates server-side.
+    """
+
+    def __init__(self, target_latency_sec=20.0, initial_chunk_size=100, min_chunk_size=1,
+                 max_chunk_size=2000, max_chunk_bytes=50 * 1024 * 1024, initial_threads=2,
+                 max_threads=10, timeout_errors=(RequestTimeoutError,)):
+        """
+        Args:
+            target_latency_sec (float): latency each chunk should be sized for. Calls to
+                the server time out around 60 seconds, so this leaves ample headroom.
+            initial_chunk_size (int): number of items in the first, probing chunk.
+            min_chunk_size (int): chunks this small are not split further on timeout;
+                the timeout is raised instead.
+            max_chunk_size (int): upper bound on the number of items per chunk.
+            max_chunk_bytes (int): upper bound on the payload bytes per chunk.
+            initial_threads (int): number of chunks submitted concurrently at first.
+            max_threads (int): upper bound on the number of concurrent submissions.
+            timeout_errors (tuple<type>): exception types signalling a timed out chunk.
+        """
+        self._target_latency_sec = target_latency_sec
+        self._initial_chunk_size = initial_chunk_size
+        self._min_chunk_size = min_chunk_size
+        self._max_chunk_size = max_chunk_size
+        self._max_chunk_bytes = max_chunk_bytes
+        self._initial_threads = max(1, min(initial_threads, max_threads))
+        self._max_threads = max_threads
+        self._timeout_errors = timeout_errors
+
+        # Estimate of server time per payload byte, smoothed over chunks.
+        self._sec_per_byte = None
+        self._smoothing = 0.5
+        self._last_chunk_size = None
+
+        self._stats = {'chunks': 0, 'timeouts': 0, 'max_threads_used': 0}
+
+    def __repr__(self):
+        return "Adaptive submitter [%s]" % self._stats
+
+    def get_stats(self):
+        """Returns counts of chunks submitted and timed out, and the peak concurrency."""
+        return dict(self._stats)
+
+    def _observe(self, latency, num_bytes):
+        if num_bytes <= 0:
+            return
+        sample = latency / num_bytes
+        if self._sec_per_byte is None:
+            self._sec_per_byte = sample
+        else:
+            self._sec_per_byte = (self._smoothing * sample +
+                                  (1 - self._smoothing) * self._sec_per_byte)
+
+    def _next_chunk_end(self, start, count, sizes):
+        """Picks the end of the next chunk of new items beginning at start."""
+        if self._sec_per_byte is None:
+            max_items = self._initial_chunk_size
+            max_bytes = self._max_chunk_bytes
+        else:
+            # Don't grow faster than doubling per chunk, in case latency is not linear.
+            max_items = min(self._max_chunk_size, 2 * self._last_chunk_size)
+            max_bytes = min(self._max_chunk_bytes,
+                            self._target_latency_sec / max(self._sec_per_byte, 1e-12))
+
+        end = start
+        total = 0
+        while end < count and end - start < max_items:
+            size = sizes(end)
+            if end > start and total + size > max_bytes:
+                break
+            total += size
+            end += 1
+        return end
+
+    def submit(self, items, submit_chunk, item_size=None):
+        """Submits all items, returning the results in item order.
+
+        Args:
+            items (list): items to submit.
+            submit_chunk (callable): called with a list of consecutive items; must return
+                a list of results of the same length. May be called from several threads.
+            item_size (callable): returns the payload size in bytes of an item. Evaluated
+                once per item, lazily as chunks are formed. If not given, every item
+                counts as one byte, i.e. chunks are sized by item count alone.
+
+        Returns:
+            list: results of submit_chunk, concatenated in item order.
+        """
+        count = len(items)
+        results = [None] * count
+        sizes_cache = {}
+
+        def sizes(i):
+            if i not in sizes_cache:
+                sizes_cache[i] = 1 if item_size is None else item_size(items[i])
+            return sizes_cache[i]
+
+        lock = threading.Condition()
+        state = {
+            'next': 0,              # first item not yet assigned to any chunk
+            'retries': deque(),     # (start, end) ranges to resubmit after a timeout
+            'in_flight': 0,
+            'threads': self._initial_threads,
+            'error': None,
+            'window_items': 0,      # throughput measurement since the last adjustment
+            'window_chunks': 0,
+            'window_start': time.perf_counter(),
+            'best_throughput': 0.0,
+        }
+
+        def take_chunk():
+            if state['retries']:
+                return state['retries'].popleft()
+            if state['next'] < count:
+                start = state['next']
+                end = self._next_chunk_end(start, count, sizes)
+                state['next'] = end
+                return start, end
+            return None
+
+        def adjust_concurrency():
+            # Called with the lock held after each completed chunk.
+            if state['window_chunks'] < state['threads']:
+                return
+            elapsed = time.perf_counter() - state['window_start']
+            throughput = state['window_items'] / max(elapsed, 1e-9)
+            if throughput > 1.1 * state['best_throughput']:
+                state['best_throughput'] = throughput
+                state['threads'] = min(state['threads'] + 1, self._max_threads)
+            elif throughput < 0.8 * state['best_throughput']:
+                state['threads'] = max(state['threads'] - 1, 1)
+            state['window_items'] = 0
+            state['window_chunks'] = 0
+            state['window_start'] = time.perf_counter()
+
+        def worker():
+            try:
+                run_chunks()
+            except Exception as e:
+                with lock:
+                    if state['error'] is None:
+                        state['error'] = e
+                    lock.notify_all()
+
+        def run_chunks():
+            while True:
+                with lock:
+                    while True:
+                        if state['error'] is not None:
+                            return
+                        done = (state['next'] >= count and not state['retries'])
+                        if done and state['in_flight'] == 0:
+                            lock.notify_all()
+                            return
+                        if not done and state['in_flight'] < state['threads']:
+                            break
+                        lock.wait()
+                    start, end = take_chunk()
+                    state['in_flight'] += 1
+                    self._stats['max_threads_used'] = max(
+                        self._stats['max_threads_used'], state['in_flight'])
+
+                num_bytes = sum(sizes(i) for i in range(start, end))
+                t0 = time.perf_counter()
+                try:
+                    chunk_results = submit_chunk(items[start:end])
+                    error = None
+                except self._timeout_errors as e:
+                    chunk_results = None
+                    error = e
+                except Exception:
+                    with lock:
+                        state['in_flight'] -= 1
+                    raise
+                latency = time.perf_counter() - t0
+
+                with lock:
+                    state['in_flight'] -= 1
+                    self._stats['chunks'] += 1
+                    if error is None:
+                        results[start:end] = chunk_results
+                        self._observe(latency, num_bytes)
+                        self._last_chunk_size = end - start
+                        state['window_items'] += end - start
+                        state['window_chunks'] += 1
+                        adjust_concurrency()
+                    else:
+                        self._stats['timeouts'] += 1
+                        if end - start <= self._min_chunk_size:
+                            state['error'] = error
+                        else:
+                            # Split and retry, and be more careful from now on.
+                            mid = (start + end) // 2
+                            state['retries'].appendleft((mid, end))
+                            state['retries'].appendleft((start, mid))
+                            self._last_chunk_size = max(1, (end - start) // 2)
+                            if self._sec_per_byte is not None:
+                                self._sec_per_byte *= 2
+                            else:
+                                self._initial_chunk_size = max(1, self._initial_chunk_size // 2)
+                            state['threads'] = max(1, state['threads'] // 2)
+                    lock.notify_all()
+
+        workers = [threading.Thread(target=worker) for _ in range(self._max_threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+        if state['error'] is not None:
+            raise state['error']
+        return results
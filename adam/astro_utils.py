@@ -19,3 +19,69 @@ def _apply_x_rotation(phi, x0, y0, z0, vx0, vy0, vz0):
     vy = vy0 * np.cos(phi) + vz0 * np.sin(phi)
     vz = -vy0 * np.sin(phi) + vz0 * np.cos(phi)
     return [x, y, z, vx, vy, vz]
+
+
+def keplerian_to_cartesian(elements, gm, mean_anomaly=False):
+    """Converts keplerian elements to cartesian state vectors, in the frame of the
+    elements.
+
+    Args:
+        elements (array-like): (..., 6) elements [a, e, i, raan, arg of pericenter,
+            anomaly] in [km, -, deg, deg, deg, deg], as in OpmParams keplerian elements.
+        gm (float): gravitational parameter of the central body [km^3/s^2].
+        mean_anomaly (boolean): whether the anomalies are mean rather than true
+            anomalies. Only elliptical orbits are supported with mean anomalies.
+
+    Returns:
+        numpy.ndarray: (..., 6) state vectors [rx, ry, rz, vx, vy, vz] in [km, km/s].
+
+    Raises:
+        ValueError if any of the elements do not describe a point on an orbit, e.g. a
+        negative eccentricity, or a true anomaly beyond the asymptotes of a hyperbola.
+    """
+    elements = np.asarray(elements, dtype=np.float64)
+    a = elements[..., 0]
+    e = elements[..., 1]
+    i, raan, argp, anomaly = np.moveaxis(np.deg2rad(elements[..., 2:6]), -1, 0)
+
+    if np.any(e < 0.0):
+        raise ValueError("Eccentricities must not be negative.")
+    if mean_anomaly:
+        if np.any(e >= 1.0):
+            raise ValueError("Mean anomalies are only supported for elliptical orbits.")
+        # Solve Kepler's equation M = E - e sin(E) by Newton's method.
+        eccentric = np.where(e < 0.8, anomaly, np.pi)
+        for _ in range(50):
+            delta = (eccentric - e * np.sin(eccentric) - anomaly) / (1.0 - e * np.cos(eccentric))
+            eccentric = eccentric - delta
+            if np.all(np.abs(delta) < 1e-14):
+                break
+        anomaly = 2.0 * np.arctan2(np.sqrt(1.0 + e) * np.sin(eccentric / 2.0),
+                                   np.sqrt(1.0 - e) * np.cos(eccentric / 2.0))
+
+    p = a * (1.0 - e * e)
+    # Ellipses need a positive semi-major axis, hyperbolas a negative one, and a true
+    # anomaly within their asymptotes. Parabolas can't be described by a and e.
+    if np.any(~(p > 0.0)) or np.any(~(1.0 + e * np.cos(anomaly) > 0.0)):
+        raise ValueError("The elements do not describe a point on an elliptical or "
+                         "hyperbolic orbit.")
+    r = p / (1.0 + e * np.cos(anomaly))
+    speed = np.sqrt(gm / p)
+    perifocal = np.stack([r * np.cos(anomaly), r * np.sin(anomaly),
+                          -speed * np.sin(anomaly), speed * (e + np.cos(anomaly))], axis=-1)
+
+    # Columns of the rotation from the perifocal frame: towards pericenter, and 90 degrees
+    # ahead of it in the orbital plane.
+    cos_o, sin_o = np.cos(raan), np.sin(raan)
+    cos_w, sin_w = np.cos(argp), np.sin(argp)
+    cos_i, sin_i = np.cos(i), np.sin(i)
+    p_axis = np.stack([cos_o * cos_w - sin_o * sin_w * cos_i,
+                       sin_o * cos_w + cos_o * sin_w * cos_i,
+                       sin_w * sin_i], axis=-1)
+    q_axis = np.stack([-cos_o * sin_w - sin_o * cos_w * cos_i,
+                       -sin_o * sin_w + cos_o * cos_w * cos_i,
+                       cos_w * sin_i], axis=-1)
+
+    position = perifocal[..., 0:1] * p_axis + perifocal[..., 1:2] * q_axis
+    velocity = perifocal[..., 2:3] * p_axis + perifocal[..., 3:4] * q_axis
+    return np.concatenate([position, velocity], axis=-1)
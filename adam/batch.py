@@ -3,9 +3,19 @@
 """
 
 from datetime import datetime, timedelta
+from enum import Enum
+import threading
+import zlib
+
+import numpy as np
+
+from adam.value_type import ValueType
 
 
 class Batch(object):
+    # Batches track their run, so unlike their parameters they are not immutable.
+    __slots__ = ('_propagation_params', '_opm_params', '_state_summary', '_results')
+
     def __init__(self, propagation_params, opm_params):
         self._propagation_params = propagation_params
         self._opm_params = opm_params
@@ -46,7 +56,10 @@ class Batch(object):
         return self._state_summary.get_calc_state()
 
 
-class StateSummary(object):
+class StateSummary(ValueType):
+    __slots__ = ('_uuid', '_calc_state', '_step_size', '_create_time', '_execute_time',
+                 '_complete_time', '_project_uuid', '_parts_count', '_error')
+
     def __init__(self, json):
         """ Requires a json response as returned from the server representing a batch
             state summary (e.g. from /batch/uuid or in bulk from batch/project_id)
@@ -62,6 +75,7 @@ class StateSummary(object):
         self._complete_time = json.get('complete_time')
         self._project_uuid = json.get('project')
         self._parts_count = json.get('parts_count')
+        self._error = json.get('error')
 
     def __repr__(self):
         return "State summary for %s: %s" % (self._uuid, self._calc_state)
@@ -90,22 +104,150 @@ class StateSummary(object):
     def get_calc_state(self):
         return self._calc_state
 
+    def get_error(self):
+        return self._error
+
+
+class ResultRetention(Enum):
+    """How much of each result part's ephemeris to keep in memory.
+
+    FULL keeps the ephemeris text as received. COMPRESSED keeps it zlib-compressed and
+    decompresses it on access. ARRAYS keeps only the parsed times and state vectors.
+    END_STATE keeps only the end state vector of the final part. Under every policy but
+    FULL the ephemeris text is dropped as soon as it has been reduced.
+    """
+    FULL = 'FULL'
+    COMPRESSED = 'COMPRESSED'
+    ARRAYS = 'ARRAYS'
+    END_STATE = 'END_STATE'
+
+
+M2KM = 1E-3  # meters to kilometers
+
+
+def _parse_state_row(line):
+    # Time and state of an ephemeris data row, or None if the line is not one, e.g. a
+    # header or comment.
+    split_line = line.split()
+    if len(split_line) < 7:
+        return None
+    try:
+        return [float(i) for i in split_line[:7]]
+    except ValueError:
+        return None
+
+
+def _parse_ephemeris(stk_ephemeris):
+    """Parses an STK ephemeris into its scenario epoch string, the times of its state
+    vectors in seconds from that epoch, and the state vectors as an (n, 6) array in
+    [km, km/s]. Any line of at least 7 numbers is taken to be a state.
+    """
+    epoch_str = None
+    times = []
+    states = []
+    for line in stk_ephemeris.splitlines():
+        if line.startswith("ScenarioEpoch"):
+            epoch_str = line.split('\t')[1]
+            continue
+        row = _parse_state_row(line)
+        if row is not None:
+            times.append(row[0])
+            states.append(row[1:7])
+    times = np.array(times, dtype=np.float64)
+    states = np.array(states, dtype=np.float64).reshape(-1, 6) * M2KM
+    return epoch_str, times, states
+
+
+def _parse_end_state(stk_ephemeris, complete=True):
+    """Parses only the last state of an STK ephemeris, scanning backwards from the end of
+    the text to the last data row before "END Ephemeris".
+
+    Args:
+        stk_ephemeris (str): the ephemeris text, or its tail.
+        complete (boolean): whether the text starts at the beginning of the ephemeris. If
+            not, its first line may be cut off and is never taken to be a state.
+
+    Returns:
+        list: the last state vector in [km, km/s], or None if none was found.
+    """
+    end = stk_ephemeris.rfind("END Ephemeris")
+    if end < 0:
+        end = len(stk_ephemeris)
+    while end > 0:
+        start = stk_ephemeris.rfind('\n', 0, end)
+        if start < 0 and not complete:
+            return None
+        row = _parse_state_row(stk_ephemeris[start + 1:end])
+        if row is not None:
+            return [x * M2KM for x in row[1:7]]
+        end = start
+    return None
+
 
 class PropagationResults(object):
 
     class Part(object):
-        def __init__(self, part):
+        def __init__(self, part, retention=ResultRetention.FULL, is_final=True):
             """ Requires a json response as returned from the server representing a batch
                 part state (e.g. from /batch/batch_uuid/part_index)
 
+                Args:
+                    part (dict): the part json.
+                    retention (ResultRetention): how much of the ephemeris to keep.
+                    is_final (boolean): whether this is the final part of its batch. Only
+                        the final part keeps an end state under END_STATE retention.
+
                 Raises:
                     KeyError if the given object does not include 'part_index' and
                     'calc_state'
             """
             self._part_index = part['part_index']
             self._calc_state = part['calc_state']
-            self._ephemeris = part.get('stk_ephemeris')
             self._error = part.get('error')
+            self._retention = retention
+
+            self._ephemeris = None
+            self._compressed_ephemeris = None
+            self._parsed = None
+            self._end_state_vector = None
+
+            ephemeris = part.get('stk_ephemeris')
+            if ephemeris is None or retention == ResultRetention.FULL:
+                self._ephemeris = ephemeris
+            elif retention == ResultRetention.COMPRESSED:
+                self._compressed_ephemeris = zlib.compress(ephemeris.encode('utf-8'))
+            elif retention == ResultRetention.ARRAYS:
+                self._parsed = _parse_ephemeris(ephemeris)
+            elif retention == ResultRetention.END_STATE and is_final:
+                self._end_state_vector = _parse_end_state(ephemeris)
+
+        def get_retention(self):
+            return self._retention
+
+        def get_parsed_ephemeris(self):
+            """ Returns (scenario epoch string, times [s], states (n, 6) [km, km/s]), or None
+                if this part has no ephemeris or does not retain enough to parse one.
+            """
+            if self._parsed is None:
+                ephemeris = self.get_ephemeris()
+                if ephemeris is None:
+                    return None
+                return _parse_ephemeris(ephemeris)
+            return self._parsed
+
+        def get_end_state_vector(self):
+            """ Returns the last state vector of this part as a list in [km, km/s], or None
+                if there is none.
+            """
+            if self._end_state_vector is not None:
+                return self._end_state_vector
+            if self._parsed is not None:
+                states = self._parsed[2]
+                return states[-1].tolist() if len(states) > 0 else None
+            ephemeris = self.get_ephemeris()
+            if ephemeris is None:
+                return None
+            return _parse_end_state(ephemeris)
 
         def __repr__(self):
             return "PropagationPart [%s]" % (self._calc_state)
@@ -117,32 +259,103 @@ class PropagationResults(object):
             return self._calc_state
 
         def get_ephemeris(self):
+            """ Returns the ephemeris text, or None if there is none or it was not retained
+                (ARRAYS and END_STATE retention).
+            """
+            if self._compressed_ephemeris is not None:
+                return zlib.decompress(self._compressed_ephemeris).decode('utf-8')
             return self._ephemeris
 
         def get_error(self):
             return self._error
 
-    M2KM = 1E-3  # meters to kilometers
-
-    def __init__(self, parts):
+    M2KM = M2KM
+
+    @classmethod
+    def lazy(cls, parts_count, part_loader, retention=ResultRetention.FULL):
+        """ Creates results that fetch only the final part up front, since that is all the
+            end state and ephemeris accessors need. Other parts are fetched on first
+            access through part_loader.
+
+            Args:
+                parts_count (int): number of parts in the batch.
+                part_loader (callable): called with a list of part indices, returns the
+                    list of their json responses (None for parts that could not be found).
+                    Called for the remaining parts together when all parts are requested,
+                    so it may fetch them concurrently.
+                retention (ResultRetention): how much of each part's ephemeris to keep.
+        """
+        parts = [None] * parts_count
+        parts[-1] = part_loader([parts_count - 1])[0]
+        results = cls(parts, retention)
+        results._part_loader = part_loader
+        results._unloaded = set(range(parts_count - 1))
+        return results
+
+    def __init__(self, parts, retention=ResultRetention.FULL):
         """ Should be called with a list of json responses from the server representing
             the parts_count parts of a batch propagation result.
+
+            Args:
+                parts (list<dict>): the part json responses.
+                retention (ResultRetention): how much of each part's ephemeris to keep.
         """
         if (len(parts) < 1):
             raise RuntimeError("Must provide at least one part.")
 
+        self._retention = retention
+        self._part_loader = None
+        self._unloaded = set()
+        self._load_lock = threading.Lock()
+
+        # Parsed final ephemeris, cached by _get_final_states().
+        self._final_states = None
+
         # Fill in None responses (which may happen e.g. in case of 404s, or if the part
         # isn't ready yet) with Nones
-        self._parts = [self.Part(p) if p is not None else None for p in parts]
+        self._parts = [self._make_part(i, p, len(parts)) for i, p in enumerate(parts)]
+
+    def _make_part(self, index, part, parts_count):
+        if part is None:
+            return None
+        return self.Part(part, self._retention, index == parts_count - 1)
+
+    def _load(self, indices):
+        with self._load_lock:
+            indices = sorted(i for i in indices if i in self._unloaded)
+            if len(indices) == 0:
+                return
+            for i, p in zip(indices, self._part_loader(indices)):
+                self._parts[i] = self._make_part(i, p, len(self._parts))
+                self._unloaded.discard(i)
+
+    def __getstate__(self):
+        # Pickling (e.g. into a ResultCache) fetches any parts not loaded yet, since the
+        # loader cannot be pickled.
+        self.get_parts()
+        state = dict(self.__dict__)
+        del state['_load_lock']
+        state['_part_loader'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._load_lock = threading.Lock()
 
     def __repr__(self):
         return "Propagation results with %s parts" % (len(self._parts))
 
     def get_parts(self):
+        self._load(list(self._unloaded))
         return self._parts
 
-    def get_final_ephemeris(self):
-        part = self._parts[-1]
+    def get_part(self, index):
+        """ Returns the part at the given index, fetching it first if necessary. """
+        self._load([index % len(self._parts)])
+        return self._parts[index]
+
+    def _get_final_part(self):
+        part = self.get_part(-1)
         if part is None:
             print("Final part is not available")
             return None
@@ -151,6 +364,12 @@ class PropagationResults(object):
             print(
                 "Final part is in state %s, not COMPLETED, so no ephemeris is available" % (state))
             return None
+        return part
+
+    def get_final_ephemeris(self):
+        part = self._get_final_part()
+        if part is None:
+            return None
         return part.get_ephemeris()
 
     def _parse_date(self, date):
@@ -162,6 +381,101 @@ class PropagationResults(object):
         parsed = parsed + timedelta(microseconds=micros * 1000000)
         return parsed
 
+    def _get_final_states(self):
+        """ Returns (file epoch, times [s] sorted ascending, states (n, 6) [km, km/s]) of the
+            final part, parsing its ephemeris only on first use. Returns None (with a
+            message) if they are not available.
+        """
+        if self._final_states is not None:
+            return self._final_states
+
+        part = self._get_final_part()
+        if part is None:
+            return None
+        parsed = part.get_parsed_ephemeris()
+        if parsed is None:
+            print("No ephemeris was retained for the final part")
+            return None
+        epoch_str, times, states = parsed
+
+        file_epoch = None
+        if epoch_str is not None:
+            try:
+                file_epoch = self._parse_date(epoch_str)
+            except ValueError as e:
+                print("Caught error, ignoring: " + str(e))
+                pass
+        if file_epoch is None:
+            print("No file epoch could be parsed")
+            return None
+
+        # Ephemerides of backwards propagations run backwards in time.
+        order = np.argsort(times, kind='stable')
+        self._final_states = (np.datetime64(file_epoch, 'us'), times[order], states[order])
+        return self._final_states
+
+    def get_state_vectors_at_times(self, target_epochs, interpolate=False):
+        """Get the state vectors at the given times as an (n, 6) array in [km, km/s]
+
+        The final part's ephemeris is parsed once and kept, so sampling one trajectory at
+        many times costs one parse plus a sorted search over its sample times.
+
+        Args:
+            target_epochs (list<datetime> or array of datetime64) - times at which state
+                vectors are desired
+            interpolate (boolean) - if false, only times that match a state vector in the
+                ephemeris are answered. If true, states between two state vectors are
+                interpolated: positions with cubic Hermite interpolation using the
+                velocities, velocities linearly.
+
+        Returns:
+            states (numpy.ndarray) - an (n, 6) array of [rx, ry, rz, vx, vy, vz] rows in
+                                     [km, km/s], with rows of NaN for times that could not
+                                     be answered (e.g. outside of the ephemeris). None if
+                                     the final ephemeris is not available.
+        """
+        final_states = self._get_final_states()
+        if final_states is None:
+            return None
+        file_epoch, times, states = final_states
+
+        targets = np.asarray(target_epochs, dtype='datetime64[us]')
+        offsets = (targets - file_epoch) / np.timedelta64(1, 's')
+        result = np.full((len(offsets), 6), np.nan)
+        if len(times) == 0:
+            return result
+
+        tolerance = 1e-6
+        i = np.clip(np.searchsorted(times, offsets), 1, max(len(times) - 1, 1))
+        lower = i - 1
+        upper = np.minimum(i, len(times) - 1)
+
+        # Exact matches (within the tolerance) on either neighbouring sample.
+        for j in (lower, upper):
+            exact = np.abs(times[j] - offsets) <= tolerance
+            result[exact] = states[j[exact]]
+
+        if interpolate:
+            between = (np.isnan(result[:, 0]) & (offsets > times[lower]) &
+                       (offsets < times[upper]))
+            t0 = times[lower[between]]
+            t1 = times[upper[between]]
+            s0 = states[lower[between]]
+            s1 = states[upper[between]]
+            h = (t1 - t0)[:, np.newaxis]
+            u = ((offsets[between] - t0) / (t1 - t0))[:, np.newaxis]
+
+            h00 = 2 * u**3 - 3 * u**2 + 1
+            h10 = u**3 - 2 * u**2 + u
+            h01 = -2 * u**3 + 3 * u**2
+            h11 = u**3 - u**2
+            positions = (h00 * s0[:, :3] + h10 * h * s0[:, 3:] +
+                         h01 * s1[:, :3] + h11 * h * s1[:, 3:])
+            velocities = (1 - u) * s0[:, 3:] + u * s1[:, 3:]
+            result[between] = np.hstack([positions, velocities])
+
+        return result
+
     def get_state_vector_at_time(self, target_epoch):
         """Get the state vector at the given time as a 6d list in [km, km/s]
 
@@ -169,7 +483,7 @@ class PropagationResults(object):
         the ephemeris in order to determine the times of all the state vectors given in the file.
 
         If a time is requested that does not have an explicit state vector, None will be returned.
-        This will not interpolate.
+        This will not interpolate. To query many times, use get_state_vectors_at_times.
 
         Args:
             target_epoch (datetime) - time at which a state vector is desired
@@ -178,37 +492,13 @@ class PropagationResults(object):
             state_vector (list) - an array with 6 elements [rx, ry, rz, vx, vy, vz]
                                   [km, km/s]
         """
-        stk_ephemeris = self.get_final_ephemeris()
-        if stk_ephemeris is None:
+        states = self.get_state_vectors_at_times([target_epoch])
+        if states is None:
             return None
-
-        split_ephem = stk_ephemeris.splitlines()
-
-        file_epoch = None
-        for line in split_ephem:
-            if line.startswith("ScenarioEpoch"):
-                epoch_str = line.split('\t')[1]
-                try:
-                    file_epoch = self._parse_date(epoch_str)
-                except ValueError as e:
-                    print("Caught error, ignoring: " + str(e))
-                    pass
-        if file_epoch is None:
-            print("No file epoch could be parsed")
+        if np.isnan(states[0, 0]):
+            print("No state vector found at time " + str(target_epoch))
             return None
-
-        for line in split_ephem:
-            split_line = line.split()
-            # It's a state if it has more than 7 elements
-            if len(split_line) >= 7:
-                epoch = file_epoch + timedelta(seconds=float(split_line[0]))
-                if abs((epoch - target_epoch).total_seconds()) <= 1e-6:
-                    state_vector = [(float(i) * self.M2KM)
-                                    for i in split_line][1:7]
-                    return state_vector
-
-        print("No state vector found at time " + str(target_epoch))
-        return None
+        return states[0].tolist()
 
     def get_end_state_vector(self):
         """Get the end state vector as a 6d list in [km, km/s]
@@ -222,19 +512,7 @@ class PropagationResults(object):
             state_vector (list) - an array with 6 elements [rx, ry, rz, vx, vy, vz]
                                   [km, km/s]
         """
-        stk_ephemeris = self.get_final_ephemeris()
-        if stk_ephemeris is None:
+        part = self._get_final_part()
+        if part is None:
             return None
-
-        split_ephem = stk_ephemeris.splitlines()
-        state_vectors = []
-        for line in split_ephem:
-            split_line = line.split()
-            # It's a state if it has more than 7 elements
-            if len(split_line) >= 7:
-                state_vector = [(float(i) * self.M2KM) for i in split_line]
-                # Ignore time
-                state_vectors.append(state_vector[1:7])
-
-        # We want the last element
-        return state_vectors[-1]
+        return part.get_end_state_vector()
@@ -4,12 +4,49 @@
 
 from adam.adam_objects import AdamObject
 from adam.adam_objects import AdamObjects
+from adam.adam_objects import CHILD_FETCH_WORKERS
+from adam.adam_objects import _fetch_child
 from adam.opm_params import OpmParams
 from adam.propagation_params import PropagationParams
 
+from multiprocessing.dummy import Pool as ThreadPool
+import threading
+import zlib
+
+import numpy as np
+
 M2KM = 1E-3  # meters to kilometers
 
 
+def _parse_state_vectors(text):
+    # Whitespace-separated numbers, one state vector per line, straight into a float64
+    # array in km and km/s.
+    rows = len([line for line in text.splitlines() if line.strip()])
+    values = np.array(text.split(), dtype=np.float64) * M2KM
+    if rows == 0:
+        return values.reshape(0, 6)
+    return values.reshape(rows, -1)
+
+
+def stack_final_states(propagations):
+    """Builds an (n, 6) array of the final state vectors of the given propagations, e.g.
+    the children of a batch propagation, in km and km/s. Rows of propagations without a
+    final state vector are NaN.
+
+    Args:
+        propagations (list<SinglePropagation>): the propagations.
+
+    Returns:
+        numpy.ndarray: one row per propagation.
+    """
+    states = np.full((len(propagations), 6), np.nan)
+    for i, p in enumerate(propagations):
+        state = p.get_final_state_array()
+        if state is not None:
+            states[i] = state
+    return states
+
+
 class BatchPropagation(AdamObject):
     def __init__(self, propagation_params, opm_params):
         AdamObject.__init__(self)
@@ -32,8 +69,15 @@ class BatchPropagation(AdamObject):
     def get_final_state_vectors(self):
         if self._summary is None:
             return []
-        return [[(float(n) * M2KM) for n in sv.split()]
-                for sv in self._summary.splitlines()]
+        return self.get_final_state_array().tolist()
+
+    def get_final_state_array(self):
+        """Returns the final state vectors of the summary as a contiguous float64 array
+        with one row per state vector, in km and km/s, or None if there is no summary.
+        """
+        if self._summary is None:
+            return None
+        return _parse_state_vectors(self._summary)
 
 
 class SinglePropagation(AdamObject):
@@ -42,33 +86,169 @@ class SinglePropagation(AdamObject):
         self._propagation_params = propagation_params
         self._opm_params = opm_params
         self._ephemeris = None
+        self._ephemeris_loader = None
         self._final_state_vector = None
+        self._details_loader = None
+
+    def set_details(self, propagation_params, opm_params, final_state_vector):
+        """Sets the parameters and final state vector, e.g. once loaded (see
+        set_details_loader())."""
+        self._propagation_params = propagation_params
+        self._opm_params = opm_params
+        self.set_final_state_vector(final_state_vector)
+        self._details_loader = None
+
+    def set_details_loader(self, details_loader):
+        """Defers loading the parameters and final state vector until they are first
+        accessed.
+
+        Args:
+            details_loader (callable): called without arguments on the first access to
+                them; sets them with set_details().
+        """
+        self._details_loader = details_loader
+
+    def _load_details(self):
+        if self._details_loader is not None:
+            self._details_loader()
 
     def set_ephemeris(self, ephemeris):
         self._ephemeris = ephemeris
+        self._ephemeris_loader = None
+
+    def set_ephemeris_loader(self, ephemeris_loader):
+        """Defers loading the ephemeris until it is first accessed.
+
+        Args:
+            ephemeris_loader (callable): called without arguments on the first call to
+                get_ephemeris(); returns the ephemeris text (or None).
+        """
+        self._ephemeris = None
+        self._ephemeris_loader = ephemeris_loader
 
     def set_final_state_vector(self, final_state_vector):
-        self._final_state_vector = None if final_state_vector is None else [
-            float(n) * M2KM for n in final_state_vector.split()]
+        self._final_state_vector = None if final_state_vector is None else \
+            _parse_state_vectors(final_state_vector).ravel()
 
     def get_propagation_params(self):
+        self._load_details()
         return self._propagation_params
 
     def get_opm_params(self):
+        self._load_details()
         return self._opm_params
 
     def get_ephemeris(self):
+        if self._ephemeris_loader is not None:
+            self._ephemeris = self._ephemeris_loader()
+            self._ephemeris_loader = None
         return self._ephemeris
 
     def get_final_state_vector(self):
+        self._load_details()
+        if self._final_state_vector is None:
+            return None
+        return self._final_state_vector.tolist()
+
+    def get_final_state_array(self):
+        """Returns the final state vector as a float64 array in km and km/s, or None."""
+        self._load_details()
         return self._final_state_vector
 
 
+def _child_details(child_json):
+    # Values in [] are guaranteed to be present. Values in .get() may be missing.
+    opm_params = OpmParams.fromJsonResponse(child_json['propagationParameters']['opm'])
+    propagation_params = PropagationParams.fromJsonResponse(
+        child_json['propagationParameters'], child_json.get('description'))
+    return propagation_params, opm_params, child_json.get('finalStateVector')
+
+
+class _LazyChildren(object):
+    """Loads the json of the children of a batch propagation only when it is needed, so
+    that each child is downloaded at most once.
+
+    The first access to the parameters or final state vector of any child fetches the
+    json of all the children not loaded yet, concurrently. Their ephemerides, which
+    come with it, are kept compressed until accessed. The first access to the ephemeris
+    of a child not loaded yet fetches the json of that child only.
+    """
+
+    def __init__(self, rest, children, max_workers=CHILD_FETCH_WORKERS, rate_limiter=None):
+        self._retriever = AdamObjects(rest, 'SinglePropagation')
+        self._children = children
+        self._max_workers = max_workers
+        self._rate_limiter = rate_limiter
+        self._lock = threading.Lock()
+        # Compressed ephemerides of the loaded children, by uuid, until accessed.
+        self._ephemerides = {}
+        for child in children:
+            child.set_details_loader(self._load_details)
+            child.set_ephemeris_loader(self._get_ephemeris_loader(child))
+
+    def _get_child_json(self, uuid):
+        child_json = _fetch_child(self._retriever._get_json, uuid, self._rate_limiter)
+        if child_json is None:
+            raise RuntimeError("Could not retrieve " + uuid)
+        return child_json
+
+    def _get_details(self, uuid):
+        # Compressed as soon as each response arrives, so that the text of at most one
+        # ephemeris per worker is held at a time.
+        child_json = self._get_child_json(uuid)
+        ephemeris = child_json.pop('ephemeris', None)
+        if ephemeris is not None:
+            ephemeris = zlib.compress(ephemeris.encode('utf-8'))
+        return _child_details(child_json), ephemeris
+
+    def _load_details(self):
+        with self._lock:
+            pending = [c for c in self._children if c._details_loader is not None]
+            if not pending:
+                return
+            uuids = [c.get_uuid() for c in pending]
+            if self._max_workers <= 1 or len(uuids) <= 1:
+                loaded = [self._get_details(uuid) for uuid in uuids]
+            else:
+                pool = ThreadPool(min(self._max_workers, CHILD_FETCH_WORKERS, len(uuids)))
+                loaded = pool.map(self._get_details, uuids)
+                pool.close()
+                pool.join()
+            for child, (child_details, ephemeris) in zip(pending, loaded):
+                child.set_details(*child_details)
+                self._ephemerides[child.get_uuid()] = ephemeris
+
+    def _get_ephemeris_loader(self, child):
+        def load():
+            with self._lock:
+                if child.get_uuid() in self._ephemerides:
+                    ephemeris = self._ephemerides.pop(child.get_uuid())
+                    return None if ephemeris is None else \
+                        zlib.decompress(ephemeris).decode('utf-8')
+            child_json = self._get_child_json(child.get_uuid())
+            with self._lock:
+                if child._details_loader is not None:
+                    child.set_details(*_child_details(child_json))
+            return child_json.get('ephemeris')
+        return load
+
+
 class BatchPropagations(AdamObjects):
     """Batch propagations using the runnables framework"""
 
-    def __init__(self, rest):
+    def __init__(self, rest, lazy_ephemeris=False):
+        """
+        Args:
+            rest (RestProxy): proxy used to communicate with the server.
+            lazy_ephemeris (boolean): if true, get_children() only retrieves the uuids and
+                runnable states of the children. The rest of each child is retrieved on
+                first access, at most once: the parameters and final state vectors of all
+                of them together, keeping their ephemerides compressed until accessed, or
+                a single child on access to its ephemeris. This keeps the children of
+                large batch propagations small in memory.
+        """
         AdamObjects.__init__(self, rest, 'BatchPropagation')
+        self._lazy_ephemeris = lazy_ephemeris
 
     def __repr__(self):
         return "BatchPropagations module"
@@ -124,8 +304,19 @@ class BatchPropagations(AdamObjects):
         batch_propagation.set_summary(response.get('summary'))
         return batch_propagation
 
-    def get_children(self, uuid):
-        child_response_list = AdamObjects._get_children_json(self, uuid)
+    def get_children(self, uuid, rate_limiter=None):
+        """Retrieves the children of the given batch propagation.
+
+        Args:
+            uuid (str): the uuid of the batch propagation.
+            rate_limiter (TokenBucket): if given, limits the rate of the requests for the
+                children, including those made later by lazy children.
+
+        Returns:
+            list<SinglePropagation>: the children.
+        """
+        child_response_list = AdamObjects._get_children_json(
+            self, uuid, with_json=not self._lazy_ephemeris, rate_limiter=rate_limiter)
 
         children = []
         for childJson, child_runnable_state, child_type in child_response_list:
@@ -135,17 +326,17 @@ class BatchPropagations(AdamObjects):
                 print('Skipping child of unexpected type ' + child_type)
                 continue
 
-            # Values in [] are guaranteed to be present. Values in .get() may be missing.
-            childOpmParams = OpmParams.fromJsonResponse(
-                childJson['propagationParameters']['opm'])
-            childPropParams = PropagationParams.fromJsonResponse(
-                childJson['propagationParameters'], childJson.get('description'))
-            childProp = SinglePropagation(childPropParams, childOpmParams)
+            if self._lazy_ephemeris:
+                childProp = SinglePropagation(None, None)
+            else:
+                childProp = SinglePropagation(*_child_details(childJson)[:2])
+                childProp.set_ephemeris(childJson.get('ephemeris'))
+                childProp.set_final_state_vector(childJson.get('finalStateVector'))
             childProp.set_uuid(childJson['uuid'])
             childProp.set_runnable_state(child_runnable_state)
-            childProp.set_ephemeris(childJson.get('ephemeris'))
-            childProp.set_final_state_vector(childJson.get('finalStateVector'))
 
             children.append(childProp)
 
+        if self._lazy_ephemeris:
+            _LazyChildren(self._rest, children, rate_limiter=rate_limiter)
         return children
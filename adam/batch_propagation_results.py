@@ -14,6 +14,27 @@ import requests
 from dateutil import parser as dateparser
 
 from adam import stk, ApsRestServiceResultsProcessor, AuthenticatingRestProxy, RestRequests
+from adam.batch import M2KM, _parse_end_state
+from adam.events import EventDispatcher, EventType
+
+
+def _holds_whole_file(response, tail_bytes):
+    """Whether a response to a Range request for the last tail_bytes of a file holds all
+    of the file."""
+    # 206 is a partial response; 200 means the whole file was sent.
+    if response.status_code != 206:
+        return True
+    # Content-Range: bytes <first>-<last>/<size>. The tail is the whole file if it starts
+    # at its first byte.
+    content_range = response.headers.get('Content-Range', '')
+    if content_range.startswith('bytes ') and '-' in content_range:
+        try:
+            return int(content_range[len('bytes '):content_range.index('-')]) == 0
+        except ValueError:
+            pass
+    # Without it, a tail shorter than requested is all there is. Compare bytes, not the
+    # decoded characters, which are fewer for multibyte content.
+    return len(response.content) < tail_bytes
 
 
 class OrbitEventType(enum.Enum):
@@ -70,6 +91,7 @@ class ApsResults:
         self._job_uuid = job_uuid
         self._results_uuid = None
         self._results = None
+        self._events = EventDispatcher()
 
     def __str__(self):
         return f'{self.json()}'
@@ -84,6 +106,34 @@ class ApsResults:
     def check_status(self):
         return self._rp.check_status(self._job_uuid)['status']
 
+    def subscribe(self, callback, event_types=None):
+        """Registers a callback for events while waiting for the job to complete.
+
+        wait_for_complete() emits STATE_CHANGED whenever the job status changes (starting
+        from no status), FAILED if the job fails and RUN_FINISHED once it completes.
+        Callbacks run on a dedicated thread, and all events are delivered before
+        wait_for_complete() returns or raises.
+
+        Args:
+            callback (callable): called with each Event.
+            event_types (list<EventType>): the event types to receive. Defaults to all.
+
+        Returns:
+            callable: the callback, which can be passed to unsubscribe().
+        """
+        return self._events.subscribe(callback, event_types)
+
+    def unsubscribe(self, callback):
+        self._events.unsubscribe(callback)
+
+    def _emit_status(self, status, last_status):
+        if status == last_status:
+            return
+        self._events.emit(EventType.STATE_CHANGED, uuid=self._job_uuid, state=status,
+                          previous_state=last_status)
+        if status == 'FAILED':
+            self._events.emit(EventType.FAILED, uuid=self._job_uuid, state=status)
+
     def wait_for_complete(self, max_wait_sec=60, print_waiting=False):
         """Polls the job until the job completes.
 
@@ -100,24 +150,31 @@ class ApsResults:
         sleep_time_sec = 10.0
         t0 = time.perf_counter()
         status = self.check_status()
+        self._emit_status(status, None)
         last_status = ''
         count = 0
-        while status != 'COMPLETED':
-            if print_waiting:
-                if last_status != status:
-                    print(status)
-                    count = 0
-                if count == 40:
-                    count = 0
-                    print()
-                print('.', end='')
-            elapsed = time.perf_counter() - t0
-            if elapsed > max_wait_sec:
-                raise RuntimeError(
-                    f'Computation has exceeded desired wait period of {max_wait_sec} sec.')
-            last_status = status
-            time.sleep(sleep_time_sec)
-            status = self.check_status()
+        try:
+            while status != 'COMPLETED':
+                if print_waiting:
+                    if last_status != status:
+                        print(status)
+                        count = 0
+                    if count == 40:
+                        count = 0
+                        print()
+                    print('.', end='')
+                elapsed = time.perf_counter() - t0
+                if elapsed > max_wait_sec:
+                    raise RuntimeError(
+                        f'Computation has exceeded desired wait period of {max_wait_sec} sec.')
+                last_status = status
+                time.sleep(sleep_time_sec)
+                status = self.check_status()
+                self._emit_status(status, last_status)
+            self._events.emit(EventType.RUN_FINISHED, uuid=self._job_uuid, state=status)
+        finally:
+            self._events.flush()
+        return status
 
     def get_results(self, force_update=True):
         if force_update or self._results is None:
@@ -310,6 +367,16 @@ class MonteCarloResults(ApsResults):
             str: The ephemeris content, as a string.
         """
 
+        file_paths = self._get_ephemeris_file_paths(run_index, orbit_event_type, force_update)
+        responses = [r for r in [requests.get(f) for f in file_paths] if r.status_code != 404]
+        # There should just be 1 successful response (assuming the orbit_event_type and run_index
+        # are correct)
+        if responses and responses[0].status_code < 300:
+            return responses[0].text
+        resp_tuples = [(r.status_code, r.text) for r in responses]
+        raise RuntimeError(f'There was a problem getting the ephemeris.\n{resp_tuples}')
+
+    def _get_ephemeris_file_paths(self, run_index, orbit_event_type, force_update):
         self._update_results(force_update)
         file_prefix = (f"{self._detailedOutputs['jobOutputPath']}"
                        f"/{self._detailedOutputs['ephemeridesDirectoryPrefix']}")
@@ -324,12 +391,43 @@ class MonteCarloResults(ApsResults):
             file_paths.append(f"{file_prefix}/{OrbitEventType.IMPACT.value}/{eph_name}")
         else:
             file_paths.append(f"{file_prefix}/{orbit_event_type.value}/{eph_name}")
-        responses = [r for r in [requests.get(f) for f in file_paths] if r.status_code != 404]
-        # There should just be 1 successful response (assuming the orbit_event_type and run_index
-        # are correct)
-        if responses and responses[0].status_code < 300:
-            return responses[0].text
-        resp_tuples = [(r.status_code, r.text) for r in responses]
+        return file_paths
+
+    def get_ephemeris_end_state(self, run_index: int,
+                                orbit_event_type: Optional[OrbitEventType] = None,
+                                force_update: bool = False,
+                                tail_bytes: int = 4096) -> Optional[List[float]]:
+        """Retrieves only the last state of an ephemeris.
+
+        Where the file server supports it, only the tail of the file is fetched with an HTTP
+        Range request, and only its last data row is parsed. The tail is grown if it holds
+        no complete data row. Servers that ignore the Range header return the whole file,
+        which is then scanned from the end in the same way.
+
+        Args:
+            run_index (int): The run number of the ephemeris
+            orbit_event_type (Optional[OrbitEventType]): The OrbitEventType of the ephemeris
+            force_update (bool): Whether the results should be reloaded from the server
+            tail_bytes (int): Size of the first tail requested.
+
+        Returns:
+            list (float): the last state vector [rx, ry, rz, vx, vy, vz] in [km, km/s], or
+            None if the ephemeris holds no states.
+        """
+        file_paths = self._get_ephemeris_file_paths(run_index, orbit_event_type, force_update)
+        resp_tuples = []
+        for f in file_paths:
+            while True:
+                response = requests.get(f, headers={'Range': f'bytes=-{tail_bytes}'})
+                if response.status_code >= 300:
+                    if response.status_code != 404:
+                        resp_tuples.append((response.status_code, response.text))
+                    break
+                complete = _holds_whole_file(response, tail_bytes)
+                state = _parse_end_state(response.text, complete=complete)
+                if state is not None or complete:
+                    return state
+                tail_bytes *= 4
         raise RuntimeError(f'There was a problem getting the ephemeris.\n{resp_tuples}')
 
     def get_ephemeris_as_dataframe(self, run_index: int,
@@ -411,6 +509,36 @@ class MonteCarloResults(ApsResults):
                 'runIndex')
         return pd.DataFrame()
 
+    def get_final_states(self, force_update: bool = False) -> np.ndarray:
+        """Retrieves the final state of every run of the job, from its MISS and IMPACT
+        states files, and from its CLOSE_APPROACH states file for the runs stopped at a
+        close approach (see stopOnCloseApproach of PropagationParams).
+
+        Args:
+            force_update (bool): Whether the results should be reloaded from the server
+
+        Returns:
+            numpy.ndarray: (N, 6) final state vectors [rx, ry, rz, vx, vy, vz] in
+            [km, km/s], in the order of the run indices.
+
+        Raises:
+            RuntimeError if the final state of some run is missing.
+        """
+        # Runs that went on after a close approach also end in a MISS or IMPACT, whose
+        # state takes precedence: it comes first, and the sort keeps that order.
+        frames = [self.get_states_dataframe(orbit_event_type, force_update)
+                  for orbit_event_type in (OrbitEventType.MISS, OrbitEventType.IMPACT,
+                                           OrbitEventType.CLOSE_APPROACH)]
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return np.empty((0, 6))
+        states = pd.concat(frames).sort_index(kind='stable')
+        states = states[~states.index.duplicated()]
+        if not np.array_equal(states.index.values, np.arange(len(states))):
+            missing = sorted(set(range(states.index.max() + 1)) - set(states.index.values))
+            raise RuntimeError(f'Final states of runs {missing} are missing.')
+        return states[['x', 'y', 'z', 'xdot', 'ydot', 'zdot']].values * M2KM
+
     def _update_results(self, force_update):
         if force_update or self._detailedOutputs is None:
             results = self.get_results()
@@ -2,13 +2,25 @@
     batch_run_manager.py
 """
 
+from adam.adaptive_submitter import AdaptiveSubmitter
+from adam.batch import Batch
+from adam.batch import StateSummary
+from adam.events import EventDispatcher
+from adam.events import EventType
+from adam.run_manifest import RunManifest
+from adam.run_manifest import hash_params
+from adam.status_table import StatusTable
 from adam.timer import Timer
 
 from enum import Enum
-import copy
+import itertools
 import threading
 from multiprocessing.dummy import Pool as ThreadPool
 
+# Bytes of a batch creation request besides the OPM content: the OPM's version and
+# creation date lines, and the other fields of the request.
+_REQUEST_OVERHEAD_BYTES = 320
+
 
 class State(Enum):
     INITIALIZED = 1
@@ -23,32 +35,59 @@ class BatchRunManager(object):
     propagation, and retrieving their results.
 
     WARNING: this module is not thread-safe. The only supported simultaneous operation
-    is calling get_latest_statuses() while a call to run() is ongoing.
+    is calling get_latest_statuses() or get_status_snapshot() while a call to run() is
+    ongoing.
     """
 
-    def __init__(self, batches_module, batch_runs, do_timing=True, multi_threaded=True):
+    def __init__(self, batches_module, batch_runs, do_timing=True, multi_threaded=True,
+                 manifest=None, submission_options=None, result_sink=None,
+                 max_in_flight=5000, project=None, retention=None,
+                 lazy_results=False, retry_policy=None, result_cache=None):
         """Sets up object that can manage the running and lifetime of the given batches.
 
         Args:
             batches_module (Batches): Object to use to communicate with server.
-            batch_runs (list<Batch2>): Batches to be run/managed.
+            batch_runs (list<Batch2>): Batches to be run/managed. If result_sink is given,
+                may instead be any iterable (e.g. a generator) of Batch objects or of
+                [PropagationParams, OpmParams] pairs.
             do_timing (boolean): If true, timing information will be printed for various
                 parts of batch lifetime (submission, running, results retrieval).
             multi_threaded (boolean): If true, operations that would benefit from
                 multithreading such as submission or results retrieval will be
                 multithreaded. Should generally be left true, but can be set to false if
                 a guaranteed particular ordering is necessary (e.g. for tests).
+            manifest (str or RunManifest): If given, the uuid, state and result retrieval
+                of every batch is appended to this on-disk manifest as the run
+                progresses, so that the run can be picked up again with resume().
+            submission_options (dict): Keyword arguments for the AdaptiveSubmitter used to
+                size and parallelize submission, e.g. target_latency_sec or max_threads.
+            result_sink (callable): If given, the manager runs in streaming mode: runs are
+                pulled from batch_runs only as capacity frees up, OPMs are generated per
+                submission chunk, and each finished run is passed to
+                result_sink(index, batch) with its state summary and results set, then
+                dropped. Memory use is then bounded by max_in_flight rather than by the
+                total number of runs.
+            max_in_flight (int): In streaming mode, the maximum number of runs submitted
+                but not yet handed to the sink.
+            project (str): In streaming mode, the project all runs belong to. Defaults to
+                the project of the first run.
+            retention (ResultRetention): How much of each result's ephemeris to keep, e.g.
+                ResultRetention.END_STATE when only end state vectors are needed. Defaults
+                to the batches module's default (the full ephemeris).
+            lazy_results (boolean): If true, only the final part of each result is
+                fetched while retrieving results; other parts are fetched when first
+                accessed. Enough for end states and final ephemerides.
+            retry_policy (RetryPolicy): If given, batches that fail are resubmitted within
+                the same run as the policy allows, instead of being treated as final.
+                Only the last attempt's results are retrieved.
+            result_cache (ResultCache): If given, batches whose results are in the cache
+                are not submitted, identical batches in the run are submitted only once,
+                and the results of completed batches are added to the cache. Results
+                fetched lazily are fetched in full when added. Not supported in
+                streaming mode.
         """
         self.batches_module = batches_module
 
-        # Store the batch runs and check that they all belong to the same project.
-        self.batch_runs = batch_runs
-        projects = set([b.get_propagation_params().get_project_uuid() for b in batch_runs])
-        if len(projects) != 1:
-            print("All batches must belong to the same project to use the batch run manager")
-            return
-        self.project = projects.pop()
-
         self.state = State.INITIALIZED
 
         self.do_timing = do_timing
@@ -56,73 +95,259 @@ class BatchRunManager(object):
             self.timer = Timer()
 
         self.multi_threaded = multi_threaded
+        self.submission_options = submission_options or {}
+
+        # Track the uuid and state of every run here, so that status can be retrieved
+        # while waiting for completion.
+        self.status_table = StatusTable()
+
+        # Progress events are delivered to subscribers on their own thread.
+        self.events = EventDispatcher()
+
+        self.manifest = RunManifest(manifest) if isinstance(manifest, str) else manifest
+        # Index of the manifest records of each run, by run index. Runs reattached by
+        # resume() keep their recorded index, so new runs never overwrite their records.
+        self._manifest_indices = {}
+        self._manifest_lock = threading.Lock()
+        self.retention = retention
+        self.lazy_results = lazy_results
+
+        # Number of submissions of runs that have been retried, by index.
+        self.retry_policy = retry_policy
+        self._attempts = {}
+
+        # Indices of runs answered from the result cache, and of runs sharing the
+        # submission of an identical run (index of the run they duplicate, by index).
+        self.result_cache = result_cache
+        self._cached = set()
+        self._duplicates = {}
+
+        self.result_sink = result_sink
+        if result_sink is not None:
+            if result_cache is not None:
+                raise ValueError("A result cache cannot be used in streaming mode.")
+            # Only runs in flight are held; finished runs are reduced to their row in the
+            # status table.
+            self.batch_runs = None
+            self._source = iter(batch_runs)
+            self._source_count = 0
+            self._in_flight = {}
+            self.max_in_flight = max_in_flight
+            self.project = project
+            return
 
-        # Cache the overall status here. Lock access so that state can be retrieved while
-        # waiting for completion.
-        self.cached_status = self._get_empty_cached_status()
-        self.status_lock = threading.Lock()
+        # Store the batch runs and check that they all belong to the same project.
+        self.batch_runs = batch_runs
+        self.status_table.append(len(batch_runs))
+        projects = set([b.get_propagation_params().get_project_uuid() for b in batch_runs])
+        if len(projects) != 1:
+            print("All batches must belong to the same project to use the batch run manager")
+            return
+        self.project = projects.pop()
 
     def __repr__(self):
+        if self._is_streaming():
+            return "Batch run manager [%s: %s batches streamed]" % (
+                self.state, self._source_count)
         return "Batch run manager [%s: %s batches]" % (self.state, len(self.batch_runs))
 
+    def _is_streaming(self):
+        return self.result_sink is not None
+
     def get_batch_runs(self):
         """ Retrieves the batch runs managed by this object. Not safe to call while
-            any other call is ongoing.
+            any other call is ongoing. Returns None in streaming mode, where finished
+            runs are not kept.
         """
         return self.batch_runs
 
+    def _get_run(self, i):
+        if self._is_streaming():
+            return self._in_flight[i]
+        return self.batch_runs[i]
+
     def get_latest_statuses(self):
-        """ Retrieves the latest state of all batches managed by this object.
-            Safe to call while a call to update_state(), wait_for_completion()
-            or run() is ongoing.
+        """ Retrieves the latest state of all batches managed by this object, as lists of
+            batch uuids by state. Safe to call while a call to update_state(),
+            wait_for_completion() or run() is ongoing.
         """
-        self.status_lock.acquire()
-        status = copy.deepcopy(self.cached_status)
-        self.status_lock.release()
-        return status
-
-    def _get_empty_cached_status(self):
-        return {
-            'PENDING': [],
-            'RUNNING': [],
-            'COMPLETED': [],
-            'FAILED': []}
-
-    def _update_cached_status(self):
-        status = self._get_empty_cached_status()
-        for b in self.batch_runs:
-            status[b.get_calc_state()].append(b.get_uuid())
+        return self.get_status_snapshot().as_dict()
 
-        self.status_lock.acquire()
-        self.cached_status = status
-        self.status_lock.release()
+    def get_status_snapshot(self):
+        """ Retrieves an immutable, versioned snapshot of the state of all batches managed
+            by this object, with counts by state available in O(1). Taking a snapshot
+            copies nothing, so it is cheap enough to call for every progress update, and
+            is safe to call while any other call is ongoing.
+        """
+        return self.status_table.get_snapshot()
 
-    def _submit(self):
-        if self.do_timing:
-            self.timer.start("Submitting %s runs." % (len(self.batch_runs)))
+    def subscribe(self, callback, event_types=None):
+        """ Registers a callback for progress events (see EventType): a batch was
+            submitted, changed state, failed or had its results fetched, or the whole run
+            finished. Callbacks run one at a time on a dedicated thread, never on the
+            threads talking to the server. All events of a run are delivered before
+            run() or resume() returns.
 
-        if not self.state == State.INITIALIZED:
-            print("Error: runs already submitted, cannot resubmit.")
-            self.timer.stop()
-            return
+        Args:
+            callback (callable): called with each Event.
+            event_types (list<EventType>): the event types to receive. Defaults to all.
+
+        Returns:
+            callable: the callback, which can be passed to unsubscribe().
+        """
+        return self.events.subscribe(callback, event_types)
+
+    def unsubscribe(self, callback):
+        self.events.unsubscribe(callback)
+
+    def _emit_state_changes(self, changes):
+        # changes: (index, previous state) of runs whose state just changed.
+        for i, previous in changes:
+            b = self._get_run(i)
+            self.events.emit(EventType.STATE_CHANGED, index=i, uuid=b.get_uuid(),
+                             state=b.get_calc_state(), previous_state=previous)
+            if b.get_calc_state() == 'FAILED':
+                self.events.emit(EventType.FAILED, index=i, uuid=b.get_uuid(),
+                                 state=b.get_calc_state())
+
+    def _get_failure_message(self, batch):
+        summary = batch.get_state_summary()
+        if summary.get_error() is not None:
+            return summary.get_error()
+        # Otherwise the errors are only recorded on the parts.
+        results = self.batches_module.get_propagation_results(summary)
+        if results is None:
+            return None
+        errors = [p.get_error() for p in results.get_parts()
+                  if p is not None and p.get_error() is not None]
+        return '\n'.join(errors) if len(errors) > 0 else None
+
+    def _retry_failed(self, indices):
+        """ Resubmits the failed runs at the given indices that the retry policy allows to
+            be retried. Returns the indices of the resubmitted runs.
+        """
+        if self.retry_policy is None or len(indices) == 0:
+            return []
+
+        retry = []
+        for i in indices:
+            error = None
+            if self.retry_policy.needs_error():
+                error = self._get_failure_message(self._get_run(i))
+            if self.retry_policy.should_retry(self._attempts.get(i, 1), error):
+                retry.append(i)
+        if len(retry) == 0:
+            return []
+
+        print("Resubmitting %s failed runs." % (len(retry)))
+        for i in retry:
+            self._attempts[i] = self._attempts.get(i, 1) + 1
+            # A retried duplicate gets a submission of its own.
+            self._duplicates.pop(i, None)
+        self._submit_runs(retry, self._new_submitter())
+        return retry
+
+    def get_attempts(self, index):
+        """ Returns how many times the run at the given index has been submitted. """
+        return self._attempts.get(index, 1)
+
+    def _finish_run(self):
+        self._fill_duplicates()
+        self.events.emit(EventType.RUN_FINISHED, state=self.state.name)
+        self.events.flush()
+        print(f"Run status: {self.state.name}")
+
+    def _update_status(self, indices):
+        """ Copies the uuid and state of the runs at the given indices to the status table. """
+        runs = [self._get_run(i) for i in indices]
+        self.status_table.update(indices, [b.get_uuid() for b in runs],
+                                 [b.get_calc_state() for b in runs])
 
-        # Batch runs are most efficient when submitted in a single call because of the
-        # overhead of authorization, connecting to the database, etc. The server takes
-        # ~20 seconds to submit 500 batch runs. We don't want to take more time than that
-        # because calls time out around 60 seconds.
-        submission_batch_size = 500
+    def _get_input_hash(self, batch):
+        return hash_params(batch.get_propagation_params(), batch.get_opm_params())
 
-        # Use as many threads as we have batches to submit, up to an arbitrary maximum
-        # of 10, which allows us to submit 5000 batches in parallel.
+    def _get_cache_key(self, batch):
+        retention = self.retention.name if self.retention is not None else None
+        return self.result_cache.key('batch_results', batch.get_propagation_params(),
+                                     batch.get_opm_params(), retention)
+
+    def _serve_from_cache(self, indices):
+        """ Sets the state summary and results of the runs at the given indices that are
+            in the result cache, and pairs up identical runs. Returns the indices of the
+            runs left to submit.
+        """
+        to_submit = []
+        first_by_key = {}
+        hits = []
+        for i in indices:
+            b = self._get_run(i)
+            key = self._get_cache_key(b)
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                b.set_state_summary(cached[0])
+                b.set_results(cached[1])
+                self._cached.add(i)
+                hits.append(i)
+            elif key in first_by_key:
+                self._duplicates[i] = first_by_key[key]
+            else:
+                first_by_key[key] = i
+                to_submit.append(i)
+
+        if len(hits) > 0 or len(self._duplicates) > 0:
+            print("%s runs served from the result cache, %s duplicate runs." %
+                  (len(hits), len(self._duplicates)))
+        self._record([{'i': i, 'hash': self._get_input_hash(self._get_run(i)),
+                       'uuid': self._get_run(i).get_uuid(), 'state': 'COMPLETED',
+                       'fetched': True} for i in hits])
+        self._update_status(hits)
+        return to_submit
+
+    def _copy_duplicate_summaries(self):
+        """ Gives duplicate runs the state summary of the run they duplicate. """
+        for i, original in self._duplicates.items():
+            self._get_run(i).set_state_summary(self._get_run(original).get_state_summary())
+        self._record([{'i': i, 'hash': self._get_input_hash(self._get_run(i)),
+                       'uuid': self._get_run(i).get_uuid(),
+                       'state': self._get_run(i).get_calc_state(), 'fetched': False}
+                      for i in self._duplicates])
+        self._update_status(list(self._duplicates))
+
+    def _fill_duplicates(self):
+        """ Gives duplicate runs the results of the run they duplicate. """
+        for i, original in self._duplicates.items():
+            b = self._get_run(i)
+            b.set_results(self._get_run(original).get_results())
+            self._record([{'i': i, 'fetched': True}])
+            self.events.emit(EventType.RESULT_FETCHED, index=i, uuid=b.get_uuid(),
+                             state=b.get_calc_state())
+
+    def _record(self, entries):
+        if self.manifest is not None:
+            self.manifest.record([dict(e, i=self._get_manifest_index(e['i']))
+                                  for e in entries])
+
+    def _get_manifest_index(self, i):
+        with self._manifest_lock:
+            if i not in self._manifest_indices:
+                self._manifest_indices[i] = self.manifest.reserve_index(i)
+            return self._manifest_indices[i]
+
+    def _new_submitter(self):
+        # Batch runs are most efficient when submitted in as few calls as possible because
+        # of the overhead of authorization, connecting to the database, etc. However, calls
+        # time out around 60 seconds, and how many batches fit in that depends on their
+        # size and on server load, so chunk sizes and concurrency are adapted as we go.
         if self.multi_threaded:
-            num_batches = round(len(self.batch_runs) / submission_batch_size) + 1
-            threads = min(num_batches, 10)
-        else:
-            threads = 1
+            return AdaptiveSubmitter(**self.submission_options)
+        options = dict(self.submission_options)
+        options.update({'initial_threads': 1, 'max_threads': 1})
+        return AdaptiveSubmitter(**options)
 
-        def _submit_batches(i):
+    def _submit_runs(self, indices, submitter):
+        def _submit_batches(chunk):
             # Grab all the creation parameters from the batch objects.
-            runs = self.batch_runs[i:i+submission_batch_size]
+            runs = [self._get_run(j) for j in chunk]
             params = [[b.get_propagation_params(), b.get_opm_params()] for b in runs]
 
             # Call to the server to create the batches.
@@ -130,18 +355,43 @@ class BatchRunManager(object):
 
             # Update the batches with the resulting state summaries.
             for summary_i in range(len(summaries)):
-                self.batch_runs[i + summary_i].set_state_summary(summaries[summary_i])
+                runs[summary_i].set_state_summary(summaries[summary_i])
+
+            self._record([{'i': j, 'hash': self._get_input_hash(b), 'uuid': b.get_uuid(),
+                           'state': b.get_calc_state(), 'fetched': False}
+                          for j, b in zip(chunk, runs)])
+            self._update_status(chunk)
+            for j, b in zip(chunk, runs):
+                self.events.emit(EventType.SUBMITTED, index=j, uuid=b.get_uuid(),
+                                 state=b.get_calc_state())
+            return summaries
+
+        def _payload_size(i):
+            # The OPM dominates the size of each batch creation request. Its content is
+            # memoized, whereas generate_opm() would render it again with a fresh header.
+            return (len(self._get_run(i).get_opm_params().generate_opm_content()) +
+                    _REQUEST_OVERHEAD_BYTES)
+
+        submitter.submit(indices, _submit_batches, item_size=_payload_size)
+
+    def _submit(self, indices=None):
+        """ Submits the batch runs at the given indices (by default, all of them). """
+        if indices is None:
+            indices = list(range(len(self.batch_runs)))
 
-        pool = ThreadPool(threads)
-        # Break up the batches into chunks and submit them in chunks. For fewer than
-        # <submission_batch_size> runs, this just submits them all in one request on one
-        # thread.
-        pool.map(_submit_batches,
-                 [i for i in range(0, len(self.batch_runs), submission_batch_size)])
-        pool.close()
-        pool.join()
+        if self.do_timing:
+            self.timer.start("Submitting %s runs." % (len(indices)))
+
+        if not self.state == State.INITIALIZED:
+            print("Error: runs already submitted, cannot resubmit.")
+            self.timer.stop()
+            return
+
+        if self.result_cache is not None:
+            indices = self._serve_from_cache(indices)
 
-        self._update_cached_status()
+        self._submit_runs(indices, self._new_submitter())
+        self._copy_duplicate_summaries()
 
         if self.do_timing:
             self.timer.stop()
@@ -160,11 +410,26 @@ class BatchRunManager(object):
             # No update is necessary, since nothing changes once the state is COMPLETED.
             return
 
-        # First, update the status of all batches.
-        summaries_by_uuid = self.batches_module.get_summaries(self.project)
-
-        for batch in self.batch_runs:
+        # First, update the status of all batches, except those from the result cache.
+        summaries_by_uuid = {}
+        if len(self._cached) < len(self.batch_runs):
+            summaries_by_uuid = self.batches_module.get_summaries(self.project)
+
+        changes = []
+        previous_states = []
+        for i, batch in enumerate(self.batch_runs):
+            if i in self._cached:
+                continue
+            previous_state = batch.get_calc_state()
             batch.set_state_summary(summaries_by_uuid[batch.get_uuid()])
+            if batch.get_calc_state() != previous_state:
+                changes.append({'i': i, 'state': batch.get_calc_state()})
+                previous_states.append((i, previous_state))
+        self._record(changes)
+        self._update_status([c['i'] for c in changes])
+        self._emit_state_changes(previous_states)
+
+        self._retry_failed([c['i'] for c in changes if c['state'] == 'FAILED'])
 
         # Then, if the state of this whole batch should be updated, do that.
         complete = True
@@ -175,8 +440,6 @@ class BatchRunManager(object):
         if complete:
             self.state = State.COMPLETED
 
-        self._update_cached_status()
-
     def _wait_for_completion(self):
         """ Waits for the completion of all the batches managed by this object. When this
             returns, all managed batches are guaranteed to be in a final state
@@ -191,29 +454,253 @@ class BatchRunManager(object):
         if self.do_timing:
             self.timer.stop()
 
-    def _get_results(self):
+    def _get_results(self, indices=None):
+        """ Retrieves results for the batch runs at the given indices (by default, all
+            of them).
+        """
+        if indices is None:
+            indices = list(range(len(self.batch_runs)))
+
         if self.do_timing:
             self.timer.start("Retrieving propagation results.")
 
-        def _get_results(i):
-            b = self.batch_runs[i]
-            results = self.batches_module.get_propagation_results(b.get_state_summary())
+        self._fetch_results(indices)
+
+        if self.do_timing:
+            self.timer.stop()
+
+    def _results_kwargs(self):
+        # Only pass options that were asked for, so that any batches module with the
+        # basic get_propagation_results(state_summary) signature can be used.
+        kwargs = {}
+        if self.retention is not None:
+            kwargs['retention'] = self.retention
+        if self.lazy_results:
+            kwargs['lazy'] = True
+        return kwargs
+
+    def _fetch_result(self, i, on_fetched=None):
+        """ Retrieves results for the batch run at the given index. """
+        if i in self._duplicates:
+            # Filled in from the run it duplicates once all results are in.
+            return
+        b = self._get_run(i)
+        if i not in self._cached:
+            results = self.batches_module.get_propagation_results(
+                b.get_state_summary(), **self._results_kwargs())
             b.set_results(results)
+            if self.result_cache is not None and b.get_calc_state() == 'COMPLETED' and \
+                    results is not None:
+                self.result_cache.put(self._get_cache_key(b), (b.get_state_summary(), results))
+        if b.get_results() is not None:
+            # Otherwise a later resume should try again.
+            self._record([{'i': i, 'fetched': True}])
+        self.events.emit(EventType.RESULT_FETCHED, index=i, uuid=b.get_uuid(),
+                         state=b.get_calc_state())
+        if on_fetched is not None:
+            on_fetched(i, b)
+
+    def _fetch_results(self, indices, on_fetched=None):
+        def _get_results(i):
+            self._fetch_result(i, on_fetched)
 
         if self.multi_threaded:
             threads = 5
         else:
             threads = 1
         pool = ThreadPool(threads)
-        pool.map(_get_results, [i for i in range(len(self.batch_runs))])
+        pool.map(_get_results, indices)
         pool.close()
         pool.join()
 
-        if self.do_timing:
-            self.timer.stop()
-
     def run(self):
+        if self._is_streaming():
+            self._run_streaming()
+            self._finish_run()
+            return
         self._submit()
         self._wait_for_completion()
         self._get_results()
-        print(f"Run status: {self.state.name}")
+        self._finish_run()
+
+    def _pull_from_source(self, count):
+        """ Takes up to count more runs from the source iterable into the in-flight set.
+            Returns their indices.
+        """
+        indices = []
+        for item in itertools.islice(self._source, count):
+            b = item if isinstance(item, Batch) else Batch(item[0], item[1])
+            project = b.get_propagation_params().get_project_uuid()
+            if self.project is None:
+                self.project = project
+            elif project != self.project:
+                raise ValueError("All batches must belong to the same project to use the "
+                                 "batch run manager, got %s and %s" % (self.project, project))
+            self._in_flight[self._source_count] = b
+            indices.append(self._source_count)
+            self._source_count += 1
+        self.status_table.append(len(indices))
+        return indices
+
+    def _update_streaming_state(self):
+        """ Polls the state of the runs in flight, and hands finished runs to the sink. """
+        summaries_by_uuid = self.batches_module.get_summaries(self.project)
+
+        changes = []
+        previous_states = []
+        finished = []
+        for i, batch in list(self._in_flight.items()):
+            previous_state = batch.get_calc_state()
+            batch.set_state_summary(summaries_by_uuid[batch.get_uuid()])
+            if batch.get_calc_state() != previous_state:
+                changes.append({'i': i, 'state': batch.get_calc_state()})
+                previous_states.append((i, previous_state))
+            if batch.get_calc_state() in ['COMPLETED', 'FAILED']:
+                finished.append(i)
+        self._record(changes)
+        self._update_status([c['i'] for c in changes])
+        self._emit_state_changes(previous_states)
+
+        retried = set(self._retry_failed([c['i'] for c in changes if c['state'] == 'FAILED']))
+        finished = [i for i in finished if i not in retried]
+
+        sink_lock = threading.Lock()
+
+        def _hand_off(i, b):
+            # The sink is called from one thread at a time, so it need not be thread-safe.
+            with sink_lock:
+                self.result_sink(i, b)
+                del self._in_flight[i]
+                self._attempts.pop(i, None)
+
+        self._fetch_results(finished, on_fetched=_hand_off)
+
+    def _run_streaming(self):
+        if self.do_timing:
+            self.timer.start("Streaming runs.")
+
+        if not self.state == State.INITIALIZED:
+            print("Error: runs already submitted, cannot resubmit.")
+            if self.do_timing:
+                self.timer.stop()
+            return
+
+        # One submitter for the whole run, so what it learns about the server carries over
+        # from one round of submissions to the next.
+        submitter = self._new_submitter()
+        exhausted = False
+        while not exhausted or len(self._in_flight) > 0:
+            if not exhausted:
+                capacity = self.max_in_flight - len(self._in_flight)
+                indices = self._pull_from_source(capacity)
+                exhausted = len(indices) < capacity
+                if len(indices) > 0:
+                    self._submit_runs(indices, submitter)
+                    self.state = State.SUBMITTED
+            if len(self._in_flight) > 0:
+                self._update_streaming_state()
+
+        self.state = State.COMPLETED
+
+        if self.do_timing:
+            self.timer.stop()
+
+    def _refresh_reattached(self, indices):
+        """ Replaces the summaries rebuilt from the manifest for the runs at the given
+            indices with their current ones from the server, which also hold the parts
+            counts needed to retrieve results. Returns the indices of the runs whose
+            batches no longer exist, which need submitting again.
+        """
+        if not indices:
+            return []
+        if self.project is not None:
+            summaries = self.batches_module.get_summaries(self.project)
+        else:
+            summaries = {}
+            for i in indices:
+                summary = self.batches_module.get_summary(self._get_run(i).get_uuid())
+                if summary is not None:
+                    summaries[summary.get_uuid()] = summary
+
+        gone = []
+        changes = []
+        for i in indices:
+            b = self._get_run(i)
+            summary = summaries.get(b.get_uuid())
+            if summary is None:
+                print("Batch %s of run %s no longer exists; submitting it again." %
+                      (b.get_uuid(), i))
+                b.set_state_summary(None)
+                gone.append(i)
+                continue
+            if summary.get_calc_state() != b.get_calc_state():
+                changes.append({'i': i, 'state': summary.get_calc_state()})
+            b.set_state_summary(summary)
+        self._record(changes)
+        return gone
+
+    def resume(self, manifest=None, skip_fetched=False):
+        """ Picks up a run recorded in a manifest, e.g. after the process that started
+            it died. The managed batch runs should be rebuilt from the same inputs as the
+            original run; they are matched to the recorded batches by input hash. Matched
+            batches are reattached to their server-side uuids, batches never submitted
+            are submitted, and the run then continues as with run().
+
+            Only batches that are not already holding results are retrieved.
+
+        Args:
+            manifest (str or RunManifest): The manifest of the run to resume. Defaults to
+                the manifest this manager was constructed with.
+            skip_fetched (boolean): If true, also skip retrieving results for batches the
+                manifest records as already fetched, e.g. if the caller persisted them.
+        """
+        if self._is_streaming():
+            raise ValueError("Streaming runs cannot be resumed.")
+        if manifest is not None:
+            self.manifest = RunManifest(manifest) if isinstance(manifest, str) else manifest
+            self._manifest_indices = {}
+        if self.manifest is None:
+            raise ValueError("A manifest is required to resume a run.")
+
+        if not self.state == State.INITIALIZED:
+            print("Error: runs already submitted, cannot resume.")
+            return
+
+        hashes = [self._get_input_hash(b) for b in self.batch_runs]
+        records = self.manifest.match(hashes)
+
+        # Reattach what was submitted before. The order of the runs may have changed, so
+        # each keeps the records it matched, and new runs get records of their own.
+        unsubmitted = []
+        fetched = set()
+        entries = []
+        for i, (b, h, record) in enumerate(zip(self.batch_runs, hashes, records)):
+            if record is None:
+                unsubmitted.append(i)
+                continue
+            self._manifest_indices[i] = record['i']
+            b.set_state_summary(StateSummary({'uuid': record['uuid'],
+                                              'calc_state': record['state']}))
+            if record['fetched']:
+                fetched.add(i)
+            entries.append({'i': i, 'hash': h, 'uuid': record['uuid'],
+                            'state': record['state'], 'fetched': record['fetched']})
+        self._record(entries)
+        gone = self._refresh_reattached([e['i'] for e in entries])
+        unsubmitted += gone
+        fetched.difference_update(gone)
+        self._update_status([e['i'] for e in entries])
+
+        if len(unsubmitted) > 0:
+            self._submit(unsubmitted)
+        else:
+            # Nothing left to poll for if every batch was last seen in a final state.
+            final = all(b.get_calc_state() in ['COMPLETED', 'FAILED'] for b in self.batch_runs)
+            self.state = State.COMPLETED if final else State.SUBMITTED
+
+        self._wait_for_completion()
+
+        missing = [i for i, b in enumerate(self.batch_runs)
+                   if b.get_results() is None and not (skip_fetched and i in fetched)]
+        self._get_results(missing)
+        self._finish_run()
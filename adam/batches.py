@@ -4,30 +4,53 @@
 
 from adam.batch import StateSummary
 from adam.batch import PropagationResults
+from adam.batch import ResultRetention
+from adam.bulk_opm import BulkOpmGenerator
+from adam.errors import RequestTimeoutError
+
+from multiprocessing.dummy import Pool as ThreadPool
 
 # from tabulate import tabulate
 
 
 class Batches(object):
-    def __init__(self, rest):
+    # Request Timeout, and Gateway Timeout from the load balancer in front of the server.
+    TIMEOUT_CODES = (408, 504)
+
+    def __init__(self, rest, part_workers=8, result_cache=None):
+        """
+        Args:
+            rest (RestProxy): proxy used to communicate with the server.
+            part_workers (int): maximum number of parts of one batch fetched concurrently.
+            result_cache (ResultCache): if given, new_batches() reuses the batches created
+                for identical parameters instead of creating them again, whether they
+                were requested earlier (and are still in the cache) or in the same call.
+                Batches which have since failed or been deleted are created again.
+        """
         self._rest = rest
+        self._part_workers = part_workers
+        self._result_cache = result_cache
 
     def __repr__(self):
         return "Batches module"
 
-    def _build_batch_creation_data(self, propagation_params, opm_params):
+    def _build_propagation_data(self, propagation_params):
         data = {'start_time': propagation_params.get_start_time(),
                 'end_time': propagation_params.get_end_time(),
                 'step_duration_sec': propagation_params.get_step_size(),
                 'propagator_uuid': propagation_params.get_propagator_uuid(),
-                'project': propagation_params.get_project_uuid(),
-                'opm_string': opm_params.generate_opm()}
+                'project': propagation_params.get_project_uuid()}
 
         if propagation_params.get_description() is not None:
             data['description'] = propagation_params.get_description()
 
         return data
 
+    def _build_batch_creation_data(self, propagation_params, opm_params):
+        data = self._build_propagation_data(propagation_params)
+        data['opm_string'] = opm_params.generate_opm()
+        return data
+
     def new_batch(self, propagation_params, opm_params):
         data = self._build_batch_creation_data(propagation_params, opm_params)
 
@@ -39,22 +62,127 @@ class Batches(object):
         return StateSummary(response)
 
     def new_batches(self, param_pairs):
-        """ Expects a list of pairs of [propagation_params, opm_params].
+        """ Expects a list of pairs of [propagation_params, opm_params]. The opm_params may
+            also be RenderedOpms, as made by BulkOpmGenerator.generate().
             Returns a list of batch summaries for the submitted batches in the same order.
+            With a result cache, identical pairs share one summary, which may be that of
+            a batch created by an earlier call (as long as it has not failed or been
+            deleted since).
         """
+        if self._result_cache is not None:
+            return self._new_batches_cached(param_pairs)
+
         batch_dicts = []
         for pair in param_pairs:
             batch_dicts.append(self._build_batch_creation_data(pair[0], pair[1]))
 
+        return self._post_batches(batch_dicts)
+
+    def _new_batches_cached(self, param_pairs):
+        keys = [self._result_cache.key('batch', pair[0], pair[1]) for pair in param_pairs]
+
+        summaries_by_key = {}
+        cached = []
+        for key, pair in zip(keys, param_pairs):
+            if key in summaries_by_key:
+                continue
+            summaries_by_key[key] = self._result_cache.get(key)
+            if summaries_by_key[key] is not None:
+                cached.append((key, pair))
+
+        # Cached batches are only reused while they are usable: resubmitting a failed
+        # batch (e.g. to retry it) must create a new one.
+        current = self._get_current_summaries(
+            [(pair[0].get_project_uuid(), summaries_by_key[key]) for key, pair in cached])
+        for (key, _), summary in zip(cached, current):
+            if summary is None:
+                self._result_cache.delete(key)
+            summaries_by_key[key] = summary
+
+        to_create = []
+        created_keys = set()
+        for key, pair in zip(keys, param_pairs):
+            if summaries_by_key[key] is None and key not in created_keys:
+                created_keys.add(key)
+                to_create.append((key, pair))
+
+        if len(to_create) > 0:
+            created = self._post_batches(
+                [self._build_batch_creation_data(pair[0], pair[1]) for _, pair in to_create])
+            for (key, _), summary in zip(to_create, created):
+                summaries_by_key[key] = summary
+                self._result_cache.put(key, summary)
+
+        return [summaries_by_key[key] for key in keys]
+
+    def _get_current_summaries(self, project_summaries):
+        """Returns the current summaries of the given batches, listing each project's
+        batches once, or None for those which no longer exist or have failed.
+
+        Args:
+            project_summaries (list<tuple>): the project and summary of each batch.
+        """
+        listings = {}
+        current = []
+        for project, summary in project_summaries:
+            if project is None:
+                latest = self.get_summary(summary.get_uuid())
+            else:
+                if project not in listings:
+                    listings[project] = self.get_summaries(project)
+                latest = listings[project].get(summary.get_uuid())
+            if latest is None or latest.get_calc_state() == 'FAILED':
+                latest = None
+            current.append(latest)
+        return current
+
+    def new_batches_from_states(self, propagation_params, opm_template, states,
+                                covariances=None, maneuvers=None, processes=None):
+        """ Submits one batch per state vector, all sharing the given propagation
+            parameters and OPM template. The OPMs are rendered in bulk (see
+            BulkOpmGenerator), so this is much cheaper than building a pair of parameters
+            per state for new_batches.
+
+        Args:
+            propagation_params (PropagationParams): parameters shared by all batches.
+            opm_template (OpmParams): OPM parameters shared by all batches.
+            states (array-like): (N, 6) state vectors, one per batch.
+            covariances (array-like): optional (N, 21) cartesian covariances.
+            maneuvers (array-like): optional (N, 3) initial maneuvers.
+            processes (int): number of processes to render the OPMs with.
+
+        Returns:
+            list<StateSummary>: summaries of the submitted batches, in the order of the
+                states.
+        """
+        if self._result_cache is not None:
+            opms = BulkOpmGenerator(opm_template).generate(states, covariances, maneuvers,
+                                                           processes)
+            return self.new_batches([[propagation_params, opm] for opm in opms])
+
+        opms = BulkOpmGenerator(opm_template).render(states, covariances, maneuvers,
+                                                     processes)
+        propagation_data = self._build_propagation_data(propagation_params)
+        batch_dicts = []
+        for opm in opms:
+            data = dict(propagation_data)
+            data['opm_string'] = opm
+            batch_dicts.append(data)
+
+        return self._post_batches(batch_dicts)
+
+    def _post_batches(self, batch_dicts):
         code, response = self._rest.post('/batches', {'requests': batch_dicts})
 
-        # Check error code
+        # Check error code. Timeouts are distinguished so callers can retry with less.
+        if code in self.TIMEOUT_CODES:
+            raise RequestTimeoutError("Server status code: %s; Response: %s" % (code, response))
         if code != 200:
             raise RuntimeError("Server status code: %s; Response: %s" % (code, response))
 
-        if len(param_pairs) != len(response['requests']):
+        if len(batch_dicts) != len(response['requests']):
             raise RuntimeError("Expected %s results, only got %s" %
-                               (len(param_pairs), len(response['requests'])))
+                               (len(batch_dicts), len(response['requests'])))
 
         # Store response values
         summaries = []
@@ -110,16 +238,39 @@ class Batches(object):
 
         return part_json
 
-    def get_propagation_results(self, state_summary):
+    def _get_parts(self, state_summary, indices):
+        if len(indices) <= 1 or self._part_workers <= 1:
+            return [self._get_part(state_summary, i) for i in indices]
+
+        pool = ThreadPool(min(self._part_workers, len(indices)))
+        parts = pool.map(lambda i: self._get_part(state_summary, i), indices)
+        pool.close()
+        pool.join()
+        return parts
+
+    def get_propagation_results(self, state_summary, retention=ResultRetention.FULL,
+                                lazy=False):
         """ Returns a PropagationResults object with as many PropagationPart objects as
             the state summary  claims to have parts, or raises an error. Note that if
             state of given summary is not 'COMPLETED' or 'FAILED', not all parts are
             guaranteed to exist or to have an ephemeris.
+
+            The retention policy controls how much of each part's ephemeris is kept; see
+            ResultRetention.
+
+            If lazy is true, only the final part is fetched up front, which is all that
+            end states and the final ephemeris need. Other parts are fetched when first
+            accessed. Parts fetched together are fetched concurrently.
         """
         if state_summary.get_parts_count() is None or state_summary.get_parts_count() < 1:
             print("Unable to retrieve results for batch with no parts")
             return None
 
-        parts = [self._get_part(state_summary, i)
-                 for i in range(state_summary.get_parts_count())]
-        return PropagationResults(parts)
+        def load(indices):
+            return self._get_parts(state_summary, indices)
+
+        if lazy:
+            return PropagationResults.lazy(state_summary.get_parts_count(), load, retention)
+
+        parts = load(list(range(state_summary.get_parts_count())))
+        return PropagationResults(parts, retention)
@@ -0,0 +1,186 @@
+"""
+    bulk_opm.py
+"""
+
+from adam.opm_params import COVARIANCE_FORMAT
+from adam.opm_params import MANEUVER_DV_FORMAT
+from adam.opm_params import STATE_VECTOR_FORMAT
+from adam.opm_params import render_creation
+
+from datetime import datetime
+from multiprocessing import Pool
+
+import numpy as np
+
+
+class RenderedOpm(object):
+    """An OPM that has already been rendered to a string.
+
+    Stands in for OpmParams wherever only the OPM string (and the state vector it was
+    rendered from) is needed, e.g. in a Batch, so that bulk-generated OPMs are not
+    rendered again on submission.
+    """
+
+    def __init__(self, opm_content, creation_date, state_vector=None):
+        """
+        Args:
+            opm_content (str): the OPM in CCSDS format, without its version and creation
+                date lines (see OpmParams.generate_opm_content()).
+            creation_date (datetime): the creation date to stamp into the OPM.
+            state_vector (list): the state vector rendered into it, if any.
+        """
+        self._opm_content = opm_content
+        self._creation_date = creation_date
+        self._state_vector = state_vector
+
+    def __repr__(self):
+        return "RenderedOpm: %s" % self._opm_content
+
+    def get_state_vector(self):
+        return self._state_vector
+
+    def get_creation_date(self):
+        return self._creation_date
+
+    def generate_opm(self, creation_date=None):
+        return render_creation(creation_date or self._creation_date) + self._opm_content
+
+    def generate_opm_content(self):
+        return self._opm_content
+
+
+def _render_rows(generator, states, covariances, maneuvers):
+    # Module level so that it can be sent to worker processes.
+    return generator._render_rows(states, covariances, maneuvers)
+
+
+class BulkOpmGenerator(object):
+    """Generates many OPMs which differ from a template only by their state vectors
+    (and optionally their covariances and initial maneuvers).
+
+    The blocks of the OPM which are the same for every OPM (header, metadata, keplerian
+    elements, spacecraft parameters and, unless covariances are given, the covariance) are
+    rendered once, so producing each OPM only takes filling in its vectors. The OPMs are
+    identical to those generate_opm() would produce from copies of the template with the
+    vectors set, except that they all share one creation date.
+    """
+
+    def __init__(self, template, creation_date=None):
+        """
+        Args:
+            template (OpmParams): the parameters shared by all OPMs. Its state vector,
+                covariance and initial maneuver are used where no others are given.
+            creation_date (datetime): the creation date stamped into the OPMs. Defaults
+                to the time the generator is created.
+        """
+        self._template = template
+        self._creation_date = creation_date or datetime.utcnow()
+
+        self._creation = render_creation(self._creation_date)
+        self._metadata = template._render_metadata()
+        self._keplerian_and_spacecraft = (template._render_keplerian_elements() +
+                                          template._render_spacecraft())
+        self._covariance = template._render_covariance(template._covariance)
+        self._maneuver = template._render_maneuver(template._initial_maneuver)
+
+        # A keplerian covariance in the template replaces any cartesian covariance.
+        self._covariance_varies = template._keplerian_covariance is None
+        self._perturbation = template._render_perturbation()
+        self._maneuver_prefix = template._render_maneuver_prefix()
+
+    def __repr__(self):
+        return "BulkOpmGenerator [%s]" % self._creation_date
+
+    def get_template(self):
+        return self._template
+
+    def get_creation_date(self):
+        return self._creation_date
+
+    def _render_rows(self, states, covariances, maneuvers):
+        prefix = self._metadata
+        middle = self._keplerian_and_spacecraft
+        if covariances is None or not self._covariance_varies:
+            middle = middle + self._covariance
+            covariances = None
+        suffix = self._maneuver if maneuvers is None else ""
+
+        opms = []
+        for i in range(len(states)):
+            opm = prefix + (STATE_VECTOR_FORMAT % tuple(states[i])) + middle
+            if covariances is not None:
+                opm = opm + (COVARIANCE_FORMAT % tuple(covariances[i])) + self._perturbation
+            if maneuvers is not None:
+                opm = opm + self._maneuver_prefix + (MANEUVER_DV_FORMAT % tuple(maneuvers[i]))
+            opms.append(opm + suffix)
+        return opms
+
+    def render(self, states, covariances=None, maneuvers=None, processes=None):
+        """Renders one OPM per state vector.
+
+        Args:
+            states (array-like): (N, 6) state vectors [rx, ry, rz, vx, vy, vz].
+            covariances (array-like): optional (N, 21) lower triangular cartesian
+                covariances, one per state. Requires the template to give the
+                perturbation and hypercube.
+            maneuvers (array-like): optional (N, 3) initial maneuvers, one per state.
+            processes (int): if more than 1, the OPMs are rendered in chunks on a pool of
+                that many processes. Only worthwhile for very large N.
+
+        Returns:
+            list<str>: the N OPMs, in the order of the states.
+        """
+        contents = self.render_content(states, covariances, maneuvers, processes)
+        return [self._creation + content for content in contents]
+
+    def render_content(self, states, covariances=None, maneuvers=None, processes=None):
+        """Like render(), but leaves out the version and creation date lines of the OPMs,
+        as OpmParams.generate_opm_content() does.
+
+        Returns:
+            list<str>: the N OPM contents, in the order of the states.
+        """
+        states = self._rows(states, 6, 'states')
+        n = len(states)
+        if covariances is not None:
+            covariances = self._rows(covariances, 21, 'covariances', n)
+        if maneuvers is not None:
+            maneuvers = self._rows(maneuvers, 3, 'maneuvers', n)
+
+        if processes is None or processes <= 1 or n < 2:
+            return self._render_rows(states, covariances, maneuvers)
+
+        chunk_size = (n + processes - 1) // processes
+        chunks = []
+        for start in range(0, n, chunk_size):
+            end = start + chunk_size
+            chunks.append((self, states[start:end],
+                           None if covariances is None else covariances[start:end],
+                           None if maneuvers is None else maneuvers[start:end]))
+        with Pool(processes) as pool:
+            rendered = pool.starmap(_render_rows, chunks)
+        return [content for chunk in rendered for content in chunk]
+
+    def generate(self, states, covariances=None, maneuvers=None, processes=None):
+        """Like render(), but returns RenderedOpm objects which can be used in place of
+        OpmParams, e.g. to create Batches.
+
+        Returns:
+            list<RenderedOpm>: the N OPMs, in the order of the states.
+        """
+        states = self._rows(states, 6, 'states')
+        contents = self.render_content(states, covariances, maneuvers, processes)
+        return [RenderedOpm(content, self._creation_date, state)
+                for content, state in zip(contents, states)]
+
+    @staticmethod
+    def _rows(values, width, name, count=None):
+        # Convert to lists of python floats, which format the same as the floats
+        # generate_opm() is usually given.
+        array = np.asarray(values, dtype=np.float64)
+        if array.ndim != 2 or array.shape[1] != width:
+            raise ValueError("Expected %s of shape (N, %s), got %s" %
+                             (name, width, array.shape))
+        if count is not None and array.shape[0] != count:
+            raise ValueError("Expected %s %s, got %s" % (count, name, array.shape[0]))
+        return array.tolist()
@@ -14,3 +14,8 @@ class CredentialsMissingError(Exception):
 class InvalidCredentialsError(Exception):
     """Error when the ADAM server is unable to validate the user's credentials"""
     pass
+
+
+class RequestTimeoutError(RuntimeError):
+    """Error when the ADAM server (or a gateway in front of it) timed out on a request"""
+    pass
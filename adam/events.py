@@ -0,0 +1,119 @@
+"""
+    events.py
+"""
+
+from enum import Enum
+import queue
+import threading
+
+
+class EventType(Enum):
+    """Kinds of progress events emitted by the run managers and job waiting."""
+    SUBMITTED = 'SUBMITTED'
+    STATE_CHANGED = 'STATE_CHANGED'
+    RESULT_FETCHED = 'RESULT_FETCHED'
+    FAILED = 'FAILED'
+    RUN_FINISHED = 'RUN_FINISHED'
+
+
+class Event(object):
+    """A progress event about one run (or, for RUN_FINISHED, about the whole run)."""
+
+    def __init__(self, event_type, index=None, uuid=None, state=None, previous_state=None):
+        self._event_type = event_type
+        self._index = index
+        self._uuid = uuid
+        self._state = state
+        self._previous_state = previous_state
+
+    def __repr__(self):
+        return "Event %s [%s, %s, %s]" % (self._event_type.name, self._index, self._uuid,
+                                          self._state)
+
+    def get_type(self):
+        return self._event_type
+
+    def get_index(self):
+        """Returns the index of the run in the manager's list, or None."""
+        return self._index
+
+    def get_uuid(self):
+        return self._uuid
+
+    def get_state(self):
+        """Returns the calculation state of the run (or of the job) after the event."""
+        return self._state
+
+    def get_previous_state(self):
+        """For STATE_CHANGED, returns the calculation state before the event."""
+        return self._previous_state
+
+
+class EventDispatcher(object):
+    """Delivers events to subscribers on a dedicated thread.
+
+    Emitting an event only puts it on a queue, so the threads doing the I/O (submission,
+    polling, results retrieval) are never held up by subscribers. Events are delivered
+    one at a time, in the order they were emitted, so subscribers need not be
+    thread-safe. When nobody is subscribed, emitting does nothing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def __repr__(self):
+        return "Event dispatcher [%s subscribers]" % len(self._subscribers)
+
+    def subscribe(self, callback, event_types=None):
+        """Registers a callback for events.
+
+        Args:
+            callback (callable): called with each Event. Exceptions raised by it are
+                printed and otherwise ignored.
+            event_types (list<EventType>): the event types to receive. Defaults to all.
+
+        Returns:
+            callable: the callback, which can be passed to unsubscribe().
+        """
+        types = None if event_types is None else frozenset(event_types)
+        with self._lock:
+            self._subscribers = self._subscribers + [(callback, types)]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._deliver, daemon=True)
+                self._thread.start()
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s[0] is not callback]
+
+    def has_subscribers(self):
+        return len(self._subscribers) > 0
+
+    def emit(self, event_type, **kwargs):
+        """Queues an event for delivery. See Event for the accepted arguments."""
+        if not self._subscribers:
+            return
+        self._queue.put(Event(event_type, **kwargs))
+
+    def flush(self):
+        """Blocks until every event emitted so far has been delivered."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def _deliver(self):
+        while True:
+            event = self._queue.get()
+            try:
+                for callback, types in self._subscribers:
+                    if types is not None and event.get_type() not in types:
+                        continue
+                    try:
+                        callback(event)
+                    except Exception as e:
+                        print("Event subscriber raised, ignoring: " + str(e))
+            finally:
+                self._queue.task_done()
@@ -9,14 +9,19 @@ from typing import List
 from dateutil import parser as dateparser
 
 from adam import Project, AuthenticatingRestProxy, RestRequests
+from adam.value_type import ValueType
 
 
-class Job(object):
+class Job(ValueType):
     """Job class.
 
-    An ADAM Project is the parent container of a computational run.
+    An ADAM Project is the parent container of a computational run. Jobs are immutable.
     """
 
+    __slots__ = ('_uuid', '_project_id', '_object_id', '_user_defined_id', '_description',
+                 '_job_type', '_input_json', '_submission_time', '_execution_start',
+                 '_completion_time', '_status')
+
     def __init__(self, uuid, project_id=None, object_id=None, user_defined_id=None,
                  description=None, job_type=None, input_json=None, submission_time=None,
                  execution_start=None, completion_time=None, status=None):
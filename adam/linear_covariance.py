@@ -0,0 +1,220 @@
+"""
+    linear_covariance.py
+"""
+
+import numpy as np
+
+from adam.stm_propagation_module import count_propagations
+
+# Indices of the 21 covariance values of an OPM (CX_X, CY_X, CY_Y, CZ_X, ...) in the
+# 6x6 matrix: the lower triangle, row by row.
+_LOWER_TRIANGLE = np.tril_indices(6)
+
+
+def covariance_from_lower_triangle(values):
+    """Builds symmetric covariance matrices from the lower triangular values of OPMs.
+
+    Args:
+        values (array-like): (..., 21) covariances in the order of the OPM keywords
+            CX_X, CY_X, CY_Y, CZ_X, ... CZ_DOT_Z_DOT.
+
+    Returns:
+        numpy.ndarray: (..., 6, 6) covariance matrices.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.shape[-1:] != (21,):
+        raise ValueError("Expected covariances of shape (..., 21), got %s" % (values.shape,))
+    matrices = np.zeros(values.shape[:-1] + (6, 6))
+    matrices[..., _LOWER_TRIANGLE[0], _LOWER_TRIANGLE[1]] = values
+    matrices[..., _LOWER_TRIANGLE[1], _LOWER_TRIANGLE[0]] = values
+    return matrices
+
+
+def lower_triangle_from_covariance(matrices):
+    """Inverse of covariance_from_lower_triangle().
+
+    Args:
+        matrices (array-like): (..., 6, 6) covariance matrices.
+
+    Returns:
+        numpy.ndarray: (..., 21) lower triangular values, in the order of the OPM keywords.
+    """
+    matrices = np.asarray(matrices, dtype=np.float64)
+    return matrices[..., _LOWER_TRIANGLE[0], _LOWER_TRIANGLE[1]]
+
+
+def propagate_covariance(stms, covariances):
+    """Propagates covariances linearly, P1 = STM P0 STM^T.
+
+    Args:
+        stms (array-like): (..., m, 6) state transition matrices.
+        covariances (array-like): (..., 6, 6) initial covariances.
+
+    Returns:
+        numpy.ndarray: (..., m, m) propagated covariances.
+    """
+    stms = np.asarray(stms, dtype=np.float64)
+    return stms @ np.asarray(covariances, dtype=np.float64) @ np.swapaxes(stms, -1, -2)
+
+
+def _square_root(covariances):
+    # Square roots L L^T = P from eigendecompositions rather than Cholesky factors, so
+    # that covariances which are only positive semi-definite are handled as well.
+    eigenvalues, eigenvectors = np.linalg.eigh(covariances)
+    return eigenvectors * np.sqrt(np.clip(eigenvalues, 0.0, None))[..., np.newaxis, :]
+
+
+def _sample(covariances, count, rng):
+    normal = rng.standard_normal(covariances.shape[:-2] + (count, 6))
+    return normal @ np.swapaxes(_square_root(covariances), -1, -2)
+
+
+def _without_uncertainty(opm_params):
+    # The propagations are of exactly the given states, so the server must not also
+    # perturb them by the covariance of the OPM.
+    return opm_params.replace(covariance=None, keplerian_covariance=None,
+                              perturbation=None, hypercube=None)
+
+
+class LinearCovarianceResults(object):
+    """Outcome of LinearCovariancePropagation.run() for K objects (or epochs)."""
+
+    def __init__(self, end_states, stms, covariances, linearity_errors=None,
+                 max_linearity_error=None):
+        self._end_states = end_states
+        self._stms = stms
+        self._covariances = covariances
+        self._linearity_errors = linearity_errors
+        self._max_linearity_error = max_linearity_error
+
+    def __repr__(self):
+        return "Linear covariance results [%s objects]" % len(self._end_states)
+
+    def get_end_states(self):
+        """ Returns the (K, 6) final states of the nominal propagations [km, km/s]. """
+        return self._end_states
+
+    def get_stms(self):
+        """ Returns the (K, 6, 6) state transition matrices. """
+        return self._stms
+
+    def get_covariances(self):
+        """ Returns the (K, 6, 6) propagated covariances. """
+        return self._covariances
+
+    def get_covariance_lower_triangles(self):
+        """ Returns the (K, 21) propagated covariances, as the lower triangular values
+            taken by OpmParams and BulkOpmGenerator.
+        """
+        return lower_triangle_from_covariance(self._covariances)
+
+    def get_linearity_errors(self):
+        """ Returns the (K,) largest difference, over the check draws of each object,
+            between the propagated deviation from the nominal end state and its linear
+            prediction, in standard deviations of the propagated covariance. None if
+            no draws were checked.
+        """
+        return self._linearity_errors
+
+    def is_linear(self):
+        """ Returns a (K,) boolean array telling for which objects the linear
+            approximation held for all the check draws, or None if none were checked.
+        """
+        if self._linearity_errors is None:
+            return None
+        return self._linearity_errors <= self._max_linearity_error
+
+
+class LinearCovariancePropagation(object):
+    """Propagates covariances through the STMs of the nominal propagations, at the cost
+    of count_propagations(6) propagations per object instead of the thousands of draws of
+    a Monte Carlo run. This is accurate only as long as the dynamics are close to linear
+    over the spread of the initial covariance, which can be checked by also propagating
+    a few draws from it and comparing them with the linear prediction.
+    """
+
+    def __init__(self, stm_module, check_draws=0, max_linearity_error=0.1, seed=None):
+        """
+        Args:
+            stm_module (StmPropagationModule): Module computing the STMs, which also runs
+                the check draws.
+            check_draws (int): Number of draws from each initial covariance propagated to
+                check the linearity of the dynamics. Checking is skipped if 0.
+            max_linearity_error (float): Largest error of the linear prediction of the
+                draws, in propagated standard deviations, for which the dynamics are
+                considered linear.
+            seed (int): Seed of the random draws, for reproducible checks.
+        """
+        self.stm_module = stm_module
+        self.check_draws = check_draws
+        self.max_linearity_error = max_linearity_error
+        self.rng = np.random.default_rng(seed)
+
+    def __repr__(self):
+        return "LinearCovariancePropagation"
+
+    def run(self, propagation_params, opm_params, covariances=None, scheme=None,
+            relative_step=None):
+        """ Propagates the covariances of many objects (or epochs) at once. The
+            propagations for the STMs and the check draws of all objects are run
+            together (see StmPropagationModule.run_stm_propagations()).
+
+            Args:
+                propagation_params (PropagationParams or list<PropagationParams>):
+                    Propagation-related parameters shared by all objects, or one per
+                    object.
+                opm_params (list<OpmParams>):
+                    OPM-related parameters, one per object, each including the nominal
+                    state vector.
+                covariances (array-like):
+                    (K, 21) lower triangular initial covariances. Defaults to the
+                    cartesian covariances of the OPM params.
+                scheme (DifferenceScheme):
+                    Finite difference scheme of the STMs. Defaults to the STM module's.
+                relative_step (float):
+                    Step of the finite differences. Defaults to the STM module's.
+
+            Returns:
+                LinearCovarianceResults: the propagated covariances.
+        """
+        if covariances is None:
+            if any(opm.get_covariance() is None for opm in opm_params):
+                raise ValueError("Cartesian covariances are required in every OPM params "
+                                 "unless covariances are given.")
+            covariances = [opm.get_covariance() for opm in opm_params]
+        initial_covariances = covariance_from_lower_triangle(covariances)
+        if len(initial_covariances) != len(opm_params):
+            raise ValueError("Expected %s covariances, got %s" %
+                             (len(opm_params), len(initial_covariances)))
+
+        scheme = scheme or self.stm_module.scheme
+        relative_step = relative_step or self.stm_module.relative_step
+        groups, steps = self.stm_module._build_stm_groups(
+            propagation_params, [_without_uncertainty(opm) for opm in opm_params], False,
+            scheme, relative_step)
+        size = count_propagations(6, scheme)
+
+        if self.check_draws:
+            deviations = _sample(initial_covariances, self.check_draws, self.rng)
+            groups = [(params, opm, np.vstack([xs, xs[0] + d]))
+                      for (params, opm, xs), d in zip(groups, deviations)]
+
+        outputs = np.array(self.stm_module._propagate_state_groups(groups), dtype=np.float64)
+        end_states = outputs[:, 0, :]
+        stms = self.stm_module._differentiate(outputs[:, :size, :], steps, scheme)
+        propagated = propagate_covariance(stms, initial_covariances)
+
+        linearity_errors = None
+        if self.check_draws:
+            predicted = deviations @ np.swapaxes(stms, -1, -2)
+            errors = np.abs(outputs[:, size:, :] - end_states[:, np.newaxis, :] - predicted)
+            sigmas = np.sqrt(np.clip(np.diagonal(propagated, axis1=-2, axis2=-1), 0.0, None))
+            # Components the covariance does not spread at all can't be judged in sigmas.
+            sigmas = np.where(sigmas > 0, sigmas, np.inf)[:, np.newaxis, :]
+            linearity_errors = np.max(errors / sigmas, axis=(1, 2))
+            for i in np.flatnonzero(linearity_errors > self.max_linearity_error):
+                print("Linear covariance propagation of object %s is off by %.3g sigma; "
+                      "consider a Monte Carlo run." % (i, linearity_errors[i]))
+
+        return LinearCovarianceResults(end_states, stms, propagated, linearity_errors,
+                                       self.max_linearity_error)
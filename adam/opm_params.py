@@ -2,10 +2,70 @@
     opm_params.py
 """
 
+from adam.value_type import ValueType
+from adam.value_type import _freeze
+
 from datetime import datetime
 
 
-class OpmParams(object):
+def _format_lines(keys):
+    return "".join("%s = %%s\n" % key for key in keys)
+
+
+# Keys of the lines of an OPM that are filled in from vectors, in element order.
+STATE_VECTOR_KEYS = ['X', 'Y', 'Z', 'X_DOT', 'Y_DOT', 'Z_DOT']
+COVARIANCE_KEYS = [
+    'CX_X', 'CY_X', 'CY_Y', 'CZ_X', 'CZ_Y', 'CZ_Z',
+    'CX_DOT_X', 'CX_DOT_Y', 'CX_DOT_Z', 'CX_DOT_X_DOT',
+    'CY_DOT_X', 'CY_DOT_Y', 'CY_DOT_Z', 'CY_DOT_X_DOT', 'CY_DOT_Y_DOT',
+    'CZ_DOT_X', 'CZ_DOT_Y', 'CZ_DOT_Z', 'CZ_DOT_X_DOT', 'CZ_DOT_Y_DOT', 'CZ_DOT_Z_DOT']
+KEPLERIAN_COVARIANCE_KEYS = [
+    'USER_DEFINED_CA_A', 'USER_DEFINED_CE_A', 'USER_DEFINED_CE_E',
+    'USER_DEFINED_CI_A', 'USER_DEFINED_CI_E', 'USER_DEFINED_CI_I',
+    'USER_DEFINED_CO_A', 'USER_DEFINED_CO_E', 'USER_DEFINED_CO_I', 'USER_DEFINED_CO_O',
+    'USER_DEFINED_CW_A', 'USER_DEFINED_CW_E', 'USER_DEFINED_CW_I', 'USER_DEFINED_CW_O',
+    'USER_DEFINED_CW_W']
+KEPLERIAN_MEAN_ANOMALY_COVARIANCE_KEYS = [
+    'USER_DEFINED_CM_A', 'USER_DEFINED_CM_E', 'USER_DEFINED_CM_I', 'USER_DEFINED_CM_O',
+    'USER_DEFINED_CM_W', 'USER_DEFINED_CM_M']
+KEPLERIAN_TRUE_ANOMALY_COVARIANCE_KEYS = [
+    'USER_DEFINED_CT_A', 'USER_DEFINED_CT_E', 'USER_DEFINED_CT_I', 'USER_DEFINED_CT_O',
+    'USER_DEFINED_CT_W', 'USER_DEFINED_CT_T']
+MANEUVER_DV_KEYS = ['MAN_DV_1', 'MAN_DV_2', 'MAN_DV_3']
+
+STATE_VECTOR_FORMAT = _format_lines(STATE_VECTOR_KEYS)
+COVARIANCE_FORMAT = _format_lines(COVARIANCE_KEYS)
+KEPLERIAN_COVARIANCE_FORMAT = _format_lines(KEPLERIAN_COVARIANCE_KEYS)
+KEPLERIAN_MEAN_ANOMALY_COVARIANCE_FORMAT = _format_lines(KEPLERIAN_MEAN_ANOMALY_COVARIANCE_KEYS)
+KEPLERIAN_TRUE_ANOMALY_COVARIANCE_FORMAT = _format_lines(KEPLERIAN_TRUE_ANOMALY_COVARIANCE_KEYS)
+MANEUVER_DV_FORMAT = _format_lines(MANEUVER_DV_KEYS)
+
+
+def _copy(value, kind):
+    return None if value is None else kind(value)
+
+
+def render_creation(creation_date):
+    """Renders the first lines of an OPM, which precede its content: the format version
+    and the given creation date."""
+    return "CCSDS_OPM_VERS = 2.0\n" + ("CREATION_DATE = %s\n" % creation_date)
+
+
+class OpmParams(ValueType):
+    """Parameters of an OPM. Immutable: use replace() to make variants, e.g. with
+    another state vector."""
+
+    __slots__ = ('_epoch', '_state_vector', '_keplerian_elements', '_originator',
+                 '_object_name', '_object_id', '_center_name', '_ref_frame', '_mass',
+                 '_solar_rad_area', '_solar_rad_coeff', '_drag_area', '_drag_coeff',
+                 '_covariance', '_keplerian_covariance', '_perturbation', '_hypercube',
+                 '_initial_maneuver', '_content')
+
+    # Memoized result of generate_opm_content().
+    _DERIVED_FIELDS = ('_content',)
+    _FROZEN_FIELDS = ('_state_vector', '_keplerian_elements', '_covariance',
+                      '_keplerian_covariance', '_initial_maneuver')
+
     @classmethod
     def fromJsonResponse(cls, response_opm):
         # Values in [] are guaranteed to be present. Values in .get() may be missing.
@@ -111,6 +171,7 @@ class OpmParams(object):
                     arg_of_pericenter_deg (float): Argument of pericenter (deg)
                     true_anomaly_deg (float): True anomaly (deg)
                     gm (float): Gravitational constant (km^3/s^2)
+                None (or omitting it) leaves the OPM with only the state vector.
             keplerian_covariance (list): lower triangular covariance matrix (21 elements)
 
             originator (str): responsible entity for run (default: 'ADAM_User')
@@ -158,16 +219,16 @@ class OpmParams(object):
 
         self._epoch = params['epoch']  # Required.
 
-        if 'state_vector' not in params and 'keplerian_elements' not in params:
+        if params.get('state_vector') is None and not params.get('keplerian_elements'):
             raise KeyError(
                 "Either state_vector or keplerian_elements must be provided.")
 
-        keplerian_params = params.get('keplerian_elements', [])
+        keplerian_params = params.get('keplerian_elements') or None
         if keplerian_params:
             self._check_keplerian_params(keplerian_params)
 
-        self._state_vector = params.get('state_vector')
-        self._keplerian_elements = keplerian_params
+        self._state_vector = _freeze(params.get('state_vector'))
+        self._keplerian_elements = _freeze(keplerian_params)
 
         self._originator = params.get('originator') or 'ADAM_User'
         self._object_name = params.get('object_name') or 'dummy'
@@ -182,176 +243,160 @@ class OpmParams(object):
         self._drag_area = params.get('drag_area') or 20.0
         self._drag_coeff = params.get('drag_coeff') or 2.2
 
-        self._covariance = params.get('covariance')
-        self._keplerian_covariance = params.get('keplerian_covariance')
+        self._covariance = _freeze(params.get('covariance'))
+        self._keplerian_covariance = _freeze(params.get('keplerian_covariance'))
         self._perturbation = params.get('perturbation')
         self._hypercube = params.get('hypercube')
 
-        self._initial_maneuver = params.get('initial_maneuver')
+        self._initial_maneuver = _freeze(params.get('initial_maneuver'))
 
     def __repr__(self):
-        return "OpmParams: %s" % self.generate_opm()
+        return "OpmParams: %s" % self.generate_opm_content()
+
+    # The getters return copies, which callers may modify without changing this instance.
 
     def get_state_vector(self):
-        return self._state_vector
+        return _copy(self._state_vector, list)
+
+    def get_covariance(self):
+        return _copy(self._covariance, list)
 
-    def set_state_vector(self, state_vector):
-        self._state_vector = state_vector
+    def get_keplerian_elements(self):
+        return _copy(self._keplerian_elements, dict)
+
+    def get_keplerian_covariance(self):
+        return _copy(self._keplerian_covariance, list)
+
+    def _check_replaced(self, changes):
+        if changes.get('keplerian_elements'):
+            self._check_keplerian_params(changes['keplerian_elements'])
+        if self._state_vector is None and not self._keplerian_elements:
+            raise KeyError(
+                "Either state_vector or keplerian_elements must be provided.")
 
-    def generate_opm(self):
+    def generate_opm(self, creation_date=None):
         """Generate an OPM string
 
         This function generates a single OPM string from defined parameters (CCSDS format)
 
         Args:
-            None
+            creation_date (datetime or str): the creation date to stamp into the OPM.
+                Defaults to the current time. Passing a fixed date makes the OPM
+                deterministic.
 
         Returns:
             OPM (str)
         """
+        if creation_date is None:
+            creation_date = datetime.utcnow()
+        return render_creation(creation_date) + self.generate_opm_content()
+
+    def generate_opm_content(self):
+        """Generate the OPM string without its version and creation date lines.
 
-        # State vector is required in the OPM even if keplerian elements are also given. However,
-        # in that case it will be ignored in favor of the keplerian elements so it is not required
-        # from the user. If no state vector is specified, use dummy values.
+        The result depends only on the parameters, so it is suitable for comparing,
+        hashing or caching OPMs. It is rendered once and then memoized.
+
+        Returns:
+            OPM content (str)
+        """
+        try:
+            return self._content
+        except AttributeError:
+            pass
+        # State vector is required in the OPM even if keplerian elements are also given.
+        # However, in that case it will be ignored in favor of the keplerian elements so
+        # it is not required from the user. If no state vector is specified, use dummy
+        # values.
         state_vector = self._state_vector or [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
-        base_opm = "CCSDS_OPM_VERS = 2.0\n" + \
-                   ("CREATION_DATE = %s\n" % datetime.utcnow()) + \
-                   ("ORIGINATOR = %s\n" % self._originator) + \
-                   "COMMENT Cartesian coordinate system\n" + \
-                   ("OBJECT_NAME = %s\n" % self._object_name) + \
-                   ("OBJECT_ID = %s\n" % self._object_id) + \
-                   ("CENTER_NAME = %s\n" % self._center_name) + \
-                   ("REF_FRAME = %s\n" % self._ref_frame) + \
-                   "TIME_SYSTEM = UTC\n" + \
-                   ("EPOCH = %s\n" % self._epoch) + \
-                   ("X = %s\n" % (state_vector[0])) + \
-                   ("Y = %s\n" % (state_vector[1])) + \
-                   ("Z = %s\n" % (state_vector[2])) + \
-                   ("X_DOT = %s\n" % (state_vector[3])) + \
-                   ("Y_DOT = %s\n" % (state_vector[4])) + \
-                   ("Z_DOT = %s\n" % (state_vector[5]))
-
-        keplerian_elements = ""
-        using_mean_anomaly = True
-        if self._keplerian_elements is not None:
-            if ('true_anomaly_deg') in self._keplerian_elements:
-                using_mean_anomaly = False
-                keplerian_elements = \
-                    ("SEMI_MAJOR_AXIS = %s\n" %
-                     (self._keplerian_elements['semi_major_axis_km'])) + \
-                    ("ECCENTRICITY = %s\n" % (self._keplerian_elements['eccentricity'])) + \
-                    ("INCLINATION = %s\n" % (self._keplerian_elements['inclination_deg'])) + \
-                    ("RA_OF_ASC_NODE = %s\n" %
-                     (self._keplerian_elements['ra_of_asc_node_deg'])) + \
-                    ("ARG_OF_PERICENTER = %s\n" %
-                     (self._keplerian_elements['arg_of_pericenter_deg'])) + \
-                    ("TRUE_ANOMALY = %s\n" % (self._keplerian_elements['true_anomaly_deg'])) + \
-                    ("GM = %s\n" % (self._keplerian_elements['gm']))
-            if ('mean_anomaly_deg') in self._keplerian_elements:
-                keplerian_elements = \
-                    ("SEMI_MAJOR_AXIS = %s\n" %
-                     (self._keplerian_elements['semi_major_axis_km'])) + \
-                    ("ECCENTRICITY = %s\n" % (self._keplerian_elements['eccentricity'])) + \
-                    ("INCLINATION = %s\n" % (self._keplerian_elements['inclination_deg'])) + \
-                    ("RA_OF_ASC_NODE = %s\n" %
-                     (self._keplerian_elements['ra_of_asc_node_deg'])) + \
-                    ("ARG_OF_PERICENTER = %s\n" %
-                     (self._keplerian_elements['arg_of_pericenter_deg'])) + \
-                    ("MEAN_ANOMALY = %s\n" % (self._keplerian_elements['mean_anomaly_deg'])) + \
-                    ("GM = %s\n" % (self._keplerian_elements['gm']))
-
-        spacecraft_params = \
-            ("MASS = %s\n" % self._mass) + \
+        content = (self._render_metadata() +
+                   (STATE_VECTOR_FORMAT % tuple(state_vector[0:6])) +
+                   self._render_keplerian_elements() +
+                   self._render_spacecraft() +
+                   self._render_covariance(self._covariance) +
+                   self._render_maneuver(self._initial_maneuver))
+        # Rendering twice (e.g. from two threads) gives the same result, so either may
+        # be kept.
+        object.__setattr__(self, '_content', content)
+        return content
+
+    # The blocks of the OPM, in the order generate_opm() puts them together. They are
+    # rendered separately so that bulk generation (see bulk_opm.py) can render the blocks
+    # which do not vary between OPMs once.
+
+    def _render_metadata(self):
+        """Renders the header and metadata after the creation date, up to and including
+        the state vector epoch."""
+        return ("ORIGINATOR = %s\n" % self._originator) + \
+            "COMMENT Cartesian coordinate system\n" + \
+            ("OBJECT_NAME = %s\n" % self._object_name) + \
+            ("OBJECT_ID = %s\n" % self._object_id) + \
+            ("CENTER_NAME = %s\n" % self._center_name) + \
+            ("REF_FRAME = %s\n" % self._ref_frame) + \
+            "TIME_SYSTEM = UTC\n" + \
+            ("EPOCH = %s\n" % self._epoch)
+
+    def _using_mean_anomaly(self):
+        return self._keplerian_elements is None or \
+            'true_anomaly_deg' not in self._keplerian_elements
+
+    def _render_keplerian_elements(self):
+        if self._keplerian_elements is None:
+            return ""
+        if 'true_anomaly_deg' in self._keplerian_elements:
+            anomaly = "TRUE_ANOMALY = %s\n" % (self._keplerian_elements['true_anomaly_deg'])
+        elif 'mean_anomaly_deg' in self._keplerian_elements:
+            anomaly = "MEAN_ANOMALY = %s\n" % (self._keplerian_elements['mean_anomaly_deg'])
+        else:
+            return ""
+        return ("SEMI_MAJOR_AXIS = %s\n" % (self._keplerian_elements['semi_major_axis_km'])) + \
+            ("ECCENTRICITY = %s\n" % (self._keplerian_elements['eccentricity'])) + \
+            ("INCLINATION = %s\n" % (self._keplerian_elements['inclination_deg'])) + \
+            ("RA_OF_ASC_NODE = %s\n" % (self._keplerian_elements['ra_of_asc_node_deg'])) + \
+            ("ARG_OF_PERICENTER = %s\n" %
+             (self._keplerian_elements['arg_of_pericenter_deg'])) + \
+            anomaly + \
+            ("GM = %s\n" % (self._keplerian_elements['gm']))
+
+    def _render_spacecraft(self):
+        return ("MASS = %s\n" % self._mass) + \
             ("SOLAR_RAD_AREA = %s\n" % self._solar_rad_area) + \
             ("SOLAR_RAD_COEFF = %s\n" % self._solar_rad_coeff) + \
             ("DRAG_AREA = %s\n" % self._drag_area) + \
             ("DRAG_COEFF = %s\n" % self._drag_coeff)
 
-        covariance = ""
-        if self._covariance is not None:
-            covariance = ("CX_X = %s\n" % (self._covariance[0])) + \
-                         ("CY_X = %s\n" % (self._covariance[1])) + \
-                         ("CY_Y = %s\n" % (self._covariance[2])) + \
-                         ("CZ_X = %s\n" % (self._covariance[3])) + \
-                         ("CZ_Y = %s\n" % (self._covariance[4])) + \
-                         ("CZ_Z = %s\n" % (self._covariance[5])) + \
-                         ("CX_DOT_X = %s\n" % (self._covariance[6])) + \
-                         ("CX_DOT_Y = %s\n" % (self._covariance[7])) + \
-                         ("CX_DOT_Z = %s\n" % (self._covariance[8])) + \
-                         ("CX_DOT_X_DOT = %s\n" % (self._covariance[9])) + \
-                         ("CY_DOT_X = %s\n" % (self._covariance[10])) + \
-                         ("CY_DOT_Y = %s\n" % (self._covariance[11])) + \
-                         ("CY_DOT_Z = %s\n" % (self._covariance[12])) + \
-                         ("CY_DOT_X_DOT = %s\n" % (self._covariance[13])) + \
-                         ("CY_DOT_Y_DOT = %s\n" % (self._covariance[14])) + \
-                         ("CZ_DOT_X = %s\n" % (self._covariance[15])) + \
-                         ("CZ_DOT_Y = %s\n" % (self._covariance[16])) + \
-                         ("CZ_DOT_Z = %s\n" % (self._covariance[17])) + \
-                         ("CZ_DOT_X_DOT = %s\n" % (self._covariance[18])) + \
-                         ("CZ_DOT_Y_DOT = %s\n" % (self._covariance[19])) + \
-                         ("CZ_DOT_Z_DOT = %s\n" % (self._covariance[20])) + \
-                         ("USER_DEFINED_ADAM_INITIAL_PERTURBATION = %s [sigma]\n" %
-                          self._perturbation) + \
-                         ("USER_DEFINED_ADAM_HYPERCUBE = %s\n" % self._hypercube)
-
-        maneuver = ""
-        if self._initial_maneuver is not None:
-            maneuver = ("MAN_EPOCH_IGNITION = %s\n" % (self._epoch)) + \
-                       ("MAN_DURATION = 0.0\n") + \
-                       ("MAN_DELTA_MASS = 0.0\n") + \
-                       ("MAN_REF_FRAME = TNW\n") + \
-                       ("MAN_DV_1 = %s\n" % (self._initial_maneuver[0])) + \
-                       ("MAN_DV_2 = %s\n" % (self._initial_maneuver[1])) + \
-                       ("MAN_DV_3 = %s\n" % (self._initial_maneuver[2]))
-
-        keplerian_covariance = ""
-        anomaly_angle_cov = ""
+    def _render_covariance(self, covariance):
+        """Renders the covariance block for the given cartesian covariance (21 elements).
+
+        A keplerian covariance takes the place of the cartesian one when both are given.
+        """
         if self._keplerian_covariance is not None:
-            if using_mean_anomaly:
-                anomaly_angle_cov = ("USER_DEFINED_CM_A = %s\n" % (
-                    self._keplerian_covariance[15])) + \
-                                    ("USER_DEFINED_CM_E = %s\n" % (
-                                        self._keplerian_covariance[16])) + \
-                                    ("USER_DEFINED_CM_I = %s\n" % (
-                                        self._keplerian_covariance[17])) + \
-                                    ("USER_DEFINED_CM_O = %s\n" % (
-                                        self._keplerian_covariance[18])) + \
-                                    ("USER_DEFINED_CM_W = %s\n" % (
-                                        self._keplerian_covariance[19])) + \
-                                    ("USER_DEFINED_CM_M = %s\n" % (self._keplerian_covariance[20]))
+            if self._using_mean_anomaly():
+                anomaly_format = KEPLERIAN_MEAN_ANOMALY_COVARIANCE_FORMAT
             else:
-                anomaly_angle_cov = ("USER_DEFINED_CT_A = %s\n" % (
-                    self._keplerian_covariance[15])) + \
-                                    ("USER_DEFINED_CT_E = %s\n" % (
-                                        self._keplerian_covariance[16])) + \
-                                    ("USER_DEFINED_CT_I = %s\n" % (
-                                        self._keplerian_covariance[17])) + \
-                                    ("USER_DEFINED_CT_O = %s\n" % (
-                                        self._keplerian_covariance[18])) + \
-                                    ("USER_DEFINED_CT_W = %s\n" % (
-                                        self._keplerian_covariance[19])) + \
-                                    ("USER_DEFINED_CT_T = %s\n" % (self._keplerian_covariance[20]))
-
-            covariance = \
-                ("USER_DEFINED_CA_A = %s\n" % (self._keplerian_covariance[0])) + \
-                ("USER_DEFINED_CE_A = %s\n" % (self._keplerian_covariance[1])) + \
-                ("USER_DEFINED_CE_E = %s\n" % (self._keplerian_covariance[2])) + \
-                ("USER_DEFINED_CI_A = %s\n" % (self._keplerian_covariance[3])) + \
-                ("USER_DEFINED_CI_E = %s\n" % (self._keplerian_covariance[4])) + \
-                ("USER_DEFINED_CI_I = %s\n" % (self._keplerian_covariance[5])) + \
-                ("USER_DEFINED_CO_A = %s\n" % (self._keplerian_covariance[6])) + \
-                ("USER_DEFINED_CO_E = %s\n" % (self._keplerian_covariance[7])) + \
-                ("USER_DEFINED_CO_I = %s\n" % (self._keplerian_covariance[8])) + \
-                ("USER_DEFINED_CO_O = %s\n" % (self._keplerian_covariance[9])) + \
-                ("USER_DEFINED_CW_A = %s\n" % (self._keplerian_covariance[10])) + \
-                ("USER_DEFINED_CW_E = %s\n" % (self._keplerian_covariance[11])) + \
-                ("USER_DEFINED_CW_I = %s\n" % (self._keplerian_covariance[12])) + \
-                ("USER_DEFINED_CW_O = %s\n" % (self._keplerian_covariance[13])) + \
-                ("USER_DEFINED_CW_W = %s\n" % (self._keplerian_covariance[14])) + \
-                anomaly_angle_cov
-
-        return (base_opm + keplerian_elements + spacecraft_params +
-                covariance + maneuver + keplerian_covariance)
+                anomaly_format = KEPLERIAN_TRUE_ANOMALY_COVARIANCE_FORMAT
+            return (KEPLERIAN_COVARIANCE_FORMAT + anomaly_format) % \
+                tuple(self._keplerian_covariance[0:21])
+        if covariance is None:
+            return ""
+        return (COVARIANCE_FORMAT % tuple(covariance[0:21])) + self._render_perturbation()
+
+    def _render_perturbation(self):
+        return ("USER_DEFINED_ADAM_INITIAL_PERTURBATION = %s [sigma]\n" %
+                self._perturbation) + \
+            ("USER_DEFINED_ADAM_HYPERCUBE = %s\n" % self._hypercube)
+
+    def _render_maneuver(self, maneuver):
+        """Renders the maneuver block for the given initial maneuver (3 elements)."""
+        if maneuver is None:
+            return ""
+        return self._render_maneuver_prefix() + (MANEUVER_DV_FORMAT % tuple(maneuver[0:3]))
+
+    def _render_maneuver_prefix(self):
+        return ("MAN_EPOCH_IGNITION = %s\n" % (self._epoch)) + \
+               ("MAN_DURATION = 0.0\n") + \
+               ("MAN_DELTA_MASS = 0.0\n") + \
+               ("MAN_REF_FRAME = TNW\n")
 
     def __check_params(self, allowed, actual):
         extra_items = []
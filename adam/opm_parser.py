@@ -0,0 +1,250 @@
+"""
+    opm_parser.py
+"""
+
+from adam.opm_params import COVARIANCE_KEYS
+from adam.opm_params import KEPLERIAN_COVARIANCE_KEYS
+from adam.opm_params import KEPLERIAN_MEAN_ANOMALY_COVARIANCE_KEYS
+from adam.opm_params import KEPLERIAN_TRUE_ANOMALY_COVARIANCE_KEYS
+from adam.opm_params import MANEUVER_DV_KEYS
+from adam.opm_params import OpmParams
+from adam.opm_params import STATE_VECTOR_KEYS
+
+from multiprocessing import Pool
+
+import numpy as np
+
+
+# OpmParams properties read from single lines of an OPM, by line key.
+_TEXT_FIELDS = {
+    'EPOCH': 'epoch',
+    'ORIGINATOR': 'originator',
+    'OBJECT_NAME': 'object_name',
+    'OBJECT_ID': 'object_id',
+    'CENTER_NAME': 'center_name',
+    'REF_FRAME': 'ref_frame',
+    'USER_DEFINED_ADAM_HYPERCUBE': 'hypercube',
+}
+_NUMBER_FIELDS = {
+    'MASS': 'mass',
+    'SOLAR_RAD_AREA': 'solar_rad_area',
+    'SOLAR_RAD_COEFF': 'solar_rad_coeff',
+    'DRAG_AREA': 'drag_area',
+    'DRAG_COEFF': 'drag_coeff',
+    'USER_DEFINED_ADAM_INITIAL_PERTURBATION': 'perturbation',
+}
+_KEPLERIAN_FIELDS = {
+    'SEMI_MAJOR_AXIS': 'semi_major_axis_km',
+    'ECCENTRICITY': 'eccentricity',
+    'INCLINATION': 'inclination_deg',
+    'RA_OF_ASC_NODE': 'ra_of_asc_node_deg',
+    'ARG_OF_PERICENTER': 'arg_of_pericenter_deg',
+    'TRUE_ANOMALY': 'true_anomaly_deg',
+    'MEAN_ANOMALY': 'mean_anomaly_deg',
+    'GM': 'gm',
+}
+
+
+def parse_kvn(text):
+    """Splits the KVN (keyword = value) text of an OPM into its values by keyword.
+
+    Lines without a keyword, e.g. comments and blank lines, are skipped, and units given
+    in square brackets after values are dropped.
+
+    Args:
+        text (str): the OPM.
+
+    Returns:
+        dict: the values, as strings, by keyword.
+
+    Raises:
+        ValueError if a keyword is repeated, e.g. in an OPM with several maneuvers, which
+        OpmParams cannot describe.
+    """
+    fields = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition('=')
+        if not sep or line.lstrip().startswith('COMMENT'):
+            continue
+        key = key.strip()
+        if key in fields:
+            if key.startswith('MAN_'):
+                raise ValueError("Only OPMs with a single maneuver are supported, "
+                                 "got repeated %s" % key)
+            raise ValueError("Repeated keyword %s in OPM" % key)
+        value = value.strip()
+        if value.endswith(']'):
+            value = value[:value.rfind('[')].rstrip()
+        fields[key] = value
+    return fields
+
+
+def _number(value):
+    # Integers are kept as such so that the OPM renders back exactly as it was read.
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _numbers(fields, keys):
+    if keys[0] not in fields:
+        return None
+    return [_number(fields[key]) for key in keys]
+
+
+def _check_supported(fields):
+    if 'CCSDS_OPM_VERS' not in fields:
+        raise ValueError("Not an OPM: missing CCSDS_OPM_VERS")
+    if fields.get('TIME_SYSTEM', 'UTC') != 'UTC':
+        raise ValueError("Only UTC OPMs are supported, got %s" % fields['TIME_SYSTEM'])
+    if 'MAN_DV_1' in fields:
+        # OpmParams can only describe an impulsive TNW maneuver at the state vector epoch.
+        if fields.get('MAN_EPOCH_IGNITION') != fields.get('EPOCH') or \
+                float(fields.get('MAN_DURATION', 0)) != 0 or \
+                float(fields.get('MAN_DELTA_MASS', 0)) != 0 or \
+                fields.get('MAN_REF_FRAME', 'TNW') != 'TNW':
+            raise ValueError("Only impulsive TNW maneuvers at the epoch are supported")
+
+
+def opm_params_from_fields(fields):
+    """Builds OpmParams from the values of an OPM, as returned by parse_kvn().
+
+    Raises:
+        ValueError if the OPM uses features OpmParams cannot describe.
+        KeyError if the OPM lacks required values (see OpmParams).
+    """
+    _check_supported(fields)
+
+    params = {}
+    for key, name in _TEXT_FIELDS.items():
+        if key in fields:
+            params[name] = fields[key]
+    for key, name in _NUMBER_FIELDS.items():
+        if key in fields:
+            params[name] = _number(fields[key])
+
+    state_vector = _numbers(fields, STATE_VECTOR_KEYS)
+    if state_vector is not None:
+        params['state_vector'] = state_vector
+
+    if 'SEMI_MAJOR_AXIS' in fields:
+        params['keplerian_elements'] = {name: _number(fields[key])
+                                        for key, name in _KEPLERIAN_FIELDS.items()
+                                        if key in fields}
+
+    covariance = _numbers(fields, COVARIANCE_KEYS)
+    if covariance is not None:
+        params['covariance'] = covariance
+
+    keplerian_covariance = _numbers(fields, KEPLERIAN_COVARIANCE_KEYS)
+    if keplerian_covariance is not None:
+        anomaly_keys = KEPLERIAN_MEAN_ANOMALY_COVARIANCE_KEYS
+        if KEPLERIAN_TRUE_ANOMALY_COVARIANCE_KEYS[0] in fields:
+            anomaly_keys = KEPLERIAN_TRUE_ANOMALY_COVARIANCE_KEYS
+        params['keplerian_covariance'] = keplerian_covariance + _numbers(fields, anomaly_keys)
+
+    maneuver = _numbers(fields, MANEUVER_DV_KEYS)
+    if maneuver is not None:
+        params['initial_maneuver'] = maneuver
+
+    return OpmParams(params)
+
+
+def parse_opm(text):
+    """Parses the KVN text of an OPM, e.g. as written by OpmParams.generate_opm().
+
+    Parsing the result of generate_opm() gives back equivalent OpmParams: generating
+    from them renders the same OPM (apart from the creation date).
+
+    Args:
+        text (str): the OPM.
+
+    Returns:
+        OpmParams: the parameters of the OPM.
+    """
+    return opm_params_from_fields(parse_kvn(text))
+
+
+def _nan_rows(count, width):
+    return np.full((count, width), np.nan)
+
+
+def parse_opm_arrays(texts):
+    """Parses many OPMs straight into arrays, without building OpmParams.
+
+    Args:
+        texts (iterable<str>): the OPMs.
+
+    Returns:
+        dict: with 'epochs', a list of the N epochs, and 'states' (N, 6),
+            'covariances' (N, 21) and 'maneuvers' (N, 3) arrays. Rows of OPMs which do
+            not give a state vector, cartesian covariance or maneuver are NaN.
+    """
+    field_lists = [parse_kvn(text) for text in texts]
+    return _fields_to_arrays(field_lists)
+
+
+def _fields_to_arrays(field_lists):
+    count = len(field_lists)
+    arrays = {'epochs': [], 'states': _nan_rows(count, 6),
+              'covariances': _nan_rows(count, 21), 'maneuvers': _nan_rows(count, 3)}
+    for i, fields in enumerate(field_lists):
+        _check_supported(fields)
+        arrays['epochs'].append(fields.get('EPOCH'))
+        for name, keys in (('states', STATE_VECTOR_KEYS), ('covariances', COVARIANCE_KEYS),
+                           ('maneuvers', MANEUVER_DV_KEYS)):
+            if keys[0] in fields:
+                arrays[name][i] = [float(fields[key]) for key in keys]
+    return arrays
+
+
+def _read_fields(path):
+    with open(path, 'r') as f:
+        return parse_kvn(f.read())
+
+
+def _read_opm(path):
+    return opm_params_from_fields(_read_fields(path))
+
+
+def _map_files(function, paths, processes, chunksize):
+    if processes is None or processes <= 1:
+        for path in paths:
+            yield function(path)
+        return
+    with Pool(processes) as pool:
+        for result in pool.imap(function, paths, chunksize):
+            yield result
+
+
+def iter_opm_files(paths, processes=None, chunksize=16):
+    """Parses OPM files, yielding their OpmParams in the order of the paths as they are
+    parsed. Only a bounded number of files is in memory at once, so this suits
+    directories of thousands of OPMs.
+
+    Args:
+        paths (iterable<str>): paths of the OPM files.
+        processes (int): if more than 1, the files are read and parsed on a pool of that
+            many processes.
+        chunksize (int): number of files handed to a process at a time.
+
+    Returns:
+        generator<OpmParams>: the parameters of each file, in order.
+    """
+    return _map_files(_read_opm, paths, processes, chunksize)
+
+
+def load_opm_arrays(paths, processes=None, chunksize=16):
+    """Parses OPM files into arrays, as parse_opm_arrays() does for OPM texts.
+
+    Args:
+        paths (iterable<str>): paths of the OPM files.
+        processes (int): if more than 1, the files are read and parsed on a pool of that
+            many processes.
+        chunksize (int): number of files handed to a process at a time.
+
+    Returns:
+        dict: see parse_opm_arrays().
+    """
+    return _fields_to_arrays(list(_map_files(_read_fields, paths, processes, chunksize)))
@@ -2,9 +2,19 @@
     propagation_params.py
 """
 
+from adam.value_type import ValueType
 
-class PropagationParams(object):
-    """Represents the parameters to set for a propagation."""
+
+class PropagationParams(ValueType):
+    """Represents the parameters to set for a propagation. Immutable: use replace() to
+    make variants."""
+
+    __slots__ = ('_start_time', '_end_time', '_step_size', '_propagator_uuid',
+                 '_project_uuid', '_description', '_executor', '_propagation_type',
+                 '_monte_carlo_draws', '_keplerian_sigma', '_cartesian_sigma',
+                 '_stop_on_impact', '_stop_on_close_approach',
+                 '_stop_on_impact_altitude_meters', '_stop_on_close_approach_after_epoch',
+                 '_singular_matrix_threshold', '_close_approach_radius_from_target_meters')
 
     DEFAULT_CONFIG_ID = "00000000-0000-0000-0000-000000000001"
     DEFAULT_EXECUTOR = "STK"
@@ -92,10 +102,11 @@ class PropagationParams(object):
         self._stop_on_impact = params.get('stopOnImpact')
         self._stop_on_close_approach = params.get('stopOnCloseApproach')
         self._stop_on_impact_altitude_meters = params.get('stopOnImpactAltitudeMeters')
-        self._stop_on_close_approach_after_epoch = params.get('stopOnCloseApproachAfterEpoch')
+        stop_on_close_approach_after_epoch = params.get('stopOnCloseApproachAfterEpoch')
+        if stop_on_close_approach_after_epoch is None:
+            stop_on_close_approach_after_epoch = self._end_time
+        self._stop_on_close_approach_after_epoch = stop_on_close_approach_after_epoch
         self._singular_matrix_threshold = params.get('singularMatrixThreshold')
-        if self._stop_on_close_approach_after_epoch is None:
-            self._stop_on_close_approach_after_epoch = self._end_time
         self._close_approach_radius_from_target_meters = \
             params.get('closeApproachRadiusFromTargetMeters')
 
@@ -0,0 +1,52 @@
+"""
+    rate_limiter.py
+"""
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Limits the rate of calls made from any number of threads.
+
+    Tokens accumulate at a fixed rate up to a burst size, and each call takes one, waiting
+    for it if none is available. Unlike pausing after every call, this lets concurrent
+    calls proceed as fast as the configured rate allows, however long each call takes.
+    """
+
+    def __init__(self, rate_per_sec, burst=1):
+        """
+        Args:
+            rate_per_sec (float): the sustained number of calls allowed per second. None
+                means unlimited.
+            burst (int): the number of calls that may be made at once after a pause.
+        """
+        if rate_per_sec is not None and rate_per_sec <= 0:
+            raise ValueError("rate_per_sec must be positive, got %s" % rate_per_sec)
+        self._rate_per_sec = rate_per_sec
+        self._burst = max(1, burst)
+        self._tokens = float(self._burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "Token bucket [%s/sec, burst %s]" % (self._rate_per_sec, self._burst)
+
+    def get_rate_per_sec(self):
+        return self._rate_per_sec
+
+    def acquire(self):
+        """Blocks until a call is allowed, then takes a token for it."""
+        if self._rate_per_sec is None:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._burst,
+                                   self._tokens + (now - self._last) * self._rate_per_sec)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate_per_sec
+            time.sleep(wait)
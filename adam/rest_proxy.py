@@ -288,10 +288,21 @@ class RestRequests(RestProxy):
     This class is used to send requests to the server.
     """
 
-    def __init__(self):
-        """Initialize client with some ADAM configuration."""
+    def __init__(self, pool_maxsize=50):
+        """Initialize client with some ADAM configuration.
+
+        Args:
+            pool_maxsize (int): maximum number of connections kept open to the server.
+                Requests share one session, so connections are reused across calls and
+                threads instead of being opened for every request.
+        """
 
         self._config = None
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_maxsize,
+                                                pool_maxsize=pool_maxsize)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
 
     def _add_requests_args(self, **kwargs):
         """Add more keyword arguments for requests method calls.
@@ -332,7 +343,8 @@ class RestRequests(RestProxy):
 
         self._maybe_reload_config(**kwargs)
         additional_args = self._add_requests_args(**kwargs)
-        response = requests.post(self.base_url() + path, json=data_dict, **additional_args)
+        response = self._session.post(self.base_url() + path, json=data_dict,
+                                      **additional_args)
         try:
             return response.status_code, response.json()
         except ValueError as e:
@@ -356,7 +368,7 @@ class RestRequests(RestProxy):
 
         self._maybe_reload_config(**kwargs)
         additional_args = self._add_requests_args(**kwargs)
-        response = requests.get(self.base_url() + path, **additional_args)
+        response = self._session.get(self.base_url() + path, **additional_args)
         response_json = {}
         try:
             response_json = response.json()
@@ -381,7 +393,7 @@ class RestRequests(RestProxy):
 
         self._maybe_reload_config(**kwargs)
         additional_args = self._add_requests_args(**kwargs)
-        response = requests.delete(self.base_url() + path, **additional_args)
+        response = self._session.delete(self.base_url() + path, **additional_args)
         return response.status_code, None
 
 
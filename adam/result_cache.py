@@ -0,0 +1,120 @@
+"""
+    result_cache.py
+"""
+
+from adam.run_manifest import hash_params
+
+import pickle
+import sqlite3
+import threading
+import time
+
+
+class ResultCache(object):
+    """Local, on-disk cache of the outcome of propagations, keyed by their inputs.
+
+    Entries are keyed by a stable hash of the propagation parameters and OPM content (see
+    run_manifest.hash_params), so resubmitting an identical propagation, e.g. the
+    nominal state of every STM computation, can be answered without calling the server.
+    Values are pickled into a SQLite database, so the cache is shared by every process
+    using the same file. Entries expire ttl_sec after they were stored, and the least
+    recently used entries are evicted once the cache holds more than max_bytes.
+    """
+
+    def __init__(self, path, ttl_sec=None, max_bytes=None):
+        """
+        Args:
+            path (str): the SQLite database file. Created if it does not exist.
+                ':memory:' gives a cache private to this object.
+            ttl_sec (float): how long entries are kept. Defaults to forever.
+            max_bytes (int): bound on the total size of the stored values. Defaults to
+                no bound.
+        """
+        self._path = path
+        self._ttl_sec = ttl_sec
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, "
+                "size INTEGER, created REAL, accessed REAL)")
+
+    def __repr__(self):
+        return "Result cache [%s, %s entries]" % (self._path, len(self))
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get_size(self):
+        """Returns the total size in bytes of the stored values."""
+        with self._lock:
+            size = self._connection.execute("SELECT SUM(size) FROM entries").fetchone()[0]
+            return size or 0
+
+    def key(self, kind, *params):
+        """Computes the key of an entry.
+
+        Args:
+            kind (str): what is cached, e.g. 'batch_results', so that values of different
+                types stored for the same inputs do not collide.
+            params: the inputs, e.g. PropagationParams and OpmParams.
+
+        Returns:
+            str: the key.
+        """
+        return hash_params(kind, *params)
+
+    def get(self, key):
+        """Returns the value stored under the given key, or None if there is none or it
+        has expired."""
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self._ttl_sec is not None and now - row[1] >= self._ttl_sec:
+                self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            self._connection.execute("UPDATE entries SET accessed = ? WHERE key = ?",
+                                     (now, key))
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        """Stores a value under the given key, replacing any previous value, then evicts
+        expired and least recently used entries as needed."""
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(blob), len(blob), now, now))
+            self._evict(now)
+
+    def delete(self, key):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM entries")
+
+    def _evict(self, now):
+        if self._ttl_sec is not None:
+            self._connection.execute("DELETE FROM entries WHERE created <= ?",
+                                     (now - self._ttl_sec,))
+        if self._max_bytes is None:
+            return
+        total = self._connection.execute("SELECT SUM(size) FROM entries").fetchone()[0] or 0
+        if total <= self._max_bytes:
+            return
+        evicted = []
+        for key, size in self._connection.execute(
+                "SELECT key, size FROM entries ORDER BY accessed ASC"):
+            if total <= self._max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._connection.executemany("DELETE FROM entries WHERE key = ?", evicted)
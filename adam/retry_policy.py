@@ -0,0 +1,61 @@
+"""
+    retry_policy.py
+"""
+
+import re
+
+
+class RetryPolicy(object):
+    """Decides whether a failed run should be resubmitted.
+
+    A run is retried while it has been attempted fewer than max_attempts times and, if
+    an error filter is given, its error message matches the filter. This allows retrying
+    transient failures (e.g. timeouts on the server) without retrying runs that fail
+    because of their inputs.
+    """
+
+    def __init__(self, max_attempts=3, error_filter=None):
+        """
+        Args:
+            max_attempts (int): the maximum number of times a run is submitted, including
+                the first submission.
+            error_filter (str or callable): if given, only runs whose error message
+                matches are retried. A string is a regular expression searched for in the
+                message; a callable is called with the message (possibly None) and
+                returns whether to retry.
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1, got %s" % max_attempts)
+        self._max_attempts = max_attempts
+        self._error_filter = error_filter
+
+    def __repr__(self):
+        return "Retry policy [%s attempts, filter %s]" % (self._max_attempts,
+                                                          self._error_filter)
+
+    def get_max_attempts(self):
+        return self._max_attempts
+
+    def get_error_filter(self):
+        return self._error_filter
+
+    def needs_error(self):
+        """Returns whether should_retry looks at error messages, which may be costly to
+        retrieve."""
+        return self._error_filter is not None
+
+    def should_retry(self, attempts, error=None):
+        """Returns whether a run that failed after the given number of attempts should
+        be submitted again.
+
+        Args:
+            attempts (int): how many times the run has been submitted so far.
+            error (str): the error message of the failure, if known.
+        """
+        if attempts >= self._max_attempts:
+            return False
+        if self._error_filter is None:
+            return True
+        if callable(self._error_filter):
+            return bool(self._error_filter(error))
+        return error is not None and re.search(self._error_filter, error) is not None
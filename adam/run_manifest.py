@@ -0,0 +1,178 @@
+"""
+    run_manifest.py
+"""
+
+from adam.value_type import ValueType
+
+import hashlib
+import json
+import os
+import threading
+
+
+def _canonical(obj):
+    """Reduces parameter objects to plain, deterministically ordered json-able values."""
+    if isinstance(obj, dict):
+        return {str(k): _canonical(v) for k, v in sorted(obj.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if hasattr(obj, 'generate_opm_content'):
+        # OPMs are identified by their content, which leaves out the creation date, so
+        # that equivalent OpmParams and RenderedOpms hash the same.
+        return {'__type__': 'Opm', 'opm': obj.generate_opm_content()}
+    if isinstance(obj, ValueType):
+        canonical = _canonical(obj.__getstate__())
+        canonical['__type__'] = type(obj).__name__
+        return canonical
+    if hasattr(obj, '__dict__'):
+        canonical = _canonical(vars(obj))
+        canonical['__type__'] = type(obj).__name__
+        return canonical
+    return obj
+
+
+def hash_params(*params):
+    """Computes a stable hash over the given parameter objects (e.g. PropagationParams
+    and OpmParams). Unlike hashing a generated OPM, this does not depend on the
+    creation date stamped into the OPM, so the same inputs hash the same across runs.
+    OPMs are hashed by their rendered content, so this can be used to recognize
+    repeated submissions of the same work whichever way their OPMs were made.
+
+    Args:
+        params: any number of parameter objects, dicts, lists or plain values.
+
+    Returns:
+        str: hex digest identifying the given parameters.
+    """
+    text = json.dumps(_canonical(list(params)), sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class RunManifest(object):
+    """Append-only, on-disk record of the work submitted by a run manager.
+
+    Each line of the manifest file is a json object describing one run by its index in
+    the managed list: the hash of its input parameters, its server-side uuid, its last
+    known calculation state and whether its results have been fetched. Lines only carry
+    the fields that changed, and the latest value of each field wins when the file is
+    read back. A last line truncated by a crash is dropped when the manifest is opened.
+
+    The manifest can be handed to a new manager (e.g. after the notebook kernel died)
+    to reattach to the submitted work instead of resubmitting it.
+    """
+
+    def __init__(self, path):
+        """Opens the manifest at the given path, loading any existing records.
+
+        Args:
+            path (str): path of the manifest file. Created on first write if missing.
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self._records = {}
+        # Indices handed out by reserve_index() which may not have records yet.
+        self._reserved = set()
+        if os.path.exists(path):
+            self._load()
+
+    def __repr__(self):
+        return "Run manifest [%s: %s runs]" % (self._path, len(self._records))
+
+    def get_path(self):
+        return self._path
+
+    def get_records(self):
+        """Returns the latest record for every run, ordered by run index."""
+        with self._lock:
+            return [dict(self._records[i]) for i in sorted(self._records)]
+
+    def get_record(self, index):
+        with self._lock:
+            record = self._records.get(index)
+            return None if record is None else dict(record)
+
+    def reserve_index(self, preferred):
+        """Reserves an index for the records of a new run, so that they do not overwrite
+        those of any other run in the manifest.
+
+        Args:
+            preferred (int): the index to use if no other run has it, e.g. the index of
+                the run in its manager.
+
+        Returns:
+            int: preferred if it was free, otherwise an index past all others.
+        """
+        with self._lock:
+            taken = self._reserved.union(self._records)
+            index = preferred
+            if index in taken:
+                index = max(taken) + 1
+            self._reserved.add(index)
+            return index
+
+    def _load(self):
+        with open(self._path, 'rb+') as f:
+            content = f.read()
+            # Drop a last line cut short by a crash, so that the next record does not get
+            # appended onto it and lost with it.
+            complete = content.rfind(b'\n') + 1
+            if complete < len(content):
+                f.truncate(complete)
+        for line in content[:complete].decode('utf-8').splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Garbled line, e.g. the process died mid-write.
+                continue
+            self._merge(entry)
+
+    def _merge(self, entry):
+        record = self._records.setdefault(entry['i'], {
+            'i': entry['i'], 'hash': None, 'uuid': None, 'state': None, 'fetched': False})
+        record.update(entry)
+
+    def record(self, entries):
+        """Appends the given entries to the manifest and flushes them to disk.
+
+        Args:
+            entries (list<dict>): each entry must contain 'i', the index of the run, and
+                any of 'hash', 'uuid', 'state' and 'fetched' that changed.
+        """
+        if len(entries) == 0:
+            return
+        lines = ''.join(json.dumps(e, sort_keys=True) + '\n' for e in entries)
+        with self._lock:
+            with open(self._path, 'a') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            for e in entries:
+                self._merge(e)
+
+    def match(self, hashes):
+        """Matches runs in the manifest to runs with the given input hashes.
+
+        Runs are matched by input hash rather than position, so the caller may rebuild
+        its list of runs in a different order. Identical inputs are matched in index
+        order.
+
+        Args:
+            hashes (list<str>): input hashes of the runs to reattach.
+
+        Returns:
+            list<dict>: for each given hash, the matching record with a uuid, or None if
+                the run was never submitted.
+        """
+        available = {}
+        for record in self.get_records():
+            if record['uuid'] is not None:
+                available.setdefault(record['hash'], []).append(record)
+
+        matched = []
+        for h in hashes:
+            candidates = available.get(h)
+            matched.append(candidates.pop(0) if candidates else None)
+        return matched
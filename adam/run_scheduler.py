@@ -0,0 +1,157 @@
+"""
+    run_scheduler.py
+"""
+
+from adam.batch_run_manager import BatchRunManager
+from adam.runnable_manager import RunnableManager
+from adam.timer import Timer
+
+from collections import OrderedDict
+import time
+from multiprocessing.dummy import Pool as ThreadPool
+
+
+class RunScheduler(object):
+    """
+    Runs batches and runnables spanning many projects as one sweep.
+
+    Work is grouped into one manager per project (a BatchRunManager for batches, a
+    RunnableManager for runnables), but the managers are driven together: a single
+    polling loop refreshes each unfinished project's states once per tick, and results
+    are retrieved on one bounded worker pool shared by all projects, so that running
+    several sweeps at once does not multiply the load on the server. Projects whose runs
+    have all finished have their results retrieved in the background while the others
+    keep being polled.
+
+    The managers share the batches and runnables modules they are given, and so the
+    connections of the underlying rest proxy.
+    """
+
+    def __init__(self, batches_module=None, runnables_module=None, max_workers=10,
+                 poll_interval_sec=1.0, do_timing=True):
+        """Sets up a scheduler with nothing to run yet.
+
+        Args:
+            batches_module (Batches): Object to use to communicate with the server about
+                batches. Required to add batches.
+            runnables_module (AdamObjects): Object to use to communicate with the server
+                about runnables. Required to add runnables.
+            max_workers (int): Bound on the number of concurrent calls to the server for
+                submission and results retrieval, across all projects.
+            poll_interval_sec (float): Time to wait between polling ticks.
+            do_timing (boolean): If true, timing information will be printed for the
+                phases of the sweep.
+        """
+        self.batches_module = batches_module
+        self.runnables_module = runnables_module
+        self.max_workers = max_workers
+        self.poll_interval_sec = poll_interval_sec
+
+        self.do_timing = do_timing
+        if self.do_timing:
+            self.timer = Timer()
+
+        self.managers = []
+
+    def __repr__(self):
+        return "Run scheduler [%s managers]" % (len(self.managers))
+
+    def get_managers(self):
+        """ Retrieves the per-project managers, in the order their work was added. """
+        return self.managers
+
+    def add_batches(self, batch_runs, **manager_options):
+        """ Adds batch runs, which may belong to any number of projects.
+
+        Args:
+            batch_runs (list<Batch>): Batches to run.
+            manager_options: Further keyword arguments for each project's BatchRunManager,
+                e.g. retention, manifest or retry_policy. Streaming mode is not supported.
+
+        Returns:
+            list<BatchRunManager>: the managers created, one per project.
+        """
+        if self.batches_module is None:
+            raise ValueError("A batches module is required to run batches.")
+        if manager_options.get('result_sink') is not None:
+            raise ValueError("Streaming runs cannot be scheduled.")
+
+        by_project = OrderedDict()
+        for b in batch_runs:
+            by_project.setdefault(b.get_propagation_params().get_project_uuid(), []).append(b)
+
+        submission_options = {'max_threads': self.max_workers}
+        submission_options.update(manager_options.pop('submission_options', None) or {})
+
+        managers = [BatchRunManager(self.batches_module, runs, do_timing=False,
+                                    submission_options=submission_options,
+                                    **manager_options)
+                    for runs in by_project.values()]
+        self.managers.extend(managers)
+        return managers
+
+    def add_runnables(self, runnables, project_uuid, **manager_options):
+        """ Adds runnables to run in the given project.
+
+        Args:
+            runnables (list<object>): Runnables to run.
+            project_uuid (str): The project in which to run them.
+            manager_options: Further keyword arguments for the RunnableManager.
+
+        Returns:
+            RunnableManager: the manager created.
+        """
+        if self.runnables_module is None:
+            raise ValueError("A runnables module is required to run runnables.")
+        manager = RunnableManager(self.runnables_module, runnables, project_uuid,
+                                  do_timing=False, **manager_options)
+        self.managers.append(manager)
+        return manager
+
+    def _get_size(self, manager):
+        if isinstance(manager, BatchRunManager):
+            return len(manager.get_batch_runs())
+        return len(manager.get_runnables())
+
+    def run(self):
+        """ Submits all work, polls it until every run is in a final state and retrieves
+            the results.
+        """
+        if self.do_timing:
+            self.timer.start("Submitting runs for %s managers." % (len(self.managers)))
+        for m in self.managers:
+            m._submit()
+        if self.do_timing:
+            self.timer.stop()
+
+        if self.do_timing:
+            self.timer.start("Running.")
+
+        pool = ThreadPool(self.max_workers)
+        fetches = []
+        active = list(self.managers)
+        while len(active) > 0:
+            # One refresh of each unfinished project's states per tick.
+            for m in list(active):
+                m._update_state()
+                if m.state.name == 'COMPLETED':
+                    active.remove(m)
+                    fetches.append(
+                        (m, pool.map_async(m._fetch_result, range(self._get_size(m)))))
+            if len(active) > 0 and self.poll_interval_sec > 0:
+                time.sleep(self.poll_interval_sec)
+
+        if self.do_timing:
+            self.timer.stop()
+
+        if self.do_timing:
+            self.timer.start("Retrieving results.")
+        try:
+            for m, fetch in fetches:
+                fetch.get()
+                m._finish_run()
+        finally:
+            pool.close()
+            pool.join()
+        if self.do_timing:
+            self.timer.stop()
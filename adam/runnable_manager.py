@@ -2,6 +2,12 @@
     runnable_manager.py
 """
 
+from adam.adam_objects import AdamObjectRunnableState
+from adam.events import EventDispatcher
+from adam.events import EventType
+from adam.rate_limiter import TokenBucket
+from adam.run_manifest import RunManifest
+from adam.run_manifest import hash_params
 from adam.timer import Timer
 
 from enum import Enum
@@ -27,7 +33,9 @@ class RunnableManager(object):
     """
 
     def __init__(self, runnables_module, runnables, project_uuid,
-                 do_timing=True, multi_threaded=True):
+                 do_timing=True, multi_threaded=True, manifest=None,
+                 requests_per_sec=10.0, max_concurrent_submissions=5, bulk_size=100,
+                 child_requests_per_sec=None):
         """Sets up object that can manage the running and lifetime of the given batches.
 
         Args:
@@ -41,6 +49,20 @@ class RunnableManager(object):
                 multithreading such as submission or results retrieval will be
                 multithreaded. Should generally be left true, but can be set to false if
                 a guaranteed particular ordering is necessary (e.g. for tests).
+            manifest (str or RunManifest): If given, the uuid, state and result retrieval
+                of every runnable is appended to this on-disk manifest as the run
+                progresses, so that the run can be picked up again with resume().
+            requests_per_sec (float): Bound on the rate of insertion calls to the server.
+                None means unlimited.
+            max_concurrent_submissions (int): Bound on the number of insertion calls in
+                flight at once.
+            bulk_size (int): Number of runnables inserted per call when the runnables
+                module supports bulk insertion (insert_many(runnables, project_uuid)).
+            child_requests_per_sec (float): Bound on the rate of the requests for the
+                children of the runnables when retrieving results, shared by all of them.
+                If given, it is passed as get_children(uuid, rate_limiter=...) to the
+                runnables module. None means unlimited, within the bound on concurrent
+                child requests (see adam_objects.CHILD_FETCH_WORKERS).
         """
         self.runnables_module = runnables_module
         self.runnables = runnables
@@ -53,12 +75,27 @@ class RunnableManager(object):
             self.timer = Timer()
 
         self.multi_threaded = multi_threaded
+        self.rate_limiter = TokenBucket(requests_per_sec)
+        self.child_rate_limiter = None
+        if child_requests_per_sec is not None:
+            self.child_rate_limiter = TokenBucket(child_requests_per_sec)
+        self.max_concurrent_submissions = max_concurrent_submissions
+        self.bulk_size = bulk_size
 
         # Cache the overall status here. Lock access so that state can be retrieved while
         # waiting for completion.
         self.cached_status = self._get_empty_cached_status()
         self.status_lock = threading.Lock()
 
+        self.manifest = RunManifest(manifest) if isinstance(manifest, str) else manifest
+        # Index of the manifest records of each run, by run index. Runs reattached by
+        # resume() keep their recorded index, so new runs never overwrite their records.
+        self._manifest_indices = {}
+        self._manifest_lock = threading.Lock()
+
+        # Progress events are delivered to subscribers on their own thread.
+        self.events = EventDispatcher()
+
     def __repr__(self):
         return "Runnable manager [%s: %s runnables]" % (self.state, len(self.runnables))
 
@@ -95,64 +132,101 @@ class RunnableManager(object):
         self.cached_status = status
         self.status_lock.release()
 
-    def _submit(self):
+    def subscribe(self, callback, event_types=None):
+        """ Registers a callback for progress events (see EventType): a runnable was
+            submitted, changed state, failed or had its results fetched, or the whole
+            run finished. Callbacks run one at a time on a dedicated thread, never on
+            the threads talking to the server. All events of a run are delivered before
+            run() or resume() returns.
+
+        Args:
+            callback (callable): called with each Event.
+            event_types (list<EventType>): the event types to receive. Defaults to all.
+
+        Returns:
+            callable: the callback, which can be passed to unsubscribe().
+        """
+        return self.events.subscribe(callback, event_types)
+
+    def unsubscribe(self, callback):
+        self.events.unsubscribe(callback)
+
+    def _get_calc_state(self, runnable):
+        runnable_state = runnable.get_runnable_state()
+        return None if runnable_state is None else runnable_state.get_calc_state()
+
+    def _finish_run(self):
+        self.events.emit(EventType.RUN_FINISHED, state=self.state.name)
+        self.events.flush()
+
+    def _get_input_hash(self, runnable):
+        # Runnables expose different sets of parameters depending on their type.
+        getters = ['get_propagation_params', 'get_opm_params', 'get_targeting_params']
+        return hash_params(type(runnable).__name__,
+                           *[getattr(runnable, g)() for g in getters if hasattr(runnable, g)])
+
+    def _record(self, entries):
+        if self.manifest is not None:
+            self.manifest.record([dict(e, i=self._get_manifest_index(e['i']))
+                                  for e in entries])
+
+    def _get_manifest_index(self, i):
+        with self._manifest_lock:
+            if i not in self._manifest_indices:
+                self._manifest_indices[i] = self.manifest.reserve_index(i)
+            return self._manifest_indices[i]
+
+    def _submit(self, indices=None):
+        """ Submits the runnables at the given indices (by default, all of them). """
+        if indices is None:
+            indices = list(range(len(self.runnables)))
+
         if self.do_timing:
             self.timer.start("Submitting %s runnables." %
-                             (len(self.runnables)))
+                             (len(indices)))
 
         if not self.state == State.INITIALIZED:
             print("Error: runnables already submitted, cannot resubmit.")
             self.timer.stop()
             return
 
-        # Insert all the runnables server-side.
-        import time
-        count = 0
-        for r in self.runnables:
-            self.runnables_module.insert(r, self.project_uuid)
-            count = count + 1
-            if count % 10 == 0:
-                print('Inserted ' + str(count) + ' runnables')
-            time.sleep(.5)
-
-        # TODO: support batched submission.
-
-        # # Batch runs are most efficient when submitted in a single call because of the
-        # # overhead of authorization, connecting to the database, etc. The server takes
-        # # ~20 seconds to submit 500 batch runs. We don't want to take more time than that
-        # # because calls time out around 60 seconds.
-        # submission_batch_size = 500
-
-        # # Use as many threads as we have batches to submit, up to an arbitrary maximum
-        # # of 10, which allows us to submit 5000 batches in parallel.
-        # if self.multi_threaded:
-        #     num_batches = round(len(self.batch_runs) / submission_batch_size) + 1
-        #     threads = min(num_batches, 10)
-        # else:
-        #     threads = 1
-
-        # def _submit_batches(i):
-        #     # Grab all the creation parameters from the batch objects.
-        #     runs = self.batch_runs[i:i+submission_batch_size]
-        #     params = [[b.get_propagation_params(), b.get_opm_params()] for b in runs]
-
-        #     # Call to the server to create the batches.
-        #     summaries = self.batches_module.new_batches(params)
-
-        #     # Update the batches with the resulting state summaries.
-        #     for summary_i in range(len(summaries)):
-        #         self.batch_runs[i + summary_i].set_state_summary(summaries[summary_i])
-
-        # pool = ThreadPool(threads)
-        # # Break up the batches into chunks and submit them in chunks. For fewer than
-        # # <submission_batch_size> runs, this just submits them all in one request on one
-        # # thread.
-        # pool.map(_submit_batches,
-        #          [i for i in range(0, len(self.batch_runs), submission_batch_size)])
-        # pool.close()
-        # pool.join()
-
-        # self._update_cached_status()
+        # Insert all the runnables server-side, in bulk if the module supports it. Calls
+        # are made concurrently, with their rate bounded so as not to overload the server.
+        if hasattr(self.runnables_module, 'insert_many'):
+            chunk_size = self.bulk_size
+        else:
+            chunk_size = 1
+        chunks = [indices[j:j + chunk_size] for j in range(0, len(indices), chunk_size)]
+
+        progress_lock = threading.Lock()
+        progress = {'count': 0}
+
+        def _insert(chunk):
+            runnables = [self.runnables[i] for i in chunk]
+            self.rate_limiter.acquire()
+            if chunk_size == 1:
+                self.runnables_module.insert(runnables[0], self.project_uuid)
+            else:
+                self.runnables_module.insert_many(runnables, self.project_uuid)
+
+            self._record([{'i': i, 'hash': self._get_input_hash(r), 'uuid': r.get_uuid(),
+                           'state': None, 'fetched': False} for i, r in zip(chunk, runnables)])
+            for i, r in zip(chunk, runnables):
+                self.events.emit(EventType.SUBMITTED, index=i, uuid=r.get_uuid())
+            with progress_lock:
+                previous = progress['count']
+                progress['count'] += len(chunk)
+                if progress['count'] // 10 > previous // 10:
+                    print('Inserted ' + str(progress['count']) + ' runnables')
+
+        if self.multi_threaded:
+            threads = max(1, min(self.max_concurrent_submissions, len(chunks)))
+        else:
+            threads = 1
+        pool = ThreadPool(threads)
+        pool.map(_insert, chunks)
+        pool.close()
+        pool.join()
 
         if self.do_timing:
             self.timer.stop()
@@ -178,9 +252,21 @@ class RunnableManager(object):
         for runnable_state in runnable_states:
             runnable_states_by_uuid[runnable_state.get_uuid()] = runnable_state
 
-        for runnable in self.runnables:
+        changes = []
+        for i, runnable in enumerate(self.runnables):
+            previous = runnable.get_runnable_state()
             runnable.set_runnable_state(
                 runnable_states_by_uuid[runnable.get_uuid()])
+            state = runnable.get_runnable_state().get_calc_state()
+            previous_state = None if previous is None else previous.get_calc_state()
+            if previous is None or previous_state != state:
+                changes.append({'i': i, 'state': state})
+                self.events.emit(EventType.STATE_CHANGED, index=i, uuid=runnable.get_uuid(),
+                                 state=state, previous_state=previous_state)
+                if state == 'FAILED':
+                    self.events.emit(EventType.FAILED, index=i, uuid=runnable.get_uuid(),
+                                     state=state)
+        self._record(changes)
 
         # Then, if the state of this whole batch should be updated, do that.
         complete = True
@@ -207,21 +293,36 @@ class RunnableManager(object):
         if self.do_timing:
             self.timer.stop()
 
-    def _get_results(self):
+    def _fetch_result(self, i):
+        """ Retrieves results for the runnable at the given index. """
+        r = self.runnables[i]
+        self.runnables_module.update_with_results(r)
+        # Only pass the rate limiter if a rate was asked for, so that runnables modules
+        # with the basic get_children(uuid) signature can be used.
+        kwargs = {}
+        if self.child_rate_limiter is not None:
+            kwargs['rate_limiter'] = self.child_rate_limiter
+        r.set_children(self.runnables_module.get_children(r.get_uuid(), **kwargs))
+        self._record([{'i': i, 'fetched': True}])
+        self.events.emit(EventType.RESULT_FETCHED, index=i, uuid=r.get_uuid(),
+                         state=self._get_calc_state(r))
+
+    def _get_results(self, indices=None):
+        """ Retrieves results for the runnables at the given indices (by default, all
+            of them).
+        """
+        if indices is None:
+            indices = list(range(len(self.runnables)))
+
         if self.do_timing:
             self.timer.start("Retrieving runnable results.")
 
-        def _get_results(i):
-            r = self.runnables[i]
-            self.runnables_module.update_with_results(r)
-            r.set_children(self.runnables_module.get_children(r.get_uuid()))
-
         if self.multi_threaded:
             threads = 5
         else:
             threads = 1
         pool = ThreadPool(threads)
-        pool.map(_get_results, [i for i in range(len(self.runnables))])
+        pool.map(self._fetch_result, indices)
         pool.close()
         pool.join()
 
@@ -232,3 +333,69 @@ class RunnableManager(object):
         self._submit()
         self._wait_for_completion()
         self._get_results()
+        self._finish_run()
+
+    def resume(self, manifest=None, skip_fetched=False):
+        """ Picks up a run recorded in a manifest, e.g. after the process that started
+            it died. The managed runnables should be rebuilt from the same inputs as the
+            original run; they are matched to the recorded runnables by input hash.
+            Matched runnables are reattached to their server-side uuids, runnables never
+            inserted are inserted, and the run then continues as with run().
+
+            Only runnables whose results (children) are not already loaded are retrieved.
+
+        Args:
+            manifest (str or RunManifest): The manifest of the run to resume. Defaults to
+                the manifest this manager was constructed with.
+            skip_fetched (boolean): If true, also skip retrieving results for runnables the
+                manifest records as already fetched, e.g. if the caller persisted them.
+        """
+        if manifest is not None:
+            self.manifest = RunManifest(manifest) if isinstance(manifest, str) else manifest
+            self._manifest_indices = {}
+        if self.manifest is None:
+            raise ValueError("A manifest is required to resume a run.")
+
+        if not self.state == State.INITIALIZED:
+            print("Error: runnables already submitted, cannot resume.")
+            return
+
+        hashes = [self._get_input_hash(r) for r in self.runnables]
+        records = self.manifest.match(hashes)
+
+        # Reattach what was inserted before. The order of the runnables may have changed,
+        # so each keeps the records it matched, and new runnables get records of their own.
+        uninserted = []
+        fetched = set()
+        entries = []
+        for i, (r, h, record) in enumerate(zip(self.runnables, hashes, records)):
+            if record is None:
+                uninserted.append(i)
+                continue
+            self._manifest_indices[i] = record['i']
+            r.set_uuid(record['uuid'])
+            if record['state'] is not None:
+                r.set_runnable_state(AdamObjectRunnableState({
+                    'uuid': record['uuid'], 'calculationState': record['state']}))
+            if record['fetched']:
+                fetched.add(i)
+            entries.append({'i': i, 'hash': h, 'uuid': record['uuid'],
+                            'state': record['state'], 'fetched': record['fetched']})
+        self._record(entries)
+
+        if len(uninserted) > 0:
+            self._submit(uninserted)
+        else:
+            # Nothing left to poll for if every runnable was last seen in a final state.
+            final = all(r.get_runnable_state() is not None and
+                        r.get_runnable_state().get_calc_state() in ['COMPLETED', 'FAILED']
+                        for r in self.runnables)
+            self.state = State.COMPLETED if final else State.SUBMITTED
+            self._update_cached_status()
+
+        self._wait_for_completion()
+
+        missing = [i for i, r in enumerate(self.runnables)
+                   if r.get_children() is None and not (skip_fetched and i in fetched)]
+        self._get_results(missing)
+        self._finish_run()
@@ -0,0 +1,150 @@
+"""
+    status_table.py
+"""
+
+import threading
+
+import numpy as np
+
+
+# Calculation states in the order of their codes in the table. Code 0 is for runs that
+# have not been submitted yet, so have no uuid or state.
+STATES = (None, 'PENDING', 'RUNNING', 'COMPLETED', 'FAILED')
+_CODES = {state: code for code, state in enumerate(STATES)}
+
+
+class StatusSnapshot(object):
+    """Immutable view of a StatusTable at one version.
+
+    Taking a snapshot copies nothing: it shares the table's arrays, and the table copies
+    them before its next write instead. Counts per state are available in O(1); lists of
+    uuids by state take one pass over the snapshot, on the caller's thread.
+    """
+
+    def __init__(self, version, uuids, states, counts):
+        self._version = version
+        self._uuids = uuids
+        self._states = states
+        self._counts = counts
+
+    def __repr__(self):
+        return "Status snapshot %s %s" % (self._version, self.get_counts())
+
+    def __len__(self):
+        return len(self._states)
+
+    def get_version(self):
+        """Returns the version of the table this snapshot was taken at. Versions only
+        increase, so equal versions mean nothing changed in between."""
+        return self._version
+
+    def get_count(self, state):
+        return int(self._counts[_CODES[state]])
+
+    def get_counts(self):
+        """Returns the number of runs in each calculation state."""
+        return {state: int(self._counts[code]) for code, state in enumerate(STATES)
+                if state is not None}
+
+    def get_uuids(self, state):
+        """Returns the uuids of the runs in the given state, in run order."""
+        return self._uuids[self._states == _CODES[state]].tolist()
+
+    def get_states(self):
+        """Returns the calculation state of every run, in run order (None if unsubmitted)."""
+        return [STATES[code] for code in self._states]
+
+    def as_dict(self):
+        """Returns the uuids of the runs in each calculation state, in the form returned
+        by the managers' get_latest_statuses()."""
+        return {state: self.get_uuids(state) for state in STATES if state is not None}
+
+
+class StatusTable(object):
+    """Columnar record of the uuid and calculation state of many runs.
+
+    Rows are kept in an array of uuids and an array of small-int state codes, and counts
+    per state are maintained as rows change. Writes from the thread(s) tracking the runs
+    are applied in place; readers take versioned, immutable snapshots that cost O(1) and
+    so never contend with the writers for longer than it takes to swap a reference.
+    """
+
+    def __init__(self, size=0):
+        """
+        Args:
+            size (int): number of rows to start with, all unsubmitted.
+        """
+        self._lock = threading.Lock()
+        self._size = 0
+        self._uuids = np.empty(0, dtype=object)
+        self._states = np.empty(0, dtype=np.int8)
+        self._counts = np.zeros(len(STATES), dtype=np.int64)
+        self._version = 0
+        self._snapshot = None
+        self.append(size)
+
+    def __repr__(self):
+        return "Status table [%s rows, version %s]" % (self._size, self._version)
+
+    def __len__(self):
+        return self._size
+
+    def _prepare_write(self, size):
+        # Copy the arrays if a snapshot shares them, growing them to at least size.
+        shared = self._snapshot is not None and self._snapshot.get_version() == self._version
+        capacity = len(self._states)
+        if size > capacity:
+            capacity = max(size, 2 * capacity, 16)
+        elif not shared:
+            return
+        uuids = np.empty(capacity, dtype=object)
+        states = np.zeros(capacity, dtype=np.int8)
+        uuids[:self._size] = self._uuids[:self._size]
+        states[:self._size] = self._states[:self._size]
+        self._uuids = uuids
+        self._states = states
+
+    def append(self, count):
+        """Adds count unsubmitted rows. Returns the index of the first one."""
+        with self._lock:
+            start = self._size
+            if count > 0:
+                self._prepare_write(start + count)
+                self._uuids[start:start + count] = None
+                self._states[start:start + count] = 0
+                self._size += count
+                self._counts[0] += count
+                self._version += 1
+            return start
+
+    def update(self, indices, uuids, states):
+        """Sets the uuid and calculation state of the given rows.
+
+        Args:
+            indices (list<int>): rows to update.
+            uuids (list<str>): their uuids.
+            states (list<str>): their calculation states.
+        """
+        if len(indices) == 0:
+            return
+        indices = np.asarray(indices, dtype=np.int64)
+        codes = np.array([_CODES[s] for s in states], dtype=np.int8)
+        with self._lock:
+            self._prepare_write(self._size)
+            np.subtract.at(self._counts, self._states[indices], 1)
+            np.add.at(self._counts, codes, 1)
+            self._uuids[indices] = uuids
+            self._states[indices] = codes
+            self._version += 1
+
+    def get_snapshot(self):
+        """Returns an immutable snapshot of the current state of the table."""
+        with self._lock:
+            if self._snapshot is None or self._snapshot.get_version() != self._version:
+                uuids = self._uuids[:self._size]
+                states = self._states[:self._size]
+                uuids.flags.writeable = False
+                states.flags.writeable = False
+                self._snapshot = StatusSnapshot(self._version, uuids, states,
+                                                self._counts.copy())
+            return self._snapshot
@@ -1,20 +1,67 @@
 """
 @author: vivek
-@todo: change all printing to logging
 """
 
 # General imports
-from copy import deepcopy
+from enum import Enum
 import numpy as np
 
 # Adam related imports
 from adam import Batch
-from adam import BatchRunManager
+from adam.batch import ResultRetention
+from adam.bulk_opm import BulkOpmGenerator
+from adam.run_scheduler import RunScheduler
+
+
+class DifferenceScheme(Enum):
+    """Finite difference schemes for the STM, from cheapest to most accurate. For an
+    n-dimensional input they take the following numbers of propagations:
+
+        FORWARD: n + 1, first order in the step size.
+        CENTRAL: 2n + 1, second order in the step size.
+        RICHARDSON: 4n + 1, central differences at steps h and h/2 extrapolated to
+            fourth order in the step size.
+    """
+    FORWARD = 'FORWARD'
+    CENTRAL = 'CENTRAL'
+    RICHARDSON = 'RICHARDSON'
+
+
+def count_propagations(dimension, scheme=DifferenceScheme.CENTRAL):
+    """Returns the number of propagations needed for one STM.
+
+    Args:
+        dimension (int): size of the input varied, e.g. 6 for a state vector, 3 for a
+            velocity.
+        scheme (DifferenceScheme): the finite difference scheme.
+
+    Returns:
+        int: the number of propagations, including the nominal one.
+    """
+    return 1 + dimension * {DifferenceScheme.FORWARD: 1,
+                            DifferenceScheme.CENTRAL: 2,
+                            DifferenceScheme.RICHARDSON: 4}[scheme]
 
 
 class StmPropagationModule(object):
-    def __init__(self, batches_module):
+    def __init__(self, batches_module, result_cache=None, scheme=DifferenceScheme.CENTRAL,
+                 relative_step=1.0e-6, min_abs_x=1.0e-3):
+        """
+        Args:
+            batches_module (Batches): Object to use to communicate with the server.
+            result_cache (ResultCache): If given, propagations already run (e.g. the
+                nominal state of an earlier STM computation) are taken from the cache.
+            scheme (DifferenceScheme): Default finite difference scheme, which sets how
+                many propagations each STM takes (see count_propagations()).
+            relative_step (float): Default step of each input, relative to its magnitude.
+            min_abs_x (float): Magnitude used in place of that of inputs smaller than
+                this, so that their steps are not vanishingly small.
+        """
         self.batches_module = batches_module
+        self.result_cache = result_cache
+        self.scheme = scheme
+        self.relative_step = relative_step
+        self.min_abs_x = min_abs_x
 
     def __repr__(self):
         return "StmPropagationModule"
@@ -23,8 +70,8 @@ class StmPropagationModule(object):
         """Propagate states using many initial state vectors.
 
         Args:
-            state_vectors (list of lists):
-                list of lists with 6 elements [rx, ry, rz, vx, vy, vz]  [km, km/s]
+            state_vectors (array-like):
+                (N, 6) initial states [rx, ry, rz, vx, vy, vz]  [km, km/s]
             propagation_params (PropagationParams):
                 propagation-related parameters to be used for all propagations
             opm_params_templ (OpmParams):
@@ -32,38 +79,51 @@ class StmPropagationModule(object):
                 of the given state vectors.
 
         Returns:
-            end_state_vectors (list of lists):
-                states at end of integration [rx, ry, rz, vx, vy, vz]  [km, km/s]
+            end_state_vectors (numpy.ndarray):
+                (N, 6) states at end of integration [rx, ry, rz, vx, vy, vz]  [km, km/s]
         """
+        return self._propagate_state_groups(
+            [(propagation_params, opm_params_templ, state_vectors)])[0]
+
+    def _propagate_state_groups(self, groups):
+        """Propagates several groups of initial state vectors, all submitted before
+        waiting for any.
 
-        # Create batches from state vectors
-        batches = []
-        for state_vector in state_vectors:
-            opm_params = deepcopy(opm_params_templ)
-            opm_params.set_state_vector(state_vector)
-            batches.append(Batch(propagation_params, opm_params))
+        Args:
+            groups (list<tuple>): (propagation_params, opm_params_templ, state_vectors)
+                for each group, as taken by _propagate_states().
+
+        Returns:
+            list<numpy.ndarray>: (N, 6) end states of each group.
+        """
+        # Create batches from state vectors, rendering their OPMs from the template at once.
+        batch_groups = [[Batch(params, opm) for opm in
+                         BulkOpmGenerator(opm_params_templ).generate(state_vectors)]
+                        for params, opm_params_templ, state_vectors in groups]
 
         # submit batches and wait till they finish running
-        runner = BatchRunManager(self.batches_module, batches)
-        runner.run()
+        # Only the end states are used, so don't hold on to the ephemerides.
+        scheduler = RunScheduler(batches_module=self.batches_module)
+        scheduler.add_batches([b for batches in batch_groups for b in batches],
+                              retention=ResultRetention.END_STATE,
+                              result_cache=self.result_cache)
+        scheduler.run()
 
         # Get final states
-        end_state_vectors = []
-        for batch in batches:
-            end_state_vectors.append(batch.get_results().get_end_state_vector())
-
-        return end_state_vectors
+        return [np.array([b.get_results().get_end_state_vector() for b in batches],
+                         dtype=np.float64)
+                for batches in batch_groups]
 
     def _propagate_states_delta_velocities(self, dV_vectors, state_vector,
                                            propagation_params,
                                            opm_params_templ):
-        """Propagate states using many initial delta-V vectors.
+        """Propagate states using many initial velocity vectors.
 
         Args:
-            dV_vectors (list of lists):
-                list of lists with 3 elements [vx, vy, vz]  [km/s]
-            state_vector (list): lost of 6 elements of initial state
-                [rx, ry, rz, vx, vy, vz]  [km, km/s]
+            dV_vectors (array-like):
+                (N, 3) initial velocities [vx, vy, vz]  [km/s]
+            state_vector (list): list of 6 elements of initial state
+                [rx, ry, rz, vx, vy, vz]  [km, km/s], of which the position is used.
             propagation_params (PropagationParams):
                 propagation-related parameters to be used for all propagations
             opm_params_templ (OpmParams):
@@ -71,81 +131,100 @@ class StmPropagationModule(object):
                 of the given state vectors.
 
         Returns:
-            end_state_vectors (list of lists):
-                states at end of integration [rx, ry, rz, vx, vy, vz]  [km, km/s]
+            end_state_vectors (numpy.ndarray):
+                (N, 6) states at end of integration [rx, ry, rz, vx, vy, vz]  [km, km/s]
         """
+        dV_vectors = np.asarray(dV_vectors, dtype=np.float64)
 
-        # Create state vectors from velocity vectors
-        state_vectors_dV = []
-        for dV_vector in dV_vectors:
-            # concatenate position and velocity
-            state_vector_dV = state_vector[0:3] + dV_vector
-            state_vectors_dV.append(state_vector_dV)
+        # concatenate position and velocity
+        positions = np.tile(np.asarray(state_vector[0:3], dtype=np.float64),
+                            (len(dV_vectors), 1))
+        state_vectors_dV = np.hstack([positions, dV_vectors])
 
-        end_state_vectors = self._propagate_states(
-            state_vectors_dV, propagation_params, opm_params_templ
-        )
+        return self._propagate_states(state_vectors_dV, propagation_params, opm_params_templ)
 
-        return end_state_vectors
+    def _perturb(self, xk, scheme, relative_step):
+        """Builds the inputs to evaluate for a finite difference derivative at xk.
 
-    def _evaluate_func_with_derivative(self, xk, func, *args):
-        """Evaluate a function and do central differencing for the derivative
+        Args:
+            xk (numpy.ndarray): (n,) point at which to differentiate.
+            scheme (DifferenceScheme): the finite difference scheme.
+            relative_step (float): step of each input, relative to its magnitude.
 
-        The function has to take a list of input values and provide a list out outs
-        e.g. it has to be able to propagate more than 1 state
+        Returns:
+            xs (numpy.ndarray): (count_propagations(n, scheme), n) inputs: xk, then xk
+                stepped forward in each dimension in turn, then (except for FORWARD) xk
+                stepped backward; for RICHARDSON, followed by the same at half steps.
+            hs (numpy.ndarray): (n,) the steps.
+        """
+        hs = np.maximum(np.abs(xk), self.min_abs_x) * relative_step
+        steps = np.diag(hs)
+        if scheme == DifferenceScheme.FORWARD:
+            blocks = [xk[np.newaxis, :], xk + steps]
+        elif scheme == DifferenceScheme.CENTRAL:
+            blocks = [xk[np.newaxis, :], xk + steps, xk - steps]
+        else:
+            blocks = [xk[np.newaxis, :], xk + steps, xk - steps,
+                      xk + steps / 2.0, xk - steps / 2.0]
+        return np.vstack(blocks), hs
+
+    def _differentiate(self, ys, hs, scheme):
+        """Computes the derivative matrix from the outputs for the inputs of _perturb().
+        Any leading dimensions of ys and hs are kept, so that the derivatives at several
+        points can be computed at once.
 
         Args:
-            xk (list) - list of floats. value where we have to evaluate
-            func (callable) - function to evaluate
-            *args (args, optional) - any other arguments to be passed to func
+            ys (numpy.ndarray): (..., count_propagations(n, scheme), m) outputs.
+            hs (numpy.ndarray): (..., n) the steps.
+            scheme (DifferenceScheme): the finite difference scheme.
 
         Returns:
-            yk (list) - output of func(xk)
-            dy_dx_matrix (numpy.matrix) - matrix of dy/dx
+            numpy.ndarray: (..., m, n) matrices of dy/dx.
         """
+        n = hs.shape[-1]
+        hs = hs[..., np.newaxis]
+        if scheme == DifferenceScheme.FORWARD:
+            derivative = (ys[..., 1:n + 1, :] - ys[..., 0:1, :]) / hs
+        else:
+            derivative = (ys[..., 1:n + 1, :] - ys[..., n + 1:2 * n + 1, :]) / (2.0 * hs)
+            if scheme == DifferenceScheme.RICHARDSON:
+                half = (ys[..., 2 * n + 1:3 * n + 1, :] - ys[..., 3 * n + 1:4 * n + 1, :]) / hs
+                derivative = (4.0 * half - derivative) / 3.0
+        return np.swapaxes(derivative, -1, -2)
 
-        epsilon = 1.0e-6  # normalized step size. TODO use as input
-        min_abs_x = 1.0e-3  # only used if x is really small
-        x_dim = len(xk)  # dimension of problem
-        hs = []  # store deltas
-        xs = []  # put in to function
-        # [xk, xi+h, xi-h, xj+h, xj-h,...]
-        xs.append(xk)
-        # we are using central differencing
-        for i in range(0, x_dim):
-            x_i = xk[i]
-            h_i = max(abs(x_i), min_abs_x) * epsilon
-            hs.append(h_i)
-            x_copy_plus = deepcopy(xk)
-            x_copy_plus[i] = x_i + h_i
-            x_copy_minus = deepcopy(xk)
-            x_copy_minus[i] = x_i - h_i
-            xs.append(x_copy_plus)
-            xs.append(x_copy_minus)
-
-        # call the function with additional inputs
-        ys = func(xs, *args)
+    def _evaluate_func_with_derivative(self, xk, func, *args, scheme=None,
+                                       relative_step=None):
+        """Evaluate a function and differentiate it by finite differences.
 
-        # This is the output
-        yk = ys[0]
-        y_dim = len(yk)
+        The function has to take an array of input values, one per row, and return an
+        array of outputs, one per row, e.g. it has to be able to propagate more than 1
+        state. It is called once, with all the perturbed inputs.
 
-        # All the delta ys
-        y_h = ys[1:]
+        Args:
+            xk (array-like) - point at which to evaluate
+            func (callable) - function to evaluate
+            *args (args, optional) - any other arguments to be passed to func
+            scheme (DifferenceScheme) - finite difference scheme. Defaults to the
+                module's.
+            relative_step (float) - step of each input, relative to its magnitude.
+                Defaults to the module's.
 
-        # make matrix of zeros
-        dy_dx = np.zeros((y_dim, x_dim))
+        Returns:
+            yk (numpy.ndarray) - output of func at xk
+            dy_dx (numpy.ndarray) - matrix of dy/dx
+        """
+        scheme = scheme or self.scheme
+        relative_step = relative_step or self.relative_step
 
-        for i in range(0, x_dim):
-            h_i = hs[i]
-            dy_dxi = (np.array(y_h[2*i]) - np.array(y_h[2*i+1])) / (2.0 * h_i)
-            dy_dx[:, i] = dy_dxi
+        xs, hs = self._perturb(np.asarray(xk, dtype=np.float64), scheme, relative_step)
 
-        dy_dx_matrix = np.matrix(dy_dx)
+        # call the function with additional inputs
+        ys = np.asarray(func(xs, *args), dtype=np.float64)
 
-        return (yk, dy_dx_matrix)
+        return ys[0], self._differentiate(ys, hs, scheme)
 
-    def run_stm_propagation(self, propagation_params, opm_params, only_dV=False):
+    def run_stm_propagation(self, propagation_params, opm_params, only_dV=False,
+                            scheme=None, relative_step=None):
         """ Generates a state transition matrix for the propagation described by the
             given parameters. Does so by nudging the state vector given in opm_params
             in several different directions and combining the results of propagating
@@ -159,14 +238,20 @@ class StmPropagationModule(object):
                     state vector that will be varied. Keplerian elements not supported.
                 only_dV (bool):
                     If True, only find the STM with respect to the velocity
+                scheme (DifferenceScheme):
+                    Finite difference scheme, which sets the number of propagations
+                    (see count_propagations()). Defaults to the module's.
+                relative_step (float):
+                    Step of each input, relative to its magnitude. Defaults to the
+                    module's.
 
             Returns:
-                end_state (list):
+                end_state (numpy.ndarray):
                     Final state vector of nominal propagation [rx, ry, rz, vx, vy, vz]
                     [km, km/s]
-                stm (matrix):
-                    STM describing effect of changes to final state due to
-                    initial state (or velocity)
+                stm (numpy.ndarray):
+                    (6, 6) STM (or (6, 3) if only_dV) describing effect of changes to
+                    final state due to initial state (or velocity)
         """
         if opm_params.get_state_vector() is None:
             raise KeyError('Only coordinates specified via a state vector are supported.')
@@ -176,17 +261,88 @@ class StmPropagationModule(object):
         if only_dV:
             # STM = dRV1/dV0
             initial_velocity = initial_state[3:6]
-            print(initial_velocity)
             end_state, stm = self._evaluate_func_with_derivative(
                 initial_velocity, self._propagate_states_delta_velocities,
-                initial_state, propagation_params, opm_params
+                initial_state, propagation_params, opm_params,
+                scheme=scheme, relative_step=relative_step
             )
 
         else:
             # STM = dRV1/dRV0
             end_state, stm = self._evaluate_func_with_derivative(
                 initial_state, self._propagate_states,
-                propagation_params, opm_params
+                propagation_params, opm_params,
+                scheme=scheme, relative_step=relative_step
             )
 
         return end_state, stm
+
+    def run_stm_propagations(self, propagation_params, opm_params, only_dV=False,
+                             scheme=None, relative_step=None):
+        """ Generates state transition matrices for many propagations at once, as
+            run_stm_propagation() does for one. The propagations for all of them are
+            submitted, polled and retrieved as a single sweep (see RunScheduler), or as
+            one job per STM all submitted at once if the module has a processing
+            service, so many STMs take about as long as the server needs to run the
+            propagations, rather than one round trip per STM.
+
+            Args:
+                propagation_params (PropagationParams or list<PropagationParams>):
+                    Propagation-related parameters shared by all STMs, or one per STM.
+                    Propagations in different projects are run concurrently.
+                opm_params (list<OpmParams>):
+                    OPM-related parameters, one per STM, each including the nominal
+                    state vector to be varied. Keplerian elements not supported.
+                only_dV (bool):
+                    If True, only find the STMs with respect to the velocity
+                scheme (DifferenceScheme):
+                    Finite difference scheme. Defaults to the module's.
+                relative_step (float):
+                    Step of each input, relative to its magnitude. Defaults to the
+                    module's.
+
+            Returns:
+                end_states (numpy.ndarray):
+                    (K, 6) final state vectors of the K nominal propagations
+                stms (numpy.ndarray):
+                    (K, 6, 6) STMs (or (K, 6, 3) if only_dV), in the order of opm_params
+        """
+        scheme = scheme or self.scheme
+        relative_step = relative_step or self.relative_step
+        groups, steps = self._build_stm_groups(propagation_params, opm_params, only_dV,
+                                               scheme, relative_step)
+
+        end_states = np.array(self._propagate_state_groups(groups), dtype=np.float64)
+        stms = self._differentiate(end_states, steps, scheme)
+        return end_states[:, 0, :], stms
+
+    def _build_stm_groups(self, propagation_params, opm_params, only_dV, scheme,
+                          relative_step):
+        """Builds the propagations needed for the STMs of run_stm_propagations().
+
+        Returns:
+            groups (list<tuple>): the groups of propagations for _propagate_state_groups(),
+                one per STM, each starting with the nominal state.
+            steps (numpy.ndarray): (K, n) the steps of each STM, for _differentiate().
+        """
+        count = len(opm_params)
+        if not isinstance(propagation_params, (list, tuple)):
+            propagation_params = [propagation_params] * count
+        if len(propagation_params) != count:
+            raise ValueError("Expected %s propagation params, got %s" %
+                             (count, len(propagation_params)))
+
+        groups = []
+        steps = []
+        for params, opm in zip(propagation_params, opm_params):
+            if opm.get_state_vector() is None:
+                raise KeyError('Only coordinates specified via a state vector are supported.')
+            initial_state = np.asarray(opm.get_state_vector(), dtype=np.float64)
+            if only_dV:
+                xs, hs = self._perturb(initial_state[3:6], scheme, relative_step)
+                xs = np.hstack([np.tile(initial_state[0:3], (len(xs), 1)), xs])
+            else:
+                xs, hs = self._perturb(initial_state, scheme, relative_step)
+            steps.append(hs)
+            groups.append((params, opm, xs))
+        return groups, np.array(steps)
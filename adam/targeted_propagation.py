@@ -181,5 +181,5 @@ class TargetedPropagations(AdamObjects):
 
         return targeted_propagation
 
-    def get_children(self, uuid):
+    def get_children(self, uuid, rate_limiter=None):
         return []
@@ -0,0 +1,189 @@
+"""
+    unscented_propagation.py
+"""
+
+import numpy as np
+
+from adam.astro_utils import keplerian_to_cartesian
+from adam.linear_covariance import _square_root
+from adam.linear_covariance import _without_uncertainty
+from adam.linear_covariance import covariance_from_lower_triangle
+from adam.linear_covariance import lower_triangle_from_covariance
+
+# Order of the keplerian elements in keplerian covariances.
+KEPLERIAN_ELEMENT_NAMES = ['semi_major_axis_km', 'eccentricity', 'inclination_deg',
+                           'ra_of_asc_node_deg', 'arg_of_pericenter_deg']
+
+
+class UnscentedResults(object):
+    """Outcome of UnscentedPropagation.run() for K objects (or epochs)."""
+
+    def __init__(self, means, covariances, end_states):
+        self._means = means
+        self._covariances = covariances
+        self._end_states = end_states
+
+    def __repr__(self):
+        return "Unscented results [%s objects]" % len(self._means)
+
+    def get_means(self):
+        """ Returns the (K, 6) propagated mean states [km, km/s]. """
+        return self._means
+
+    def get_covariances(self):
+        """ Returns the (K, 6, 6) propagated covariances. """
+        return self._covariances
+
+    def get_covariance_lower_triangles(self):
+        """ Returns the (K, 21) propagated covariances, as the lower triangular values
+            taken by OpmParams and BulkOpmGenerator.
+        """
+        return lower_triangle_from_covariance(self._covariances)
+
+    def get_end_states(self):
+        """ Returns the (K, 13, 6) final states of the propagated sigma points. """
+        return self._end_states
+
+
+class UnscentedPropagation(object):
+    """Propagates uncertainty with the unscented transform: 2n + 1 = 13 sigma points are
+    chosen per object to match the mean and covariance of its initial state, and the
+    propagated mean and covariance are rebuilt from their end states. Unlike a linear
+    propagation this captures mild nonlinearity of the dynamics, at a few percent of the
+    propagations of a large Monte Carlo run.
+
+    Sigma points are spread along the columns of the square root of (n + lambda) P, with
+    lambda = alpha^2 (n + kappa) - n, and weighted as in the scaled unscented transform
+    (Wan and van der Merwe).
+    """
+
+    def __init__(self, stm_module, alpha=1.0, beta=2.0, kappa=0.0):
+        """
+        Args:
+            stm_module (StmPropagationModule): Module whose batches module runs the
+                propagations of the sigma points, as one managed run.
+            alpha (float): Spread of the sigma points around the mean.
+            beta (float): Prior knowledge of the distribution; 2 is optimal for
+                gaussians.
+            kappa (float): Secondary scaling of the spread.
+        """
+        self.stm_module = stm_module
+        self.alpha = alpha
+        self.beta = beta
+        self.kappa = kappa
+
+    def __repr__(self):
+        return "UnscentedPropagation"
+
+    def get_weights(self, n=6):
+        """ Returns the (2n + 1,) weights of the sigma points for the mean and those for
+            the covariance.
+        """
+        lam = self.alpha ** 2 * (n + self.kappa) - n
+        mean_weights = np.full(2 * n + 1, 1.0 / (2.0 * (n + lam)))
+        mean_weights[0] = lam / (n + lam)
+        covariance_weights = mean_weights.copy()
+        covariance_weights[0] += 1.0 - self.alpha ** 2 + self.beta
+        return mean_weights, covariance_weights
+
+    def get_sigma_points(self, means, covariances):
+        """ Computes the sigma points of the given distributions.
+
+        Args:
+            means (array-like): (..., n) means.
+            covariances (array-like): (..., n, n) covariances.
+
+        Returns:
+            numpy.ndarray: (..., 2n + 1, n) sigma points: the mean, then the mean plus and
+            minus each column of the scaled square root of the covariance.
+        """
+        means = np.asarray(means, dtype=np.float64)
+        n = means.shape[-1]
+        lam = self.alpha ** 2 * (n + self.kappa) - n
+        offsets = np.swapaxes(_square_root((n + lam) * np.asarray(covariances)), -1, -2)
+        means = means[..., np.newaxis, :]
+        return np.concatenate([means, means + offsets, means - offsets], axis=-2)
+
+    def _get_initial_sigma_points(self, opm_params, covariances):
+        """Returns the (K, 13, 6) cartesian sigma points and the OPM templates to
+        propagate them with."""
+        if covariances is not None:
+            states = [opm.get_state_vector() for opm in opm_params]
+            if any(state is None for state in states):
+                raise KeyError('Only coordinates specified via a state vector are supported.')
+            covariances = covariance_from_lower_triangle(covariances)
+            if len(covariances) != len(opm_params):
+                raise ValueError("Expected %s covariances, got %s" %
+                                 (len(opm_params), len(covariances)))
+            return (self.get_sigma_points(states, covariances),
+                    [_without_uncertainty(opm) for opm in opm_params])
+
+        sigma_points = []
+        templates = []
+        for index, opm in enumerate(opm_params):
+            elements = opm.get_keplerian_elements()
+            if elements and opm.get_keplerian_covariance() is not None:
+                # Same precedence as the OPM, whose covariance is of the rendered anomaly.
+                mean_anomaly = opm._using_mean_anomaly()
+                anomaly = elements['mean_anomaly_deg' if mean_anomaly else 'true_anomaly_deg']
+                element_points = self.get_sigma_points(
+                    [elements[name] for name in KEPLERIAN_ELEMENT_NAMES] + [anomaly],
+                    covariance_from_lower_triangle(opm.get_keplerian_covariance()))
+                try:
+                    points = keplerian_to_cartesian(element_points, elements['gm'],
+                                                    mean_anomaly)
+                except ValueError as e:
+                    raise ValueError("Keplerian sigma points of object %s are not all valid "
+                                     "orbits: %s Try a smaller alpha." % (index, e))
+                # The server would take the elements over the state vectors, so the
+                # template carries the state vector alone.
+                template = _without_uncertainty(opm).replace(keplerian_elements=None,
+                                                             state_vector=points[0].tolist())
+            elif opm.get_covariance() is not None and opm.get_state_vector() is not None:
+                points = self.get_sigma_points(
+                    opm.get_state_vector(), covariance_from_lower_triangle(opm.get_covariance()))
+                template = _without_uncertainty(opm)
+            else:
+                raise ValueError("Each OPM params needs a cartesian covariance with a state "
+                                 "vector, or a keplerian covariance with keplerian elements, "
+                                 "unless covariances are given.")
+            sigma_points.append(points)
+            templates.append(template)
+        return np.array(sigma_points), templates
+
+    def run(self, propagation_params, opm_params, covariances=None):
+        """ Propagates the uncertainty of many objects (or epochs) at once. The sigma
+            points of all objects are propagated together.
+
+            Args:
+                propagation_params (PropagationParams or list<PropagationParams>):
+                    Propagation-related parameters shared by all objects, or one per
+                    object.
+                opm_params (list<OpmParams>):
+                    OPM-related parameters, one per object. The sigma points are drawn
+                    from the keplerian covariance around the keplerian elements if given
+                    (in the units of the elements, i.e. km and degrees), otherwise from
+                    the cartesian covariance around the state vector.
+                covariances (array-like):
+                    (K, 21) lower triangular cartesian covariances around the state
+                    vectors, used instead of those of the OPM params.
+
+            Returns:
+                UnscentedResults: the propagated means and covariances.
+        """
+        count = len(opm_params)
+        if not isinstance(propagation_params, (list, tuple)):
+            propagation_params = [propagation_params] * count
+        if len(propagation_params) != count:
+            raise ValueError("Expected %s propagation params, got %s" %
+                             (count, len(propagation_params)))
+
+        sigma_points, templates = self._get_initial_sigma_points(opm_params, covariances)
+        end_states = np.array(self.stm_module._propagate_state_groups(
+            list(zip(propagation_params, templates, sigma_points))), dtype=np.float64)
+
+        mean_weights, covariance_weights = self.get_weights(end_states.shape[-1])
+        means = np.einsum('i,kij->kj', mean_weights, end_states)
+        deviations = end_states - means[:, np.newaxis, :]
+        propagated = np.einsum('i,kij,kil->kjl', covariance_weights, deviations, deviations)
+        return UnscentedResults(means, propagated, end_states)
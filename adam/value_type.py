@@ -0,0 +1,93 @@
+"""
+    value_type.py
+"""
+
+
+class ValueType(object):
+    """Base class of compact, immutable value types.
+
+    Subclasses declare their fields in __slots__, so instances carry no per-instance
+    dict. Each field can only be set once, normally by __init__, after which the instance
+    is read-only: replace() makes a modified copy instead, sharing every unchanged field
+    with the original, so per-run variants of a template are cheap to build. Since
+    instances never change, copy.copy() and copy.deepcopy() return the instance itself.
+
+    Fields named in _FROZEN_FIELDS are copied when set (sequences to tuples), so that
+    later changes to the caller's lists cannot change the instance behind its back. Values
+    returned by the getters are shared between copies, and must not be modified.
+    """
+
+    __slots__ = ()
+
+    # Fields holding values computed from the other fields, which replace() must not
+    # carry over to copies.
+    _DERIVED_FIELDS = ()
+
+    # Fields holding sequences (stored as tuples) or dicts, copied from what is given.
+    _FROZEN_FIELDS = ()
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError("%s is immutable, use replace() to get a modified copy" %
+                                 type(self).__name__)
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self._get_fields()
+                if hasattr(self, name) and name not in self._DERIVED_FIELDS}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    @classmethod
+    def _get_fields(cls):
+        fields = cls.__dict__.get('_fields')
+        if fields is None:
+            fields = tuple(name for klass in reversed(cls.__mro__)
+                           for name in klass.__dict__.get('__slots__', ()))
+            type.__setattr__(cls, '_fields', fields)
+        return fields
+
+    def replace(self, **changes):
+        """Returns a copy of this object with the given fields changed.
+
+        Fields are named as their getters are, without the get_ prefix, e.g.
+        replace(state_vector=[...]) changes what get_state_vector() returns.
+
+        Raises:
+            KeyError if a named field does not exist.
+        """
+        state = self.__getstate__()
+        for name, value in changes.items():
+            field = '_' + name
+            if field not in self._get_fields() or field in self._DERIVED_FIELDS:
+                raise KeyError("Unexpected fields provided: %s" % name)
+            state[field] = _freeze(value) if field in self._FROZEN_FIELDS else value
+        copy = object.__new__(type(self))
+        copy.__setstate__(state)
+        copy._check_replaced(changes)
+        return copy
+
+    def _check_replaced(self, changes):
+        """Validates the fields changed by replace(). Raises if they are invalid."""
+        pass
+
+
+def _freeze(value):
+    """Returns a copy of the given value which the caller does not hold: a tuple for a
+    sequence, a new dict for a dict. None is kept as is."""
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return dict(value)
+    return tuple(value)
@@ -1,7 +1,12 @@
 from adam.adam_objects import AdamObject
 from adam.adam_objects import AdamObjects
 from adam.adam_objects import AdamObjectRunnableState
+from adam.adam_objects import CHILD_FETCH_WORKERS
 from adam.rest_proxy import _RestProxyForTest
+
+from multiprocessing.dummy import Pool as ThreadPool
+import threading
+import time
 import unittest
 
 
@@ -190,7 +195,8 @@ class AdamObjectsTest(unittest.TestCase):
             "/adam_object/single/ChildType/childUuid1", 200, {'anyJson': 5})
         rest.expect_get("/adam_object/runnable_state/single/ChildType/childUuid1", 200,
                         {'uuid': 'childUuid1', 'calculationState': 'COMPLETED'})
-        children_json = adam_objects._get_children_json('uuid1')
+        # The test proxy expects requests in order, so make them one at a time.
+        children_json = adam_objects._get_children_json('uuid1', max_workers=1)
         self.assertEqual(1, len(children_json))
         child_json, child_runnable_state, child_type = children_json[0]
         self.assertEqual({'anyJson': 5}, child_json)
@@ -199,6 +205,15 @@ class AdamObjectsTest(unittest.TestCase):
         self.assertIsNone(child_runnable_state.get_error())
         self.assertEqual('ChildType', child_type)
 
+        # Without the json, only the runnable states are requested.
+        rest.expect_get("/adam_object/by_parent/MyType/uuid1", 200,
+                        {'childTypes': ['ChildType'], 'childUuids': ['childUuid1']})
+        rest.expect_get("/adam_object/runnable_state/single/ChildType/childUuid1", 200,
+                        {'uuid': 'childUuid1', 'calculationState': 'COMPLETED'})
+        children_json = adam_objects._get_children_json('uuid1', with_json=False)
+        self.assertEqual({'uuid': 'childUuid1'}, children_json[0][0])
+        self.assertEqual('COMPLETED', children_json[0][1].get_calc_state())
+
         rest.expect_get("/adam_object/by_parent/MyType/uuid1", 404, {})
         json = adam_objects._get_children_json('uuid1')
         self.assertEqual([], json)
@@ -207,6 +222,72 @@ class AdamObjectsTest(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             adam_objects._get_children_json('uuid1')
 
+    def test_get_children_json_concurrently(self):
+        class UnorderedRest(object):
+            def get(self, path):
+                parts = path.split('/')
+                if parts[2] == 'by_parent':
+                    return 200, {'childTypes': ['ChildType'] * 20,
+                                 'childUuids': ['child%s' % i for i in range(20)]}
+                if parts[2] == 'runnable_state':
+                    return 200, {'uuid': parts[-1], 'calculationState': 'COMPLETED'}
+                return 200, {'uuid': parts[-1]}
+
+        adam_objects = AdamObjects(UnorderedRest(), 'MyType')
+        children_json = adam_objects._get_children_json('uuid1', max_workers=4)
+        self.assertEqual(['child%s' % i for i in range(20)],
+                         [c[0]['uuid'] for c in children_json])
+        self.assertEqual(['child%s' % i for i in range(20)],
+                         [c[1].get_uuid() for c in children_json])
+        self.assertEqual(['ChildType'] * 20, [c[2] for c in children_json])
+
+    def test_get_children_json_bounded_overall(self):
+        class CountingRest(object):
+            def __init__(self):
+                self.lock = threading.Lock()
+                self.in_flight = 0
+                self.max_in_flight = 0
+
+            def get(self, path):
+                parts = path.split('/')
+                if parts[2] == 'by_parent':
+                    return 200, {'childTypes': ['ChildType'] * 20,
+                                 'childUuids': ['child%s' % i for i in range(20)]}
+                with self.lock:
+                    self.in_flight += 1
+                    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                time.sleep(0.002)
+                with self.lock:
+                    self.in_flight -= 1
+                if parts[2] == 'runnable_state':
+                    return 200, {'uuid': parts[-1], 'calculationState': 'COMPLETED'}
+                return 200, {'uuid': parts[-1]}
+
+        class CountingLimiter(object):
+            def __init__(self):
+                self.acquired = 0
+                self.lock = threading.Lock()
+
+            def acquire(self):
+                with self.lock:
+                    self.acquired += 1
+
+        # Parents retrieved from several threads at once share the bound on concurrent
+        # requests, and the rate limiter.
+        rest = CountingRest()
+        limiter = CountingLimiter()
+        adam_objects = AdamObjects(rest, 'MyType')
+        pool = ThreadPool(5)
+        children = pool.map(
+            lambda uuid: adam_objects._get_children_json(uuid, rate_limiter=limiter),
+            ['uuid%s' % i for i in range(5)])
+        pool.close()
+        pool.join()
+
+        self.assertEqual([20] * 5, [len(c) for c in children])
+        self.assertLessEqual(rest.max_in_flight, CHILD_FETCH_WORKERS)
+        self.assertEqual(5 * 40, limiter.acquired)
+
     def test_delete(self):
         rest = _RestProxyForTest()
         adam_objects = AdamObjects(rest, 'MyType')
@@ -0,0 +1,85 @@
+from adam.adaptive_submitter import AdaptiveSubmitter
+from adam.errors import RequestTimeoutError
+
+import threading
+import unittest
+
+
+class AdaptiveSubmitterTest(unittest.TestCase):
+    """Unit tests for AdaptiveSubmitter
+
+    """
+
+    def test_results_in_order(self):
+        submitter = AdaptiveSubmitter(initial_chunk_size=3, max_threads=4)
+        chunks = []
+        lock = threading.Lock()
+
+        def submit_chunk(items):
+            with lock:
+                chunks.append(list(items))
+            return [i * 10 for i in items]
+
+        items = list(range(100))
+        results = submitter.submit(items, submit_chunk, item_size=lambda i: 100)
+        self.assertEqual([i * 10 for i in items], results)
+
+        # Every item was submitted exactly once.
+        self.assertEqual(items, sorted(i for c in chunks for i in c))
+        self.assertEqual(3, len(chunks[0]))
+        self.assertLessEqual(submitter.get_stats()['max_threads_used'], 4)
+
+    def test_chunks_limited_by_bytes(self):
+        submitter = AdaptiveSubmitter(initial_chunk_size=10, max_chunk_bytes=250,
+                                      max_threads=1)
+        chunks = []
+
+        def submit_chunk(items):
+            chunks.append(list(items))
+            return items
+
+        submitter.submit(list(range(10)), submit_chunk, item_size=lambda i: 100)
+        self.assertEqual([[0, 1], [2, 3], [4, 5], [6, 7], [8, 9]], chunks)
+
+    def test_timeouts_split_and_retry(self):
+        submitter = AdaptiveSubmitter(initial_chunk_size=8, max_threads=1)
+        chunks = []
+
+        def submit_chunk(items):
+            chunks.append(list(items))
+            if len(items) > 2:
+                raise RequestTimeoutError("too big")
+            return [-i for i in items]
+
+        results = submitter.submit(list(range(8)), submit_chunk)
+        self.assertEqual([-i for i in range(8)], results)
+        self.assertEqual([0, 1, 2, 3, 4, 5, 6, 7], chunks[0])
+        self.assertEqual([0, 1, 2, 3], chunks[1])
+        self.assertEqual([0, 1], chunks[2])
+        self.assertGreater(submitter.get_stats()['timeouts'], 0)
+
+    def test_timeout_at_minimum_size_is_raised(self):
+        submitter = AdaptiveSubmitter(initial_chunk_size=4, max_threads=2)
+
+        def submit_chunk(items):
+            raise RequestTimeoutError("always")
+
+        with self.assertRaises(RequestTimeoutError):
+            submitter.submit(list(range(4)), submit_chunk)
+
+    def test_other_errors_are_raised(self):
+        submitter = AdaptiveSubmitter(max_threads=3)
+
+        def submit_chunk(items):
+            raise RuntimeError("Server status code: 500")
+
+        with self.assertRaises(RuntimeError):
+            submitter.submit(list(range(1000)), submit_chunk)
+
+    def test_empty(self):
+        submitter = AdaptiveSubmitter()
+        self.assertEqual([], submitter.submit([], lambda items: items))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
 import unittest
 
+import numpy as np
+import numpy.testing as npt
+
 import adam.astro_utils as astro_utils
 
 JPL_ECLIPTIC_X = -3.027985514061421E+08
@@ -41,3 +44,39 @@ class AstroUtilsTest(unittest.TestCase):
         self.assertAlmostEqual(ICRF_VX, icrf_pos_vel[3], 15)
         self.assertAlmostEqual(ICRF_VY, icrf_pos_vel[4], 14)
         self.assertAlmostEqual(ICRF_VZ, icrf_pos_vel[5], 14)
+
+    def test_keplerian_to_cartesian(self):
+        gm = 398600.4418
+        # Circular equatorial orbit, a quarter turn past pericenter.
+        state = astro_utils.keplerian_to_cartesian([7000.0, 0.0, 0.0, 0.0, 0.0, 90.0], gm)
+        npt.assert_allclose([0.0, 7000.0, 0.0, -np.sqrt(gm / 7000.0), 0.0, 0.0], state,
+                            atol=1e-9)
+
+        # The same elliptical orbit given by true and by mean anomaly.
+        e = 0.3
+        true_anomaly = np.deg2rad(123.0)
+        eccentric = 2.0 * np.arctan(np.sqrt((1 - e) / (1 + e)) * np.tan(true_anomaly / 2))
+        mean_anomaly = np.rad2deg(eccentric - e * np.sin(eccentric))
+        elements = np.array([[1.5e8, e, 10.0, 40.0, 60.0, 123.0],
+                             [1.5e8, e, 10.0, 40.0, 60.0, mean_anomaly]])
+        states = astro_utils.keplerian_to_cartesian(elements[0], 1.327e11)
+        npt.assert_allclose(states, astro_utils.keplerian_to_cartesian(
+            elements[1:], 1.327e11, mean_anomaly=True)[0], rtol=1e-10)
+
+        # Energy and angular momentum match the elements.
+        r = np.linalg.norm(states[0:3])
+        v = np.linalg.norm(states[3:6])
+        self.assertAlmostEqual(1.5e8, 1.0 / (2.0 / r - v * v / 1.327e11), delta=1e-3)
+        h = np.cross(states[0:3], states[3:6])
+        self.assertAlmostEqual(10.0, np.rad2deg(np.arccos(h[2] / np.linalg.norm(h))), 10)
+
+        with self.assertRaises(ValueError):
+            astro_utils.keplerian_to_cartesian([1e5, 1.5, 0, 0, 0, 10], gm, mean_anomaly=True)
+
+        # Hyperbolas are fine with a true anomaly within their asymptotes, but elements
+        # that describe no orbit at all are rejected.
+        astro_utils.keplerian_to_cartesian([-1e5, 1.5, 0, 0, 0, 10], gm)
+        for invalid in [[7000.0, -0.01, 0, 0, 0, 10], [-1e5, 1.5, 0, 0, 0, 150],
+                        [1e5, 1.5, 0, 0, 0, 10], [7000.0, 1.0, 0, 0, 0, 10]]:
+            with self.assertRaises(ValueError):
+                astro_utils.keplerian_to_cartesian([[7000.0, 0.1, 0, 0, 0, 10], invalid], gm)
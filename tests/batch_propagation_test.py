@@ -3,7 +3,12 @@ from adam import BatchPropagations
 from adam import PropagationParams
 from adam import OpmParams
 from adam.adam_objects import AdamObjects
+from adam.batch_propagation import SinglePropagation
+from adam.batch_propagation import stack_final_states
 
+import numpy as np
+import numpy.testing as npt
+import threading
 import unittest
 
 
@@ -30,6 +35,31 @@ class BatchPropagationTest(unittest.TestCase):
         self.assertEqual([[1, 2, 3, 4, 5, 6, 7], [7, 6, 5, 4, 3, 2, 1]],
                          batch_prop.get_final_state_vectors())
 
+    def test_final_state_arrays(self):
+        batch_prop = BatchPropagation({}, {})
+        self.assertIsNone(batch_prop.get_final_state_array())
+
+        batch_prop.set_summary('1000 2000 3000 4000 5000 6000\n6000 5000 4000 3000 2000 1000\n')
+        states = batch_prop.get_final_state_array()
+        self.assertEqual((2, 6), states.shape)
+        self.assertEqual(np.float64, states.dtype)
+        npt.assert_equal([[1, 2, 3, 4, 5, 6], [6, 5, 4, 3, 2, 1]], states)
+
+        batch_prop.set_summary('')
+        self.assertEqual((0, 6), batch_prop.get_final_state_array().shape)
+
+        children = [SinglePropagation({}, {}) for _ in range(3)]
+        children[0].set_final_state_vector('1000 2000 3000 4000 5000 6000')
+        children[2].set_final_state_vector('6000 5000 4000 3000 2000 1000')
+        self.assertEqual([1, 2, 3, 4, 5, 6], children[0].get_final_state_vector())
+        self.assertIsNone(children[1].get_final_state_vector())
+
+        states = stack_final_states(children)
+        self.assertEqual((3, 6), states.shape)
+        npt.assert_equal([1, 2, 3, 4, 5, 6], states[0])
+        self.assertTrue(np.isnan(states[1]).all())
+        npt.assert_equal([6, 5, 4, 3, 2, 1], states[2])
+
 
 class BatchPropagationsTest(unittest.TestCase):
     """Unit tests for BatchPropagations module
@@ -208,6 +238,76 @@ class BatchPropagationsTest(unittest.TestCase):
 
         AdamObjects._get_json = tmp_get_json
 
+    def test_get_children_lazy_ephemeris(self):
+        test = self
+
+        class FakeRest(object):
+            def __init__(self):
+                self.ephemeris_fetches = 0
+                self.count = 2
+                self.lock = threading.Lock()
+
+            def get(self, path):
+                parts = path.split('/')
+                if parts[2] == 'by_parent':
+                    return 200, {'childTypes': ['SinglePropagation'] * self.count,
+                                 'childUuids': ['c%s' % i for i in range(self.count)]}
+                if parts[2] == 'runnable_state':
+                    return 200, {'uuid': parts[-1], 'calculationState': 'COMPLETED'}
+                with self.lock:
+                    self.ephemeris_fetches += 1
+                return 200, {
+                    'uuid': parts[-1],
+                    'propagationParameters': {
+                        'start_time': 'AAA',
+                        'end_time': 'BBB',
+                        'step_duration_sec': '0',
+                        'propagator_uuid': '00000000-0000-0000-0000-000000000001',
+                        'executor': 'stk',
+                        'opm': test.dummy_opm_params_as_api_response,
+                    },
+                    'ephemeris': 'ephemeris of ' + parts[-1],
+                    'finalStateVector': '1000 2000 3000 4000 5000 6000',
+                }
+
+        rest = FakeRest()
+        children = BatchPropagations(rest).get_children('parent')
+        self.assertEqual(2, rest.ephemeris_fetches)
+        self.assertEqual('ephemeris of c0', children[0].get_ephemeris())
+
+        rest = FakeRest()
+        children = BatchPropagations(rest, lazy_ephemeris=True).get_children('parent')
+        # Nothing but the uuids and runnable states is retrieved up front.
+        self.assertEqual(0, rest.ephemeris_fetches)
+        self.assertEqual(['c0', 'c1'], [c.get_uuid() for c in children])
+        self.assertEqual('COMPLETED', children[1].get_runnable_state().get_calc_state())
+
+        # The ephemeris of a child is fetched on first access to it only, along with the
+        # details of that child.
+        self.assertEqual('ephemeris of c0', children[0].get_ephemeris())
+        self.assertEqual('ephemeris of c0', children[0].get_ephemeris())
+        self.assertEqual(1, rest.ephemeris_fetches)
+        self.assertEqual([1, 2, 3, 4, 5, 6], children[0].get_final_state_vector())
+        self.assertEqual(1, rest.ephemeris_fetches)
+
+        # The details of the other children are fetched together. Their ephemerides are
+        # kept compressed, and served from there rather than fetched again.
+        self.assertEqual([1, 2, 3, 4, 5, 6], children[1].get_final_state_vector())
+        self.assertEqual('AAA', children[1].get_propagation_params().get_start_time())
+        self.assertEqual(2, rest.ephemeris_fetches)
+        self.assertIsNone(children[1]._ephemeris)
+        self.assertEqual('ephemeris of c1', children[1].get_ephemeris())
+        self.assertEqual('ephemeris of c1', children[1].get_ephemeris())
+        self.assertEqual(2, rest.ephemeris_fetches)
+
+        # The final states of many children are fetched concurrently.
+        rest = FakeRest()
+        rest.count = 40
+        children = BatchPropagations(rest, lazy_ephemeris=True).get_children('parent')
+        states = stack_final_states(children)
+        self.assertEqual((40, 6), states.shape)
+        self.assertEqual(40, rest.ephemeris_fetches)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,10 +2,20 @@ from adam.batch_run_manager import BatchRunManager
 from adam.batch import Batch
 from adam.batch import StateSummary
 from adam.batch import PropagationResults
+from adam.batch import ResultRetention
+from adam.batches import Batches
+from adam.events import EventType
 from adam.opm_params import OpmParams
+from adam.opm_parser import parse_opm
 from adam.propagation_params import PropagationParams
+from adam.result_cache import ResultCache
+from adam.retry_policy import RetryPolicy
+from adam.run_manifest import RunManifest
 
+import os
+import tempfile
 import unittest
+from unittest import mock
 
 
 class MockBatches:
@@ -28,6 +38,9 @@ class MockBatches:
             raise AssertionError("Did not expect any calls")
 
         expectation = self.expected_get_results.pop(0)
+        # Expectations may name the batch by uuid when the summary object is not known.
+        if isinstance(expectation[0], str):
+            batch = batch.get_uuid()
         if not expectation[0] == batch:
             raise AssertionError("Expected call to get_propagation_results with %s, got %s" %
                                  (expectation[0], batch))
@@ -64,14 +77,98 @@ class MockBatches:
             raise AssertionError("Still expecting call to get_batch_states")
 
 
-def get_dummy_batch(project):
+class FakeBatchesServer:
+    """Assigns uuids on submission and completes every batch on the next poll."""
+
+    def __init__(self):
+        self.submitted = []
+        self.pending = []
+        self.max_pending = 0
+
+    def new_batches(self, batch_params):
+        summaries = []
+        for pair in batch_params:
+            uuid = 'b%s' % len(self.submitted)
+            self.submitted.append(pair[1].get_state_vector()[0])
+            self.pending.append(uuid)
+            summaries.append(StateSummary({'uuid': uuid, 'calc_state': 'PENDING'}))
+        self.max_pending = max(self.max_pending, len(self.pending))
+        return summaries
+
+    def get_summaries(self, project):
+        summaries = {uuid: StateSummary({'uuid': uuid, 'calc_state': 'COMPLETED'})
+                     for uuid in self.pending}
+        self.pending = []
+        return summaries
+
+    def get_propagation_results(self, state_summary, **kwargs):
+        return state_summary.get_uuid() + ' results'
+
+
+class FlakyBatchesServer(FakeBatchesServer):
+    """Fails the first attempts of batches with the given state vector x components."""
+
+    def __init__(self, failures):
+        FakeBatchesServer.__init__(self)
+        self.failures = failures
+        self.summaries = {}
+
+    def get_summaries(self, project):
+        summaries = self.summaries
+        for uuid in self.pending:
+            x = self.submitted[int(uuid[1:])]
+            if self.failures.get(x, 0) > 0:
+                self.failures[x] -= 1
+                summaries[uuid] = StateSummary({'uuid': uuid, 'calc_state': 'FAILED',
+                                                'error': 'Worker timeout (%s)' % x})
+            else:
+                summaries[uuid] = StateSummary({'uuid': uuid, 'calc_state': 'COMPLETED'})
+        self.pending = []
+        return summaries
+
+
+class FlakyBatchesRest(object):
+    """Rest proxy of a batches server failing the first attempts of batches with the given
+    state vector x components, completing the others on the next listing."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.submitted = []
+        self.batches = {}
+
+    def post(self, path, data_dict, **kwargs):
+        assert path == '/batches'
+        responses = []
+        for request in data_dict['requests']:
+            uuid = 'b%s' % len(self.submitted)
+            self.submitted.append(parse_opm(request['opm_string']).get_state_vector()[0])
+            self.batches[uuid] = {'uuid': uuid, 'calc_state': 'PENDING', 'parts_count': 1}
+            responses.append(dict(self.batches[uuid]))
+        return 200, {'requests': responses}
+
+    def get(self, path, **kwargs):
+        if path.startswith('/batch?project_uuid='):
+            for uuid, batch in self.batches.items():
+                if batch['calc_state'] != 'PENDING':
+                    continue
+                x = self.submitted[int(uuid[1:])]
+                if self.failures.get(x, 0) > 0:
+                    self.failures[x] -= 1
+                    batch['calc_state'] = 'FAILED'
+                else:
+                    batch['calc_state'] = 'COMPLETED'
+            return 200, {'items': [dict(b) for b in self.batches.values()]}
+        return 200, {'part_index': 1, 'calc_state': 'COMPLETED'}
+
+
+def get_dummy_batch(project, state_vector=[1, 2, 3, 4, 5, 6]):
     return Batch(PropagationParams({
         'start_time': 'today',
         'end_time': 'tomorrow',
         'project_uuid': project
     }), OpmParams({
         'epoch': 'today',
-        'state_vector': [1, 2, 3, 4, 5, 6]
+        'state_vector': state_vector
     }))
 
 
@@ -127,9 +224,318 @@ class BatchRunnerTest(unittest.TestCase):
 
         batches.clear_expectations()
 
+    def test_submission_sizing_does_not_render_opms(self):
+        # Chunks are sized from the memoized OPM content; the full OPM, with a fresh
+        # creation date, is rendered only by the batches module when it submits.
+        batches = MockBatches()
+        b1 = get_dummy_batch("p1")
+        completed_state = StateSummary({'uuid': 'b1', 'calc_state': 'COMPLETED'})
+        batches.expect_new_batch(b1, StateSummary({'uuid': 'b1', 'calc_state': 'PENDING'}))
+        batches.expect_get_summaries("p1", {"b1": completed_state})
+        batches.expect_get_results(completed_state, PropagationResults([None]))
+
+        with mock.patch.object(OpmParams, 'generate_opm') as generate_opm:
+            BatchRunManager(batches, [b1], do_timing=False).run()
+        generate_opm.assert_not_called()
+        batches.clear_expectations()
+
+    def test_resume(self):
+        batches = MockBatches()
+        manifest_dir = tempfile.TemporaryDirectory()
+        manifest = os.path.join(manifest_dir.name, 'manifest.jsonl')
+
+        b1 = get_dummy_batch("p1")
+        b2 = get_dummy_batch("p1", [6, 5, 4, 3, 2, 1])
+        b1_completed = StateSummary({'uuid': 'b1', 'calc_state': 'COMPLETED'})
+        b2_completed = StateSummary({'uuid': 'b2', 'calc_state': 'COMPLETED'})
+        results = PropagationResults([None])
+
+        batches.expect_new_batch(b1, StateSummary({'uuid': 'b1', 'calc_state': 'PENDING'}))
+        batches.expect_new_batch(b2, StateSummary({'uuid': 'b2', 'calc_state': 'PENDING'}))
+        batches.expect_get_summaries("p1", {"b1": b1_completed, "b2": b2_completed})
+        batches.expect_get_results(b1_completed, results)
+        batches.expect_get_results(b2_completed, results)
+
+        batch_runner = BatchRunManager(batches, [b1, b2], multi_threaded=False,
+                                       manifest=manifest)
+        batch_runner.run()
+        batches.clear_expectations()
+
+        # Rebuild the same inputs in a different order, as after a restart. Nothing is
+        # resubmitted, and all results are retrieved again since none are in memory.
+        r2 = get_dummy_batch("p1", [6, 5, 4, 3, 2, 1])
+        r1 = get_dummy_batch("p1")
+        batches.expect_get_summaries("p1", {"b1": b1_completed, "b2": b2_completed})
+        batches.expect_get_results('b2', results)
+        batches.expect_get_results('b1', results)
+
+        batch_runner = BatchRunManager(batches, [r2, r1], multi_threaded=False)
+        batch_runner.resume(manifest)
+        self.assertEqual('b2', r2.get_uuid())
+        self.assertEqual('b1', r1.get_uuid())
+        self.assertEqual(results, r1.get_results())
+        batches.clear_expectations()
+
+        # Results recorded as fetched can be skipped, and new inputs are submitted.
+        r1 = get_dummy_batch("p1")
+        r3 = get_dummy_batch("p1", [0, 0, 0, 0, 0, 0])
+        b3_completed = StateSummary({'uuid': 'b3', 'calc_state': 'COMPLETED'})
+        batches.expect_new_batch(r3, StateSummary({'uuid': 'b3', 'calc_state': 'PENDING'}))
+        batches.expect_get_summaries("p1", {"b1": b1_completed, "b2": b2_completed})
+        batches.expect_get_summaries("p1", {"b1": b1_completed, "b3": b3_completed})
+        batches.expect_get_results(b3_completed, results)
+
+        batch_runner = BatchRunManager(batches, [r1, r3], multi_threaded=False,
+                                       manifest=manifest)
+        batch_runner.resume(skip_fetched=True)
+        self.assertEqual('b1', r1.get_uuid())
+        self.assertEqual('b3', r3.get_uuid())
+        self.assertIsNone(r1.get_results())
+        self.assertEqual(results, r3.get_results())
+        batches.clear_expectations()
+        self.assertEqual(0, len(batches.expected_get_results))
+
+        # Resuming with a different set of runs adds records for the new ones, without
+        # overwriting those of runs left out.
+        records = RunManifest(manifest).get_records()
+        self.assertEqual(['b1', 'b2', 'b3'], [r['uuid'] for r in records])
+        self.assertEqual([0, 1, 2], [r['i'] for r in records])
+        self.assertEqual('b2', RunManifest(manifest).match(
+            [batch_runner._get_input_hash(r2)])[0]['uuid'])
+
+        manifest_dir.cleanup()
+
+    def test_resume_before_fetching(self):
+        # The process dies after the batches complete but before their results are in.
+        rest = FlakyBatchesRest({})
+        working_get = rest.get
+
+        def get_without_parts(path, **kwargs):
+            if path.startswith('/batch/'):
+                raise RuntimeError("Connection lost")
+            return working_get(path, **kwargs)
+
+        rest.get = get_without_parts
+        manifest_dir = tempfile.TemporaryDirectory()
+        manifest = os.path.join(manifest_dir.name, 'manifest.jsonl')
+        with self.assertRaises(RuntimeError):
+            BatchRunManager(Batches(rest), [get_dummy_batch("p1")], multi_threaded=False,
+                            manifest=manifest).run()
+        self.assertEqual([False], [r['fetched'] for r in RunManifest(manifest).get_records()])
+
+        # Runs whose results can't be retrieved, here for lack of a parts count, are not
+        # recorded as fetched, so that a later resume tries again.
+        rest.get = working_get
+        del rest.batches['b0']['parts_count']
+        run = get_dummy_batch("p1")
+        BatchRunManager(Batches(rest), [run], multi_threaded=False).resume(manifest)
+        self.assertIsNone(run.get_results())
+        self.assertEqual([False], [r['fetched'] for r in RunManifest(manifest).get_records()])
+
+        # Resuming gets the summaries with their parts counts, and then the results.
+        rest.batches['b0']['parts_count'] = 1
+        run = get_dummy_batch("p1")
+        BatchRunManager(Batches(rest), [run], multi_threaded=False).resume(manifest)
+        self.assertEqual([1], rest.submitted)
+        self.assertEqual(1, run.get_state_summary().get_parts_count())
+        self.assertEqual(1, len(run.get_results().get_parts()))
+        self.assertEqual([True], [r['fetched'] for r in RunManifest(manifest).get_records()])
+
+        manifest_dir.cleanup()
+
+    def test_streaming(self):
+        server = FakeBatchesServer()
+        sunk = []
+
+        def runs():
+            for i in range(7):
+                run = get_dummy_batch("p1")
+                yield [run.get_propagation_params(), OpmParams({
+                    'epoch': 'today', 'state_vector': [i, 0, 0, 0, 0, 0]})]
+
+        def sink(index, batch):
+            sunk.append((index, batch.get_uuid(), batch.get_calc_state(),
+                         batch.get_results()))
+
+        batch_runner = BatchRunManager(server, runs(), multi_threaded=False,
+                                       result_sink=sink, max_in_flight=3)
+        batch_runner.run()
+
+        self.assertEqual(list(range(7)), server.submitted)
+        self.assertEqual(3, server.max_pending)
+        self.assertEqual([(i, 'b%s' % i, 'COMPLETED', 'b%s results' % i) for i in range(7)],
+                         sunk)
+        self.assertIsNone(batch_runner.get_batch_runs())
+        statuses = batch_runner.get_latest_statuses()
+        self.assertEqual(['b%s' % i for i in range(7)], statuses['COMPLETED'])
+        self.assertEqual([], statuses['PENDING'])
+
+    def test_streaming_rejects_mixed_projects(self):
+        server = FakeBatchesServer()
+        batch_runner = BatchRunManager(server, iter([get_dummy_batch("p1"),
+                                                     get_dummy_batch("p2")]),
+                                       result_sink=lambda i, b: None)
+        with self.assertRaises(ValueError):
+            batch_runner.run()
+
+    def test_events(self):
+        batches = MockBatches()
+
+        b1 = get_dummy_batch("p1")
+        b2 = get_dummy_batch("p1")
+        batches.expect_new_batch(b1, StateSummary({'uuid': 'b1', 'calc_state': 'PENDING'}))
+        batches.expect_new_batch(b2, StateSummary({'uuid': 'b2', 'calc_state': 'PENDING'}))
+        batches.expect_get_summaries("p1", {
+            'b1': StateSummary({'uuid': 'b1', 'calc_state': 'PENDING'}),
+            'b2': StateSummary({'uuid': 'b2', 'calc_state': 'FAILED'})})
+        batches.expect_get_summaries("p1", {
+            'b1': StateSummary({'uuid': 'b1', 'calc_state': 'COMPLETED'}),
+            'b2': StateSummary({'uuid': 'b2', 'calc_state': 'FAILED'})})
+        batches.expect_get_results('b1', 'b1 results')
+        batches.expect_get_results('b2', 'b2 results')
+
+        batch_runner = BatchRunManager(batches, [b1, b2], multi_threaded=False)
+        events = []
+        batch_runner.subscribe(lambda e: events.append(
+            (e.get_type(), e.get_index(), e.get_uuid(), e.get_state())))
+        failed = []
+        batch_runner.subscribe(lambda e: failed.append(e.get_uuid()), [EventType.FAILED])
+        batch_runner.run()
+
+        self.assertEqual([
+            (EventType.SUBMITTED, 0, 'b1', 'PENDING'),
+            (EventType.SUBMITTED, 1, 'b2', 'PENDING'),
+            (EventType.STATE_CHANGED, 1, 'b2', 'FAILED'),
+            (EventType.FAILED, 1, 'b2', 'FAILED'),
+            (EventType.STATE_CHANGED, 0, 'b1', 'COMPLETED'),
+            (EventType.RESULT_FETCHED, 0, 'b1', 'COMPLETED'),
+            (EventType.RESULT_FETCHED, 1, 'b2', 'FAILED'),
+            (EventType.RUN_FINISHED, None, None, 'COMPLETED')], events)
+        self.assertEqual(['b2'], failed)
+
+    def test_retry_failed(self):
+        server = FlakyBatchesServer({1: 1, 2: 5})
+        runs = [Batch(PropagationParams({'start_time': 'today', 'end_time': 'tomorrow',
+                                         'project_uuid': 'p1'}),
+                      OpmParams({'epoch': 'today', 'state_vector': [i, 0, 0, 0, 0, 0]}))
+                for i in range(3)]
+
+        batch_runner = BatchRunManager(server, runs, multi_threaded=False,
+                                       retry_policy=RetryPolicy(max_attempts=3))
+        batch_runner.run()
+
+        # Run 1 succeeds on its second attempt, run 2 gives up after its third.
+        self.assertEqual([0, 1, 2, 1, 2, 2], server.submitted)
+        self.assertEqual(['COMPLETED', 'COMPLETED', 'FAILED'],
+                         [b.get_calc_state() for b in runs])
+        self.assertEqual(['b0', 'b3', 'b5'], [b.get_uuid() for b in runs])
+        self.assertEqual(['b0 results', 'b3 results', 'b5 results'],
+                         [b.get_results() for b in runs])
+        self.assertEqual([1, 2, 3], [batch_runner.get_attempts(i) for i in range(3)])
+        self.assertEqual({'PENDING': 0, 'RUNNING': 0, 'COMPLETED': 2, 'FAILED': 1},
+                         batch_runner.get_status_snapshot().get_counts())
+
+        # Failures whose error does not match the filter are final.
+        server = FlakyBatchesServer({0: 1, 1: 1})
+        runs = [Batch(PropagationParams({'start_time': 'today', 'end_time': 'tomorrow',
+                                         'project_uuid': 'p1'}),
+                      OpmParams({'epoch': 'today', 'state_vector': [i, 0, 0, 0, 0, 0]}))
+                for i in range(2)]
+        batch_runner = BatchRunManager(server, runs, multi_threaded=False,
+                                       retry_policy=RetryPolicy(error_filter=r'timeout \(1\)'))
+        batch_runner.run()
+        self.assertEqual(['FAILED', 'COMPLETED'], [b.get_calc_state() for b in runs])
+
+    def test_retry_with_batches_cache(self):
+        rest = FlakyBatchesRest({1: 1})
+        batches = Batches(rest, result_cache=ResultCache(':memory:'))
+        runs = [Batch(PropagationParams({'start_time': 'today', 'end_time': 'tomorrow',
+                                         'project_uuid': 'p1'}),
+                      OpmParams({'epoch': 'today', 'state_vector': [i, 0, 0, 0, 0, 0]}))
+                for i in range(2)]
+
+        batch_runner = BatchRunManager(batches, runs, multi_threaded=False,
+                                       retry_policy=RetryPolicy(max_attempts=3))
+        batch_runner.run()
+
+        # The retry creates a new batch rather than getting the failed one from the cache.
+        self.assertEqual([0, 1, 1], rest.submitted)
+        self.assertEqual(['b0', 'b2'], [b.get_uuid() for b in runs])
+        self.assertEqual(['COMPLETED', 'COMPLETED'], [b.get_calc_state() for b in runs])
+        self.assertEqual([1, 2], [batch_runner.get_attempts(i) for i in range(2)])
+
+    def test_result_cache(self):
+        def make_runs(xs):
+            return [Batch(PropagationParams({'start_time': 'today', 'end_time': 'tomorrow',
+                                             'project_uuid': 'p1'}),
+                          OpmParams({'epoch': 'today', 'state_vector': [x, 0, 0, 0, 0, 0]}))
+                    for x in xs]
+
+        cache = ResultCache(':memory:')
+
+        # Identical runs are only submitted once.
+        server = FakeBatchesServer()
+        runs = make_runs([1, 2, 1])
+        batch_runner = BatchRunManager(server, runs, multi_threaded=False,
+                                       result_cache=cache)
+        batch_runner.run()
+        self.assertEqual([1, 2], server.submitted)
+        self.assertEqual(['b0', 'b1', 'b0'], [b.get_uuid() for b in runs])
+        self.assertEqual(['b0 results', 'b1 results', 'b0 results'],
+                         [b.get_results() for b in runs])
+        self.assertEqual(2, len(cache))
+
+        # Cached runs are not submitted, polled or fetched again.
+        server = FakeBatchesServer()
+        runs = make_runs([2, 3, 1])
+        batch_runner = BatchRunManager(server, runs, multi_threaded=False,
+                                       result_cache=cache)
+        batch_runner.run()
+        self.assertEqual([3], server.submitted)
+        self.assertEqual(['b1 results', 'b0 results', 'b0 results'],
+                         [b.get_results() for b in runs])
+        self.assertEqual({'PENDING': 0, 'RUNNING': 0, 'COMPLETED': 3, 'FAILED': 0},
+                         batch_runner.get_status_snapshot().get_counts())
+
+        # A run fully served from the cache never calls the server.
+        runs = make_runs([1, 3])
+        BatchRunManager(MockBatches(), runs, multi_threaded=False, result_cache=cache).run()
+        self.assertEqual(['b0 results', 'b0 results'], [b.get_results() for b in runs])
+
+        # Results kept differently are cached separately.
+        server = FakeBatchesServer()
+        runs = make_runs([1])
+        BatchRunManager(server, runs, multi_threaded=False, result_cache=cache,
+                        retention=ResultRetention.END_STATE).run()
+        self.assertEqual([1], server.submitted)
+        self.assertEqual(4, len(cache))
+
     def test_get_latest_statuses(self):
-        # TODO
-        pass
+        batches = MockBatches()
+
+        b1 = get_dummy_batch("p1")
+        b2 = get_dummy_batch("p1")
+        batches.expect_new_batch(b1, StateSummary({'uuid': 'b1', 'calc_state': 'PENDING'}))
+        batches.expect_new_batch(b2, StateSummary({'uuid': 'b2', 'calc_state': 'PENDING'}))
+
+        batch_runner = BatchRunManager(batches, [b1, b2], multi_threaded=False)
+        self.assertEqual({'PENDING': [], 'RUNNING': [], 'COMPLETED': [], 'FAILED': []},
+                         batch_runner.get_latest_statuses())
+
+        batch_runner._submit()
+        before = batch_runner.get_status_snapshot()
+        self.assertEqual(['b1', 'b2'], batch_runner.get_latest_statuses()['PENDING'])
+
+        batches.expect_get_summaries("p1", {
+            'b1': StateSummary({'uuid': 'b1', 'calc_state': 'RUNNING'}),
+            'b2': StateSummary({'uuid': 'b2', 'calc_state': 'FAILED'})})
+        batch_runner._update_state()
+        after = batch_runner.get_status_snapshot()
+        self.assertGreater(after.get_version(), before.get_version())
+        self.assertEqual({'PENDING': 0, 'RUNNING': 1, 'COMPLETED': 0, 'FAILED': 1},
+                         after.get_counts())
+        self.assertEqual({'PENDING': ['b1', 'b2'], 'RUNNING': [], 'COMPLETED': [],
+                          'FAILED': []}, before.as_dict())
 
 
 if __name__ == '__main__':
@@ -1,8 +1,11 @@
 from adam import Batch
 from adam.batch import StateSummary
 from adam.batch import PropagationResults
+from adam.batch import ResultRetention
+from adam.batch import _parse_end_state
 
-from datetime import datetime
+from datetime import datetime, timedelta
+import numpy as np
 import numpy.testing as npt
 import unittest
 
@@ -193,6 +196,41 @@ EphemerisTimePosVel
             pr.get_state_vector_at_time(datetime.strptime("12 Jul 2009 13:42:34.616",
                                                           "%d %b %Y %H:%M:%S.%f")))
 
+    def test_get_state_vectors_at_times(self):
+        pr = PropagationResults([{'part_index': 'a', 'calc_state': 'RUNNING'}])
+        self.assertIsNone(pr.get_state_vectors_at_times([datetime.now()]))
+
+        # Sampled backwards in time, as for a backwards propagation.
+        pr = PropagationResults([{
+            'part_index': 'a',
+            'calc_state': 'COMPLETED',
+            'stk_ephemeris': """
+ScenarioEpoch\t21 Jul 2009 13:42:34.615999999999985
+EphemerisTimePosVel
+0 0 0 0 1000 0 0
+-10 -10000 0 0 1000 0 0
+-20 -30000 0 0 3000 0 0
+END Ephemeris
+"""
+        }])
+        epoch = datetime.strptime("21 Jul 2009 13:42:34.616", "%d %b %Y %H:%M:%S.%f")
+        times = [epoch - timedelta(seconds=s) for s in [10, 5, 0, 30, 20]]
+
+        states = pr.get_state_vectors_at_times(times)
+        self.assertEqual((5, 6), states.shape)
+        npt.assert_almost_equal([-10, 0, 0, 1, 0, 0], states[0])
+        self.assertTrue(np.isnan(states[1]).all())
+        npt.assert_almost_equal([0, 0, 0, 1, 0, 0], states[2])
+        self.assertTrue(np.isnan(states[3]).all())
+        npt.assert_almost_equal([-30, 0, 0, 3, 0, 0], states[4])
+
+        # Constant velocity is interpolated exactly; outside of the ephemeris is not.
+        states = pr.get_state_vectors_at_times(np.array(times, dtype='datetime64[us]'),
+                                               interpolate=True)
+        npt.assert_almost_equal([-5, 0, 0, 1, 0, 0], states[1])
+        self.assertTrue(np.isnan(states[3]).all())
+        self.assertEqual([-10, 0, 0, 1, 0, 0], pr.get_state_vector_at_time(times[0]))
+
     def test_get_final_state_vector(self):
         pr = PropagationResults([None])
         self.assertIsNone(pr.get_end_state_vector())
@@ -219,6 +257,63 @@ some junk here
         self.assertEqual([0.006, 0.005, 0.004, 0.003, 0.002, 0.001],
                          pr.get_end_state_vector())
 
+    def test_parse_end_state(self):
+        ephemeris = """ScenarioEpoch\t21 Jul 2009 13:42:34.615999999999985
+EphemerisTimePosVel
+0 1000 2000 3000 4000 5000 6000
+60 7000 6000 5000 4000 3000 2000 # 8 9 10
+
+END Ephemeris
+1 2 3 4 5 6 7
+"""
+        # Only data rows before END Ephemeris count.
+        self.assertEqual([7, 6, 5, 4, 3, 2], _parse_end_state(ephemeris))
+        self.assertIsNone(_parse_end_state("no states\nEND Ephemeris\n"))
+
+        # The first line of a tail may be cut off, so it is never taken to be a state.
+        tail = ephemeris[ephemeris.index('000 6000 5000'):]
+        self.assertIsNone(_parse_end_state(tail, complete=False))
+        tail = ephemeris[ephemeris.index('000 2000 3000'):]
+        self.assertEqual([7, 6, 5, 4, 3, 2], _parse_end_state(tail, complete=False))
+
+    def test_retention(self):
+        ephemeris = """
+ScenarioEpoch\t21 Jul 2009 13:42:34.615999999999985
+
+EphemerisTimePosVel
+0 1000 2000 3000 4000 5000 6000
+60 7000 6000 5000 4000 3000 2000
+"""
+        parts = [{'part_index': 'a', 'calc_state': 'COMPLETED', 'stk_ephemeris': ephemeris},
+                 {'part_index': 'b', 'calc_state': 'COMPLETED', 'stk_ephemeris': ephemeris}]
+        end_state = [7, 6, 5, 4, 3, 2]
+        second = datetime.strptime("21 Jul 2009 13:42:34.616", "%d %b %Y %H:%M:%S.%f")
+
+        full = PropagationResults(parts)
+        self.assertEqual(ephemeris, full.get_final_ephemeris())
+        self.assertEqual(end_state, full.get_end_state_vector())
+
+        compressed = PropagationResults(parts, ResultRetention.COMPRESSED)
+        self.assertIsNone(compressed.get_parts()[1]._ephemeris)
+        self.assertEqual(ephemeris, compressed.get_final_ephemeris())
+        self.assertEqual(ephemeris, compressed.get_parts()[0].get_ephemeris())
+        self.assertEqual(end_state, compressed.get_end_state_vector())
+
+        arrays = PropagationResults(parts, ResultRetention.ARRAYS)
+        self.assertIsNone(arrays.get_final_ephemeris())
+        self.assertEqual(end_state, arrays.get_end_state_vector())
+        npt.assert_almost_equal([1, 2, 3, 4, 5, 6], arrays.get_state_vector_at_time(second))
+        epoch, times, states = arrays.get_parts()[0].get_parsed_ephemeris()
+        self.assertEqual("21 Jul 2009 13:42:34.615999999999985", epoch)
+        npt.assert_equal([0, 60], times)
+        self.assertEqual((2, 6), states.shape)
+
+        end_only = PropagationResults(parts, ResultRetention.END_STATE)
+        self.assertIsNone(end_only.get_final_ephemeris())
+        self.assertIsNone(end_only.get_parts()[0].get_end_state_vector())
+        self.assertEqual(end_state, end_only.get_end_state_vector())
+        self.assertIsNone(end_only.get_state_vector_at_time(second))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,10 @@
 from adam import PropagationParams
 from adam import OpmParams
 from adam.batch import StateSummary
+from adam.batch import ResultRetention
 from adam import Batches
+from adam import ResultCache
+from adam.errors import RequestTimeoutError
 
 from adam.rest_proxy import _RestProxyForTest
 
@@ -112,6 +115,14 @@ class BatchesTest(unittest.TestCase):
         self.assertEqual('2', states[1].get_uuid())
         self.assertEqual('RUNNING', states[1].get_calc_state())
 
+        # Timed out run.
+        rest.expect_post("/batches", self._check_inputs, 504, {})
+        with self.assertRaises(RequestTimeoutError):
+            batches.new_batches([
+                [self.dummy_propagation_params, self.dummy_opm_params],
+                [self.dummy_propagation_params, self.dummy_opm_params]
+            ])
+
         # Unsuccessful run.
         rest.expect_post("/batches", self._check_inputs, 400, {})
         with self.assertRaises(RuntimeError):
@@ -120,6 +131,87 @@ class BatchesTest(unittest.TestCase):
                 [self.dummy_propagation_params, self.dummy_opm_params]
             ])
 
+    def test_new_batches_from_states(self):
+        rest = _RestProxyForTest()
+        batches = Batches(rest)
+
+        def check_requests(data):
+            requests = data['requests']
+            self.assertEqual(2, len(requests))
+            self.assertEqual('AAA', requests[0]['start_time'])
+            self.assertEqual('BBB', requests[1]['end_time'])
+            self.assertIn('X = 1.0\n', requests[0]['opm_string'])
+            self.assertIn('X = 7.0\n', requests[1]['opm_string'])
+            return True
+
+        rest.expect_post("/batches", check_requests, 200, {'requests': [
+            {'calc_state': 'PENDING', 'uuid': '1'},
+            {'calc_state': 'PENDING', 'uuid': '2'}
+        ]})
+        states = batches.new_batches_from_states(
+            self.dummy_propagation_params, self.dummy_opm_params,
+            [[1, 2, 3, 4, 5, 6], [7, 8, 9, 10, 11, 12]])
+        self.assertEqual(['1', '2'], [s.get_uuid() for s in states])
+
+    def test_new_batches_result_cache(self):
+        rest = _RestProxyForTest()
+        batches = Batches(rest, result_cache=ResultCache(':memory:'))
+        other_opm_params = OpmParams({'epoch': 'foo', 'state_vector': [7, 8, 9, 10, 11, 12]})
+
+        def check_requests(data):
+            self.assertEqual(1, len(data['requests']))
+            return True
+
+        # Identical pairs are only created once.
+        rest.expect_post("/batches", check_requests, 200, {'requests': [
+            {'calc_state': 'PENDING', 'uuid': '1'}
+        ]})
+        states = batches.new_batches([
+            [self.dummy_propagation_params, self.dummy_opm_params],
+            [self.dummy_propagation_params, self.dummy_opm_params]
+        ])
+        self.assertEqual(['1', '1'], [s.get_uuid() for s in states])
+
+        # Pairs seen before are not sent again, once their batches are found to still
+        # be usable.
+        rest.expect_get('/batch?project_uuid=CCC', 200, {'items': [
+            {'calc_state': 'RUNNING', 'uuid': '1'}
+        ]})
+        rest.expect_post("/batches", check_requests, 200, {'requests': [
+            {'calc_state': 'PENDING', 'uuid': '2'}
+        ]})
+        states = batches.new_batches([
+            [self.dummy_propagation_params, other_opm_params],
+            [self.dummy_propagation_params, self.dummy_opm_params]
+        ])
+        self.assertEqual(['2', '1'], [s.get_uuid() for s in states])
+        self.assertEqual('RUNNING', states[1].get_calc_state())
+
+        # Batches which failed or were deleted since are created again, e.g. on retry.
+        rest.expect_get('/batch?project_uuid=CCC', 200, {'items': [
+            {'calc_state': 'FAILED', 'uuid': '1'}
+        ]})
+        rest.expect_post("/batches", check_requests, 200, {'requests': [
+            {'calc_state': 'PENDING', 'uuid': '3'}
+        ]})
+        states = batches.new_batches([
+            [self.dummy_propagation_params, self.dummy_opm_params],
+            [self.dummy_propagation_params, self.dummy_opm_params]
+        ])
+        self.assertEqual(['3', '3'], [s.get_uuid() for s in states])
+
+        rest.expect_get('/batch?project_uuid=CCC', 200, {'items': [
+            {'calc_state': 'COMPLETED', 'uuid': '3'}
+        ]})
+        rest.expect_post("/batches", check_requests, 200, {'requests': [
+            {'calc_state': 'PENDING', 'uuid': '4'}
+        ]})
+        states = batches.new_batches([
+            [self.dummy_propagation_params, other_opm_params],
+            [self.dummy_propagation_params, self.dummy_opm_params]
+        ])
+        self.assertEqual(['4', '3'], [s.get_uuid() for s in states])
+
     def test_delete_batch(self):
         rest = _RestProxyForTest()
         batches = Batches(rest)
@@ -182,7 +274,8 @@ class BatchesTest(unittest.TestCase):
 
     def test_get_propagation_results(self):
         rest = _RestProxyForTest()
-        batches = Batches(rest)
+        # The test proxy expects requests in order, so fetch parts one at a time.
+        batches = Batches(rest, part_workers=1)
 
         # Parts count not specified. No result retrieval is attempted.
         state = StateSummary({
@@ -212,6 +305,16 @@ class BatchesTest(unittest.TestCase):
         self.assertEqual('a', results.get_parts()[0].get_part_index())
         self.assertEqual('z', results.get_parts()[1].get_part_index())
 
+        # Only end states retained.
+        rest.expect_get('/batch/aaa/1', 200, {'part_index': 'a', 'calc_state': 'COMPLETED',
+                                              'stk_ephemeris': '0 1 2 3 4 5 6'})
+        rest.expect_get('/batch/aaa/2', 200, {'part_index': 'z', 'calc_state': 'COMPLETED',
+                                              'stk_ephemeris': '0 6 5 4 3 2 1'})
+        results = batches.get_propagation_results(state, retention=ResultRetention.END_STATE)
+        self.assertIsNone(results.get_final_ephemeris())
+        self.assertEqual([0.006, 0.005, 0.004, 0.003, 0.002, 0.001],
+                         results.get_end_state_vector())
+
         # Some parts could not be found.
         state = StateSummary({
             'uuid': 'aaa',
@@ -237,6 +340,56 @@ class BatchesTest(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             batches.get_propagation_results(state)
 
+    def test_get_propagation_results_lazy(self):
+        rest = _RestProxyForTest()
+        batches = Batches(rest, part_workers=1)
+
+        state = StateSummary({
+            'uuid': 'aaa',
+            'calc_state': 'COMPLETED',
+            'parts_count': 3,
+        })
+
+        # Only the final part is fetched up front.
+        rest.expect_get('/batch/aaa/3', 200, {'part_index': 'z', 'calc_state': 'COMPLETED',
+                                              'stk_ephemeris': '0 6 5 4 3 2 1'})
+        results = batches.get_propagation_results(state, lazy=True)
+        self.assertEqual([0.006, 0.005, 0.004, 0.003, 0.002, 0.001],
+                         results.get_end_state_vector())
+
+        # Other parts are fetched on first access, and only once.
+        rest.expect_get('/batch/aaa/2', 200, {'part_index': 'b', 'calc_state': 'COMPLETED'})
+        self.assertEqual('b', results.get_part(1).get_part_index())
+        self.assertEqual('b', results.get_part(1).get_part_index())
+
+        rest.expect_get('/batch/aaa/1', 404, 'Not json')
+        parts = results.get_parts()
+        self.assertIsNone(parts[0])
+        self.assertEqual(['b', 'z'], [p.get_part_index() for p in parts[1:]])
+        self.assertEqual(3, len(results.get_parts()))
+
+    def test_get_propagation_results_concurrently(self):
+        class UnorderedRest(object):
+            def __init__(self):
+                self.paths = []
+
+            def get(self, path):
+                self.paths.append(path)
+                return 200, {'part_index': path.split('/')[-1], 'calc_state': 'COMPLETED'}
+
+        rest = UnorderedRest()
+        batches = Batches(rest, part_workers=4)
+        state = StateSummary({
+            'uuid': 'aaa',
+            'calc_state': 'COMPLETED',
+            'parts_count': 10,
+        })
+        results = batches.get_propagation_results(state)
+        self.assertEqual([str(i + 1) for i in range(10)],
+                         [p.get_part_index() for p in results.get_parts()])
+        self.assertEqual(sorted(['/batch/aaa/%s' % (i + 1) for i in range(10)]),
+                         sorted(rest.paths))
+
 
 if __name__ == '__main__':
     unittest.main()
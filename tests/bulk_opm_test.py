@@ -0,0 +1,118 @@
+from adam import BulkOpmGenerator
+from adam import OpmParams
+from adam import RenderedOpm
+
+from datetime import datetime
+import numpy as np
+
+import unittest
+
+
+class BulkOpmGeneratorTest(unittest.TestCase):
+    """Unit tests for bulk OPM generation
+
+    """
+
+    creation_date = datetime(2020, 1, 2, 3, 4, 5)
+
+    covariance = [i * 0.5 for i in range(21)]
+
+    keplerian_elements = {
+        'semi_major_axis_km': 1.5,
+        'eccentricity': 0.1,
+        'inclination_deg': 3.0,
+        'ra_of_asc_node_deg': 4.0,
+        'arg_of_pericenter_deg': 5.0,
+        'mean_anomaly_deg': 6.0,
+        'gm': 7.0
+    }
+
+    def expected_opm(self, params, state, covariance=None, maneuver=None):
+        params = dict(params)
+        params['state_vector'] = state
+        if covariance is not None:
+            params['covariance'] = covariance
+        if maneuver is not None:
+            params['initial_maneuver'] = maneuver
+        opm = OpmParams(params).generate_opm()
+        # Only the creation date differs.
+        return "\n".join([line if not line.startswith('CREATION_DATE')
+                          else 'CREATION_DATE = %s' % self.creation_date
+                          for line in opm.splitlines()]) + "\n"
+
+    def test_render_matches_generate_opm(self):
+        params = {'epoch': '2017-10-04T00:00:00Z', 'state_vector': [0.0] * 6,
+                  'originator': 'a', 'mass': 5.0, 'initial_maneuver': [1.0, 2.0, 3.0]}
+        states = np.arange(12, dtype=np.float64).reshape(2, 6) * 1.5
+
+        generator = BulkOpmGenerator(OpmParams(params), creation_date=self.creation_date)
+        opms = generator.render(states)
+
+        self.assertEqual(2, len(opms))
+        for i in range(2):
+            self.assertEqual(self.expected_opm(params, states[i].tolist()), opms[i])
+
+    def test_render_covariances_and_maneuvers(self):
+        params = {'epoch': 'foo', 'state_vector': [0.0] * 6,
+                  'covariance': [0.0] * 21, 'perturbation': 3, 'hypercube': 'FACES'}
+        states = [[1.0, 2.0, 3.0, 4.0, 5.0, 6.0], [6.0, 5.0, 4.0, 3.0, 2.0, 1.0]]
+        covariances = [self.covariance, self.covariance[::-1]]
+        maneuvers = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]]
+
+        generator = BulkOpmGenerator(OpmParams(params), creation_date=self.creation_date)
+        opms = generator.render(states, covariances, maneuvers)
+
+        for i in range(2):
+            self.assertEqual(
+                self.expected_opm(params, states[i], covariances[i], maneuvers[i]), opms[i])
+
+        # Without per-state covariances, the template's is used.
+        opms = generator.render(states)
+        self.assertEqual(self.expected_opm(params, states[1]), opms[1])
+
+    def test_render_keplerian_covariance(self):
+        params = {'epoch': 'foo', 'keplerian_elements': self.keplerian_elements,
+                  'keplerian_covariance': self.covariance}
+        states = [[1.0, 2.0, 3.0, 4.0, 5.0, 6.0]]
+
+        generator = BulkOpmGenerator(OpmParams(params), creation_date=self.creation_date)
+        # The keplerian covariance takes the place of any cartesian one.
+        opms = generator.render(states, covariances=[[9.0] * 21])
+
+        self.assertEqual(self.expected_opm(params, states[0]), opms[0])
+        self.assertIn('USER_DEFINED_CM_M = 10.0\n', opms[0])
+        self.assertNotIn('CX_X', opms[0])
+
+    def test_render_processes(self):
+        params = {'epoch': 'foo', 'state_vector': [0.0] * 6}
+        states = np.random.RandomState(1).normal(size=(7, 6))
+
+        generator = BulkOpmGenerator(OpmParams(params), creation_date=self.creation_date)
+
+        self.assertEqual(generator.render(states), generator.render(states, processes=3))
+
+    def test_generate(self):
+        params = {'epoch': 'foo', 'state_vector': [0.0] * 6}
+        states = np.ones((3, 6))
+
+        generator = BulkOpmGenerator(OpmParams(params), creation_date=self.creation_date)
+        opms = generator.generate(states)
+
+        self.assertEqual(3, len(opms))
+        self.assertIsInstance(opms[0], RenderedOpm)
+        self.assertEqual([1.0] * 6, opms[2].get_state_vector())
+        self.assertEqual(self.expected_opm(params, [1.0] * 6), opms[2].generate_opm())
+
+    def test_invalid_shapes(self):
+        generator = BulkOpmGenerator(OpmParams({'epoch': 'foo', 'state_vector': [0.0] * 6}))
+
+        with self.assertRaises(ValueError):
+            generator.render(np.ones((2, 5)))
+        with self.assertRaises(ValueError):
+            generator.render(np.ones(6))
+        with self.assertRaises(ValueError):
+            generator.render(np.ones((2, 6)), maneuvers=np.ones((3, 3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+from adam.events import EventDispatcher
+from adam.events import EventType
+
+import threading
+import unittest
+
+
+class EventDispatcherTest(unittest.TestCase):
+    """Unit tests for the event dispatcher.
+
+    """
+
+    def test_delivery(self):
+        dispatcher = EventDispatcher()
+        # Nobody is listening, so this is dropped.
+        dispatcher.emit(EventType.SUBMITTED, index=0)
+
+        received = []
+        threads = set()
+
+        def callback(event):
+            received.append((event.get_type(), event.get_index()))
+            threads.add(threading.current_thread())
+
+        failures = []
+        dispatcher.subscribe(callback)
+        dispatcher.subscribe(lambda e: failures.append(e.get_uuid()), [EventType.FAILED])
+        dispatcher.subscribe(lambda e: 1 / 0)
+
+        dispatcher.emit(EventType.SUBMITTED, index=1)
+        dispatcher.emit(EventType.FAILED, index=1, uuid='a', state='FAILED')
+        dispatcher.flush()
+
+        self.assertEqual([(EventType.SUBMITTED, 1), (EventType.FAILED, 1)], received)
+        self.assertEqual(['a'], failures)
+        self.assertNotIn(threading.current_thread(), threads)
+
+        dispatcher.unsubscribe(callback)
+        dispatcher.emit(EventType.RUN_FINISHED)
+        dispatcher.flush()
+        self.assertEqual(2, len(received))
+
+
+if __name__ == '__main__':
+    unittest.main()
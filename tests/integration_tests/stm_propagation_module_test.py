@@ -69,7 +69,7 @@ class TestStmPropagationModule:
         )
 
         npt.assert_allclose(expected_end_state, np.array(end_state), rtol=1e-8, atol=0)
-        npt.assert_allclose(expected_stm.getA(), stm.getA(), rtol=1e-8, atol=0)
+        npt.assert_allclose(expected_stm.getA(), stm, rtol=1e-8, atol=0)
         # test fails due to
         # >       npt.assert_allclose(expected_stm.getA(), stm.getA(), rtol=1e-8, atol=0)
         # E       AssertionError:
@@ -86,4 +86,4 @@ class TestStmPropagationModule:
         # E              [ 7.111719e+00, -3.242025e+00, -5.930376e-01,  3.902784e+07,...
 
         npt.assert_allclose(expected_end_state, np.array(end_state_V), rtol=1e-8, atol=0)
-        npt.assert_allclose(expected_stm[:, 3:].getA(), stm_V.getA(), rtol=1e-8, atol=0)
+        npt.assert_allclose(expected_stm[:, 3:].getA(), stm_V, rtol=1e-8, atol=0)
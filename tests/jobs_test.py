@@ -1,12 +1,16 @@
 import json
+import time
 import unittest
 
+import numpy.testing as npt
 import requests
 from _pytest.monkeypatch import MonkeyPatch
 
+from adam import AdamProcessingService, OpmParams, PropagationParams, ResultCache
 from adam import MonteCarloResults, ApsRestServiceResultsProcessor
 from adam import rest_proxy
 from adam.batch_propagation_results import OrbitEventType
+from adam.events import EventType
 
 TEST_EPHEMERIS = """stk.v.11.0
 BEGIN Ephemeris
@@ -51,9 +55,11 @@ TEST_STATE_MISS_CSV = """#JobId=fake-job-id
 
 
 class MockResponse(object):
-    def __init__(self, text, status_code):
-        self.text = text
+    def __init__(self, text, status_code, headers=None, content=None):
+        self.content = text.encode('utf-8') if content is None else content
+        self.text = text if content is None else content.decode('utf-8', errors='replace')
         self.status_code = status_code
+        self.headers = headers or {}
 
     def json(self):
         return json.loads(self.text)
@@ -72,6 +78,26 @@ class JobsTest(unittest.TestCase):
             ApsRestServiceResultsProcessor(self.test_rest_proxy, self.fake_project_id),
             self.fake_job_id)
 
+    def tearDown(self):
+        self.monkeypatch.undo()
+
+    def test_wait_for_complete_events(self):
+        self.monkeypatch.setattr(time, 'sleep', lambda sec: None)
+        for status in ['PENDING', 'RUNNING', 'RUNNING', 'COMPLETED']:
+            self.test_rest_proxy.expect_get(
+                f"/projects/{self.fake_project_id}/jobs/{self.fake_job_id}/status",
+                200, {'status': status})
+
+        events = []
+        self.api.subscribe(lambda e: events.append(
+            (e.get_type(), e.get_uuid(), e.get_state(), e.get_previous_state())))
+        self.assertEqual('COMPLETED', self.api.wait_for_complete(max_wait_sec=60))
+        self.assertEqual([
+            (EventType.STATE_CHANGED, self.fake_job_id, 'PENDING', None),
+            (EventType.STATE_CHANGED, self.fake_job_id, 'RUNNING', 'PENDING'),
+            (EventType.STATE_CHANGED, self.fake_job_id, 'COMPLETED', 'RUNNING'),
+            (EventType.RUN_FINISHED, self.fake_job_id, 'COMPLETED', None)], events)
+
     def test_list_single_ephem_page(self):
         expected_data = {
             'resourceBasePath': f'https://storage.googleapis.com/{self.fake_project_id}',
@@ -131,6 +157,67 @@ class JobsTest(unittest.TestCase):
 
         self.assertEqual(TEST_EPHEMERIS, result)
 
+    def test_get_ephemeris_end_state(self):
+        results_data = {
+            'outputSummaryJson': '{}',
+            'outputDetailsJson': json.dumps({
+                'jobOutputPath': self.job_output_path,
+                'ephemeridesDirectoryPrefix': 'stk-ephemerides'
+            })
+        }
+        requested_ranges = []
+
+        def mock_get(*args, **kwargs):
+            assert args[0].startswith(self.job_output_path)
+            # Serve the requested tail, like a server supporting Range requests.
+            tail = int(kwargs['headers']['Range'].split('-')[-1])
+            requested_ranges.append(tail)
+            return MockResponse(TEST_EPHEMERIS[-tail:], 206)
+
+        self.monkeypatch.setattr(requests, 'get', mock_get)
+        self.test_rest_proxy.expect_get(
+            f"/projects/{self.fake_project_id}/jobs/{self.fake_job_id}/result",
+            200, results_data)
+
+        # The first tail is too short to hold a whole data row, so a longer one is fetched.
+        state = self.api.get_ephemeris_end_state(run_index=1, tail_bytes=64)
+        self.assertEqual([64, 256], requested_ranges)
+        expected = [-1.269446657501e+08, 5.751833781487e+07, -1.612243824298e+05,
+                    -1.439212586335e+01, -2.810259606631e+01, 4.797537329159e-02]
+        for actual, value in zip(state, expected):
+            self.assertAlmostEqual(value, actual)
+
+        # A server ignoring the Range header sends the whole file.
+        self.monkeypatch.setattr(requests, 'get',
+                                 lambda *args, **kwargs: MockResponse(TEST_EPHEMERIS, 200))
+        self.assertEqual(state, self.api.get_ephemeris_end_state(run_index=1, tail_bytes=64))
+
+        # Tails are sized in bytes: a tail of multibyte text holds fewer characters than
+        # requested, yet doesn't hold the whole file.
+        ephemeris = TEST_EPHEMERIS.replace('\n\n\nEND Ephemeris',
+                                           '\n# ' + '\u03a9' * 30 + '\n\n\nEND Ephemeris')
+        content = ephemeris.encode('utf-8')
+        requested_ranges.clear()
+
+        def mock_get_bytes(*args, **kwargs):
+            tail = int(kwargs['headers']['Range'].split('-')[-1])
+            requested_ranges.append(tail)
+            return MockResponse(None, 206, content=content[-tail:])
+
+        self.monkeypatch.setattr(requests, 'get', mock_get_bytes)
+        self.assertEqual(state, self.api.get_ephemeris_end_state(run_index=1, tail_bytes=64))
+        self.assertEqual([64, 256], requested_ranges)
+
+        # The Content-Range header tells whether the tail starts at the first byte.
+        def mock_get_range(*args, **kwargs):
+            tail = int(kwargs['headers']['Range'].split('-')[-1])
+            first = max(0, len(content) - tail)
+            return MockResponse(None, 206, content=content[first:], headers={
+                'Content-Range': 'bytes %s-%s/%s' % (first, len(content) - 1, len(content))})
+
+        self.monkeypatch.setattr(requests, 'get', mock_get_range)
+        self.assertEqual(state, self.api.get_ephemeris_end_state(run_index=1, tail_bytes=64))
+
     def test_get_ephemeris_content_not_found_raises(self):
         results_data = {
             'outputSummaryJson': '{}',
@@ -228,3 +315,98 @@ class JobsTest(unittest.TestCase):
         result = self.api.get_states_content(OrbitEventType.MISS)
 
         self.assertEqual(TEST_STATE_MISS_CSV, result)
+
+    def _expect_states_files(self, impact_csv, close_approach_csv=None):
+        state_files = ['states/MISS-00000-of-00001.csv', 'states/IMPACT-00000-of-00001.csv']
+        if close_approach_csv is not None:
+            state_files.append('states/CLOSE_APPROACH-00000-of-00001.csv')
+        results_data = {
+            'outputSummaryJson': '{}',
+            'outputDetailsJson': json.dumps({
+                'jobOutputPath': self.job_output_path,
+                'states': state_files
+            })
+        }
+
+        def mock_get(*args, **kwargs):
+            if 'states/IMPACT' in args[0]:
+                return MockResponse(impact_csv, 200)
+            if 'states/CLOSE_APPROACH' in args[0]:
+                return MockResponse(close_approach_csv, 200)
+            return MockResponse(TEST_STATE_MISS_CSV, 200)
+
+        self.monkeypatch.setattr(requests, 'get', mock_get)
+        self.test_rest_proxy.expect_get(
+            f"/projects/{self.fake_project_id}/jobs/{self.fake_job_id}/result",
+            200, results_data)
+
+    def test_get_final_states(self):
+        impact_csv = ('"runIndex","epoch","x","y","z","xdot","ydot","zdot"\n'
+                      '10,"2017-10-11T00:00:00Z",1000.0,2000.0,3000.0,4.0,5.0,6.0\n')
+        self._expect_states_files(impact_csv)
+
+        states = self.api.get_final_states()
+
+        # Runs from both files, in run order and in km, km/s.
+        self.assertEqual((11, 6), states.shape)
+        npt.assert_allclose([-2.69284718478173E8, 1.6019298007097527E7, -1.8148304914219505E7,
+                             -14.390860984829254, -28.10320139699668, 0.04797836551868571],
+                            states[3])
+        npt.assert_allclose([1.0, 2.0, 3.0, 0.004, 0.005, 0.006], states[10])
+
+    def test_get_final_states_close_approach(self):
+        impact_csv = ('"runIndex","epoch","x","y","z","xdot","ydot","zdot"\n'
+                      '10,"2017-10-11T00:00:00Z",1000.0,2000.0,3000.0,4.0,5.0,6.0\n')
+        # Run 11 stopped at its close approach; run 3 went on to its MISS state.
+        close_approach_csv = ('"runIndex","epoch","x","y","z","xdot","ydot","zdot"\n'
+                              '3,"2017-10-11T00:00:00Z",7000.0,0.0,0.0,0.0,0.0,0.0\n'
+                              '11,"2017-10-11T00:00:00Z",7000.0,8000.0,9000.0,1.0,2.0,3.0\n')
+        self._expect_states_files(impact_csv, close_approach_csv)
+
+        states = self.api.get_final_states()
+
+        self.assertEqual((12, 6), states.shape)
+        npt.assert_allclose([-2.69284718478173E8, 1.6019298007097527E7, -1.8148304914219505E7,
+                             -14.390860984829254, -28.10320139699668, 0.04797836551868571],
+                            states[3])
+        npt.assert_allclose([7.0, 8.0, 9.0, 0.001, 0.002, 0.003], states[11])
+
+    def test_get_final_states_missing_runs(self):
+        impact_csv = ('"runIndex","epoch","x","y","z","xdot","ydot","zdot"\n'
+                      '12,"2017-10-11T00:00:00Z",1000.0,2000.0,3000.0,4.0,5.0,6.0\n')
+        self._expect_states_files(impact_csv)
+
+        with self.assertRaises(RuntimeError):
+            self.api.get_final_states()
+
+    def test_result_cache_skips_failed_jobs(self):
+        propagation_params = PropagationParams({'start_time': 'a', 'end_time': 'b',
+                                                'project_uuid': self.fake_project_id})
+        opm_params = OpmParams({'epoch': 'e', 'state_vector': [1, 2, 3, 4, 5, 6]})
+        service = AdamProcessingService(self.test_rest_proxy,
+                                        result_cache=ResultCache(':memory:'))
+        jobs_path = f"/projects/{self.fake_project_id}/jobs"
+
+        self.test_rest_proxy.expect_post(jobs_path, lambda data: True, 200, {'uuid': 'j1'})
+        job = service.execute_batch_propagation(self.fake_project_id, propagation_params,
+                                                opm_params)
+        self.assertEqual('j1', job.job_id())
+
+        # A job still running is reused.
+        self.test_rest_proxy.expect_get(f"{jobs_path}/j1/status", 200, {'status': 'RUNNING'})
+        job = service.execute_batch_propagation(self.fake_project_id, propagation_params,
+                                                opm_params)
+        self.assertEqual('j1', job.job_id())
+
+        # Failed and deleted jobs are submitted again.
+        self.test_rest_proxy.expect_get(f"{jobs_path}/j1/status", 200, {'status': 'FAILED'})
+        self.test_rest_proxy.expect_post(jobs_path, lambda data: True, 200, {'uuid': 'j2'})
+        job = service.execute_batch_propagation(self.fake_project_id, propagation_params,
+                                                opm_params)
+        self.assertEqual('j2', job.job_id())
+
+        self.test_rest_proxy.expect_get(f"{jobs_path}/j2/status", 404, {})
+        self.test_rest_proxy.expect_post(jobs_path, lambda data: True, 200, {'uuid': 'j3'})
+        job = service.execute_batch_propagation(self.fake_project_id, propagation_params,
+                                                opm_params)
+        self.assertEqual('j3', job.job_id())
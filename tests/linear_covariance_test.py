@@ -0,0 +1,97 @@
+from adam.linear_covariance import LinearCovariancePropagation
+from adam.linear_covariance import covariance_from_lower_triangle
+from adam.linear_covariance import lower_triangle_from_covariance
+from adam.linear_covariance import propagate_covariance
+from adam.opm_params import OpmParams
+from adam.propagation_params import PropagationParams
+from adam.stm_propagation_module import StmPropagationModule
+from adam.stm_propagation_module import count_propagations
+from tests.stm_propagation_module_test import QuadraticPropagationServer
+
+import numpy as np
+import numpy.testing as npt
+
+import unittest
+
+
+class LinearCovarianceTest(unittest.TestCase):
+    """Unit tests for linear covariance propagation
+
+    """
+
+    propagation_params = PropagationParams({'start_time': 'a', 'end_time': 'b',
+                                            'project_uuid': 'p'})
+
+    states = [[1.5, -2.0, 3.0, 0.5, 0.25, -0.75], [7.0, 0.5, -1.0, 0.1, -0.3, 0.2]]
+
+    # Lower triangle of a diagonal covariance with a position-velocity correlation.
+    covariance = [1e-4, 0, 2e-4, 0, 0, 3e-4, 1e-6, 0, 0, 1e-7, 0, 0, 0, 0, 2e-7,
+                  0, 0, 0, 0, 0, 3e-7]
+
+    def expected_stm(self, state):
+        return QuadraticPropagationServer.A + np.diag(2.0 * np.array(state))
+
+    def test_lower_triangle(self):
+        matrix = covariance_from_lower_triangle(self.covariance)
+        npt.assert_array_equal(matrix, matrix.T)
+        # CX_DOT_X is row 3, column 0.
+        self.assertEqual(1e-6, matrix[3, 0])
+        self.assertEqual(3e-7, matrix[5, 5])
+        npt.assert_array_equal(self.covariance, lower_triangle_from_covariance(matrix))
+
+        stacked = covariance_from_lower_triangle([self.covariance] * 3)
+        self.assertEqual((3, 6, 6), stacked.shape)
+        with self.assertRaises(ValueError):
+            covariance_from_lower_triangle([1.0] * 6)
+
+    def test_propagate_covariance(self):
+        stms = np.array([np.eye(6) * 2.0, np.eye(6)])
+        covariances = covariance_from_lower_triangle([self.covariance] * 2)
+        propagated = propagate_covariance(stms, covariances)
+        npt.assert_allclose(4.0 * covariances[0], propagated[0])
+        npt.assert_allclose(covariances[1], propagated[1])
+
+    def test_run(self):
+        opm_params = [OpmParams({'epoch': 'e', 'state_vector': state,
+                                 'covariance': self.covariance, 'perturbation': 3,
+                                 'hypercube': 'FACES'})
+                      for state in self.states]
+        server = QuadraticPropagationServer()
+        propagation = LinearCovariancePropagation(StmPropagationModule(server))
+
+        results = propagation.run(self.propagation_params, opm_params)
+
+        self.assertEqual(2 * count_propagations(6), len(server.submitted))
+        self.assertIsNone(results.get_linearity_errors())
+        self.assertIsNone(results.is_linear())
+        p0 = covariance_from_lower_triangle(self.covariance)
+        for i, state in enumerate(self.states):
+            stm = self.expected_stm(state)
+            npt.assert_allclose(stm.dot(p0).dot(stm.T), results.get_covariances()[i],
+                                rtol=1e-5, atol=1e-12)
+        self.assertEqual((2, 21), results.get_covariance_lower_triangles().shape)
+
+        with self.assertRaises(ValueError):
+            propagation.run(self.propagation_params,
+                            [OpmParams({'epoch': 'e', 'state_vector': self.states[0]})])
+
+    def test_linearity_check(self):
+        opm_params = [OpmParams({'epoch': 'e', 'state_vector': state})
+                      for state in self.states]
+        # The quadratic term is negligible over a small covariance, but not a large one.
+        covariances = [self.covariance, np.array(self.covariance) * 1e6]
+        server = QuadraticPropagationServer()
+        propagation = LinearCovariancePropagation(StmPropagationModule(server),
+                                                  check_draws=5, seed=1)
+
+        results = propagation.run(self.propagation_params, opm_params,
+                                  covariances=covariances)
+
+        # The draws are run alongside the STM propagations.
+        self.assertEqual(2 * (count_propagations(6) + 5), len(server.submitted))
+        self.assertEqual((2,), results.get_linearity_errors().shape)
+        npt.assert_array_equal([True, False], results.is_linear())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,9 @@
 from adam import OpmParams
+from adam.run_manifest import hash_params
+
+import copy
+from datetime import datetime
+import pickle
 
 import unittest
 
@@ -135,11 +140,89 @@ DRAG_COEFF = 2.2"""
         self.maxDiff = None  # Otherwise if the next line fails, we can't see the diff
         self.assertEqual(expected_opm, opm)
 
+    def test_generate_opm_deterministic(self):
+        o = OpmParams({'epoch': 'foo', 'state_vector': [1, 2, 3, 4, 5, 6]})
+
+        opm = o.generate_opm(creation_date=datetime(2020, 1, 2))
+
+        self.assertEqual(opm, o.generate_opm(creation_date=datetime(2020, 1, 2)))
+        self.assertIn('CREATION_DATE = 2020-01-02 00:00:00\n', opm)
+        self.assertEqual("CCSDS_OPM_VERS = 2.0\nCREATION_DATE = 2020-01-02 00:00:00\n" +
+                         o.generate_opm_content(), opm)
+        self.assertNotIn('CREATION_DATE', o.generate_opm_content())
+
+    def test_generate_opm_content_memoized(self):
+        o = OpmParams({'epoch': 'foo', 'state_vector': [1, 2, 3, 4, 5, 6]})
+
+        content = o.generate_opm_content()
+        self.assertIs(content, o.generate_opm_content())
+
+        # Variants render again.
+        variant = o.replace(state_vector=[7, 8, 9, 10, 11, 12])
+        self.assertIn('X = 7\n', variant.generate_opm_content())
+        self.assertIn('X = 7\n', variant.generate_opm())
+        self.assertIs(content, o.generate_opm_content())
+
     def test_access_state_vector(self):
         o = OpmParams({'epoch': 'foo', 'state_vector': [1, 2, 3, 4, 5, 6]})
         self.assertEqual([1, 2, 3, 4, 5, 6], o.get_state_vector())
-        o.set_state_vector([6, 5, 4, 3, 2, 1])
-        self.assertEqual([6, 5, 4, 3, 2, 1], o.get_state_vector())
+        o2 = o.replace(state_vector=[6, 5, 4, 3, 2, 1])
+        self.assertEqual([6, 5, 4, 3, 2, 1], o2.get_state_vector())
+        self.assertEqual([1, 2, 3, 4, 5, 6], o.get_state_vector())
+
+    def test_copies_sequences(self):
+        state_vector = [1, 2, 3, 4, 5, 6]
+        covariance = [float(i) for i in range(21)]
+        maneuver = [0.001, 0.002, 0.003]
+        o = OpmParams({'epoch': 'foo', 'state_vector': state_vector, 'covariance': covariance,
+                       'perturbation': 3, 'hypercube': 'FACES',
+                       'initial_maneuver': maneuver})
+        opm = o.generate_opm()
+        content = o.generate_opm_content()
+        digest = hash_params(o)
+
+        # Changing the given lists in place changes neither the rendering nor the hash.
+        state_vector[0] = 7
+        covariance[0] = 7.0
+        maneuver[0] = 7.0
+        self.assertEqual(opm.splitlines()[2:], o.generate_opm().splitlines()[2:])
+        self.assertIs(content, o.generate_opm_content())
+        self.assertEqual(digest, hash_params(o))
+        self.assertEqual(digest, hash_params(o.replace()))
+
+        # Neither do changes to the lists given to replace(), or returned by the getters.
+        variant = o.replace(state_vector=state_vector)
+        variant_content = variant.generate_opm_content()
+        state_vector[1] = 8
+        variant.get_state_vector()[2] = 9
+        variant.get_covariance()[0] = 9.0
+        self.assertEqual(variant_content, variant.replace().generate_opm_content())
+        self.assertEqual([7, 2, 3, 4, 5, 6], variant.get_state_vector())
+
+    def test_immutable(self):
+        o = OpmParams({'epoch': 'foo', 'state_vector': [1, 2, 3, 4, 5, 6], 'mass': 5})
+
+        with self.assertRaises(AttributeError):
+            o._state_vector = [6, 5, 4, 3, 2, 1]
+        with self.assertRaises(AttributeError):
+            o.foo = 1
+        self.assertIs(o, copy.deepcopy(o))
+
+        # Variants share the unchanged fields.
+        o2 = o.replace(state_vector=[6, 5, 4, 3, 2, 1])
+        self.assertEqual(5, o2._mass)
+        self.assertIs(o._epoch, o2._epoch)
+
+        with self.assertRaises(KeyError):
+            o.replace(foo=1)
+        with self.assertRaises(KeyError):
+            o.replace(keplerian_elements={'eccentricity': 0.1})
+
+        # Pickling leaves out the memoized rendering.
+        o.generate_opm_content()
+        unpickled = pickle.loads(pickle.dumps(o))
+        self.assertEqual(o.generate_opm_content(), unpickled.generate_opm_content())
+        self.assertEqual([1, 2, 3, 4, 5, 6], unpickled.get_state_vector())
 
     def test_required_keys(self):
         with self.assertRaises(KeyError):
@@ -200,6 +283,34 @@ DRAG_COEFF = 2.2"""
                 'gm': 7
             }})
 
+    def test_remove_keplerian_elements(self):
+        elements = {
+            'semi_major_axis_km': 1,
+            'eccentricity': 0.1,
+            'inclination_deg': 3,
+            'ra_of_asc_node_deg': 4,
+            'arg_of_pericenter_deg': 5,
+            'true_anomaly_deg': 6,
+            'gm': 7
+        }
+        o = OpmParams({'epoch': 'foo', 'keplerian_elements': elements,
+                       'state_vector': [1, 2, 3, 4, 5, 6]})
+
+        cartesian = o.replace(keplerian_elements=None)
+        self.assertIsNone(cartesian.get_keplerian_elements())
+        self.assertNotIn('SEMI_MAJOR_AXIS', cartesian.generate_opm_content())
+        self.assertEqual(
+            OpmParams({'epoch': 'foo', 'keplerian_elements': None,
+                       'state_vector': [1, 2, 3, 4, 5, 6]}).generate_opm_content(),
+            cartesian.generate_opm_content())
+
+        # Something has to describe the orbit.
+        with self.assertRaises(KeyError):
+            OpmParams({'epoch': 'foo', 'keplerian_elements': elements}).replace(
+                keplerian_elements=None)
+        with self.assertRaises(KeyError):
+            OpmParams({'epoch': 'foo', 'keplerian_elements': None})
+
     def test_invalid_keys(self):
         with self.assertRaises(KeyError):
             OpmParams({'unrecognized': 0})
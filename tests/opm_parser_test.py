@@ -0,0 +1,143 @@
+from adam import OpmParams
+from adam.opm_parser import iter_opm_files
+from adam.opm_parser import load_opm_arrays
+from adam.opm_parser import parse_kvn
+from adam.opm_parser import parse_opm
+from adam.opm_parser import parse_opm_arrays
+
+from datetime import datetime
+import numpy as np
+import os
+import tempfile
+
+import unittest
+
+
+class OpmParserTest(unittest.TestCase):
+    """Unit tests for the OPM parser
+
+    """
+
+    covariance = [i * 0.25 for i in range(21)]
+
+    keplerian_elements = {
+        'semi_major_axis_km': 1.5e8,
+        'eccentricity': 0.1,
+        'inclination_deg': 3,
+        'ra_of_asc_node_deg': 4.5,
+        'arg_of_pericenter_deg': 5,
+        'true_anomaly_deg': 6.25,
+        'gm': 132712440041.9394
+    }
+
+    all_params = [
+        {'epoch': '2017-10-04T00:00:00Z', 'state_vector': [1.5, -2, 3e-9, 4, 5, 6]},
+        {'epoch': '2017-10-04T00:00:00.000Z',
+         'state_vector': [130347560.13690618, -74407287.6018632, -35247598.541470632,
+                          23.935241263310683, 27.146279819258538, 10.346605942591514],
+         'originator': 'a', 'object_name': 'b', 'object_id': 'c', 'center_name': 'EARTH',
+         'ref_frame': 'EMEME2000', 'mass': 500.5, 'solar_rad_area': 2, 'solar_rad_coeff': 3,
+         'drag_area': 4, 'drag_coeff': 5,
+         'covariance': covariance, 'perturbation': 3, 'hypercube': 'FACES',
+         'initial_maneuver': [0.001, -0.002, 0.0]},
+        {'epoch': 'foo', 'keplerian_elements': keplerian_elements,
+         'keplerian_covariance': covariance},
+    ]
+
+    def test_parse_kvn(self):
+        fields = parse_kvn("CCSDS_OPM_VERS = 2.0\n"
+                           "COMMENT Cartesian coordinate system\n"
+                           "\n"
+                           "  X =   1.5  \n"
+                           "USER_DEFINED_ADAM_INITIAL_PERTURBATION = 3 [sigma]\n"
+                           "COMMENT a = b\n"
+                           "MAN_DV_1 = 1\n")
+
+        self.assertEqual({'CCSDS_OPM_VERS': '2.0', 'X': '1.5', 'MAN_DV_1': '1',
+                          'USER_DEFINED_ADAM_INITIAL_PERTURBATION': '3'}, fields)
+
+        # Repeated keywords would otherwise silently lose values, e.g. further maneuvers.
+        with self.assertRaises(ValueError):
+            parse_kvn("X = 1\nX = 2\n")
+        opm = OpmParams(self.all_params[1]).generate_opm()
+        maneuver = opm[opm.index('MAN_EPOCH_IGNITION'):]
+        with self.assertRaises(ValueError):
+            parse_opm(opm + '\n' + maneuver.replace('MAN_DV_1 = 0.001', 'MAN_DV_1 = 0.002'))
+
+    def test_round_trip(self):
+        creation_date = datetime(2020, 1, 2)
+        for params in self.all_params:
+            opm = OpmParams(params).generate_opm(creation_date=creation_date)
+
+            parsed = parse_opm(opm)
+
+            self.assertEqual(opm, parsed.generate_opm(creation_date=creation_date))
+
+        mean_anomaly = dict(self.keplerian_elements)
+        del mean_anomaly['true_anomaly_deg']
+        mean_anomaly['mean_anomaly_deg'] = 7.5
+        params = {'epoch': 'foo', 'keplerian_elements': mean_anomaly,
+                  'keplerian_covariance': self.covariance}
+        opm = OpmParams(params).generate_opm_content()
+        self.assertEqual(opm, parse_opm("CCSDS_OPM_VERS = 2.0\n" + opm).generate_opm_content())
+
+    def test_parse_values(self):
+        parsed = parse_opm(OpmParams(self.all_params[1]).generate_opm())
+
+        self.assertEqual(self.all_params[1]['state_vector'], parsed.get_state_vector())
+        self.assertEqual(self.covariance, parsed.get_covariance())
+        self.assertEqual(3, parsed._perturbation)
+        self.assertEqual('FACES', parsed._hypercube)
+        self.assertEqual([0.001, -0.002, 0.0], list(parsed._initial_maneuver))
+
+        parsed = parse_opm(OpmParams(self.all_params[2]).generate_opm())
+        self.assertEqual(self.keplerian_elements, parsed.get_keplerian_elements())
+        self.assertEqual(self.covariance, parsed.get_keplerian_covariance())
+
+    def test_unsupported(self):
+        opm = OpmParams(self.all_params[1]).generate_opm()
+
+        with self.assertRaises(ValueError):
+            parse_opm(opm.replace('CCSDS_OPM_VERS = 2.0\n', ''))
+        with self.assertRaises(ValueError):
+            parse_opm(opm.replace('TIME_SYSTEM = UTC', 'TIME_SYSTEM = TDB'))
+        with self.assertRaises(ValueError):
+            parse_opm(opm.replace('MAN_DURATION = 0.0', 'MAN_DURATION = 10.0'))
+
+    def test_parse_opm_arrays(self):
+        opms = [OpmParams(params).generate_opm() for params in self.all_params]
+
+        arrays = parse_opm_arrays(opms)
+
+        self.assertEqual(['2017-10-04T00:00:00Z', '2017-10-04T00:00:00.000Z', 'foo'],
+                         arrays['epochs'])
+        self.assertEqual((3, 6), arrays['states'].shape)
+        self.assertEqual(self.all_params[1]['state_vector'], arrays['states'][1].tolist())
+        self.assertEqual([0.0] * 6, arrays['states'][2].tolist())
+        self.assertEqual(self.covariance, arrays['covariances'][1].tolist())
+        self.assertTrue(np.all(np.isnan(arrays['covariances'][[0, 2]])))
+        self.assertEqual([0.001, -0.002, 0.0], arrays['maneuvers'][1].tolist())
+        self.assertTrue(np.all(np.isnan(arrays['maneuvers'][0])))
+
+    def test_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for i in range(5):
+                path = os.path.join(directory, '%s.opm' % i)
+                params = dict(self.all_params[0])
+                params['state_vector'] = [float(i), 0.0, 0.0, 0.0, 0.0, 0.0]
+                with open(path, 'w') as f:
+                    f.write(OpmParams(params).generate_opm())
+                paths.append(path)
+
+            for processes in [None, 2]:
+                parsed = list(iter_opm_files(paths, processes=processes, chunksize=2))
+                self.assertEqual([float(i) for i in range(5)],
+                                 [p.get_state_vector()[0] for p in parsed])
+
+                arrays = load_opm_arrays(paths, processes=processes)
+                self.assertEqual([float(i) for i in range(5)], arrays['states'][:, 0].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -58,6 +58,23 @@ class PropagationParamsTest(unittest.TestCase):
         self.assertEqual(5, propParams.get_step_size())
         self.assertEqual('config', propParams.get_propagator_uuid())
 
+    def test_replace(self):
+        propParams = PropagationParams({'start_time': 'foo', 'end_time': 'bar',
+                                        'monteCarloDraws': 5})
+
+        variant = propParams.replace(monte_carlo_draws=10, description='variant')
+
+        self.assertEqual(10, variant.get_monte_carlo_draws())
+        self.assertEqual('variant', variant.get_description())
+        self.assertEqual('foo', variant.get_start_time())
+        self.assertEqual(5, propParams.get_monte_carlo_draws())
+        self.assertIsNone(propParams.get_description())
+
+        with self.assertRaises(AttributeError):
+            propParams._start_time = 'baz'
+        with self.assertRaises(KeyError):
+            propParams.replace(monteCarloDraws=10)
+
 
 if __name__ == '__main__':
     unittest.main()
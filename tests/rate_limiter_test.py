@@ -0,0 +1,34 @@
+from adam.rate_limiter import TokenBucket
+
+import time
+import unittest
+
+
+class TokenBucketTest(unittest.TestCase):
+    """Unit tests for token bucket rate limiter.
+
+    """
+
+    def test_rate(self):
+        bucket = TokenBucket(50, burst=5)
+        start = time.monotonic()
+        for _ in range(15):
+            bucket.acquire()
+        elapsed = time.monotonic() - start
+        # 5 calls are allowed at once, the other 10 at 50 per second.
+        self.assertGreaterEqual(elapsed, 0.18)
+        self.assertLess(elapsed, 1.0)
+
+    def test_unlimited(self):
+        bucket = TokenBucket(None)
+        start = time.monotonic()
+        for _ in range(1000):
+            bucket.acquire()
+        self.assertLess(time.monotonic() - start, 0.5)
+
+        with self.assertRaises(ValueError):
+            TokenBucket(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
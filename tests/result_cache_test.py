@@ -0,0 +1,96 @@
+from adam.batch import PropagationResults
+from adam.opm_params import OpmParams
+from adam.propagation_params import PropagationParams
+from adam.result_cache import ResultCache
+
+import os
+import tempfile
+import unittest
+
+
+class ResultCacheTest(unittest.TestCase):
+    """Unit tests for ResultCache
+
+    """
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'cache.sqlite')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_key(self):
+        cache = ResultCache(':memory:')
+
+        def make(x):
+            return [PropagationParams({'start_time': 'a', 'end_time': 'b'}),
+                    OpmParams({'epoch': 'c', 'state_vector': [x, 2, 3, 4, 5, 6]})]
+
+        self.assertEqual(cache.key('batch', *make(1)), cache.key('batch', *make(1)))
+        self.assertNotEqual(cache.key('batch', *make(1)), cache.key('batch', *make(2)))
+        self.assertNotEqual(cache.key('batch', *make(1)), cache.key('job', *make(1)))
+
+    def test_get_and_put(self):
+        cache = ResultCache(self.path)
+        self.assertIsNone(cache.get('a'))
+
+        cache.put('a', {'uuid': 'u1'})
+        cache.put('b', [1, 2])
+        self.assertEqual({'uuid': 'u1'}, cache.get('a'))
+        self.assertEqual(2, len(cache))
+
+        cache.put('a', 'replaced')
+        self.assertEqual('replaced', cache.get('a'))
+
+        # The cache is kept on disk.
+        self.assertEqual([1, 2], ResultCache(self.path).get('b'))
+
+        cache.delete('a')
+        self.assertIsNone(cache.get('a'))
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+    def test_ttl(self):
+        cache = ResultCache(':memory:', ttl_sec=0)
+        cache.put('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+        cache = ResultCache(':memory:', ttl_sec=3600)
+        cache.put('a', 1)
+        self.assertEqual(1, cache.get('a'))
+
+    def test_size_eviction(self):
+        cache = ResultCache(':memory:', max_bytes=2500)
+        cache.put('a', b'x' * 1000)
+        cache.put('b', b'x' * 1000)
+        # Using a makes b the least recently used.
+        cache.get('a')
+        cache.put('c', b'x' * 1000)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertLessEqual(cache.get_size(), 2500)
+
+    def test_lazy_results(self):
+        ephemeris = 'ephem %s'
+        loaded = []
+
+        def load(indices):
+            loaded.extend(indices)
+            return [{'part_index': i, 'calc_state': 'COMPLETED', 'stk_ephemeris': ephemeris % i}
+                    for i in indices]
+
+        cache = ResultCache(':memory:')
+        cache.put('a', PropagationResults.lazy(3, load))
+
+        # Parts not loaded yet are fetched to be stored.
+        self.assertEqual([2, 0, 1], loaded)
+        results = cache.get('a')
+        self.assertEqual(['ephem 0', 'ephem 1', 'ephem 2'],
+                         [p.get_ephemeris() for p in results.get_parts()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+from adam.retry_policy import RetryPolicy
+
+import unittest
+
+
+class RetryPolicyTest(unittest.TestCase):
+    """Unit tests for retry policy.
+
+    """
+
+    def test_attempt_limit(self):
+        policy = RetryPolicy(max_attempts=2)
+        self.assertFalse(policy.needs_error())
+        self.assertTrue(policy.should_retry(1))
+        self.assertFalse(policy.should_retry(2))
+
+        with self.assertRaises(ValueError):
+            RetryPolicy(max_attempts=0)
+
+    def test_error_filter(self):
+        policy = RetryPolicy(error_filter='[Tt]imeout')
+        self.assertTrue(policy.needs_error())
+        self.assertTrue(policy.should_retry(1, 'Worker timeout after 600s'))
+        self.assertFalse(policy.should_retry(1, 'Invalid OPM'))
+        self.assertFalse(policy.should_retry(1, None))
+        self.assertFalse(policy.should_retry(3, 'Timeout'))
+
+        policy = RetryPolicy(error_filter=lambda error: error is None)
+        self.assertTrue(policy.should_retry(1, None))
+        self.assertFalse(policy.should_retry(1, 'Invalid OPM'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+from adam.run_manifest import RunManifest
+from adam.run_manifest import hash_params
+from adam.bulk_opm import BulkOpmGenerator
+from adam.opm_params import OpmParams
+from adam.propagation_params import PropagationParams
+
+import os
+import tempfile
+import unittest
+
+
+class RunManifestTest(unittest.TestCase):
+    """Unit tests for RunManifest
+
+    """
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'manifest.jsonl')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_hash_params(self):
+        def make(x):
+            return [PropagationParams({'start_time': 'a', 'end_time': 'b'}),
+                    OpmParams({'epoch': 'c', 'state_vector': [x, 2, 3, 4, 5, 6]})]
+
+        self.assertEqual(hash_params(*make(1)), hash_params(*make(1)))
+        self.assertNotEqual(hash_params(*make(1)), hash_params(*make(2)))
+
+        # Memoizing the rendered OPM doesn't change the hash.
+        params = make(1)
+        before = hash_params(*params)
+        params[1].generate_opm()
+        self.assertEqual(before, hash_params(*params))
+
+    def test_hash_params_rendered_opm(self):
+        propagation_params = PropagationParams({'start_time': 'a', 'end_time': 'b'})
+        opm_params = OpmParams({'epoch': 'c', 'state_vector': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]})
+        rendered = BulkOpmGenerator(opm_params).generate([[1.0, 2.0, 3.0, 4.0, 5.0, 6.0]])
+
+        self.assertEqual(hash_params(propagation_params, opm_params),
+                         hash_params(propagation_params, rendered[0]))
+
+    def test_record_and_reload(self):
+        manifest = RunManifest(self.path)
+        manifest.record([{'i': 0, 'hash': 'h0', 'uuid': 'u0', 'state': 'PENDING',
+                          'fetched': False},
+                         {'i': 1, 'hash': 'h1', 'uuid': 'u1', 'state': 'PENDING',
+                          'fetched': False}])
+        manifest.record([{'i': 1, 'state': 'COMPLETED'}])
+        manifest.record([{'i': 1, 'fetched': True}])
+
+        # Simulate a write cut short by a crash.
+        with open(self.path, 'a') as f:
+            f.write('{"i": 0, "sta')
+
+        reloaded = RunManifest(self.path)
+        records = reloaded.get_records()
+        self.assertEqual(2, len(records))
+        self.assertEqual('PENDING', records[0]['state'])
+        self.assertFalse(records[0]['fetched'])
+        self.assertEqual('u1', records[1]['uuid'])
+        self.assertEqual('COMPLETED', records[1]['state'])
+        self.assertTrue(records[1]['fetched'])
+
+    def test_record_after_truncated_line(self):
+        manifest = RunManifest(self.path)
+        manifest.record([{'i': 0, 'hash': 'h0', 'uuid': 'u0', 'state': 'PENDING'}])
+        with open(self.path, 'a') as f:
+            f.write('{"i": 0, "sta')
+
+        # Records made after reopening are not lost on the truncated line.
+        RunManifest(self.path).record([{'i': 1, 'hash': 'h1', 'uuid': 'u1',
+                                        'state': 'PENDING'}])
+
+        records = RunManifest(self.path).get_records()
+        self.assertEqual(['u0', 'u1'], [r['uuid'] for r in records])
+        self.assertEqual('PENDING', records[0]['state'])
+
+    def test_reserve_index(self):
+        manifest = RunManifest(self.path)
+        manifest.record([{'i': 0, 'hash': 'h0'}, {'i': 1, 'hash': 'h1'}])
+
+        self.assertEqual(3, manifest.reserve_index(3))
+        # Taken indices, by records or reservations, are not handed out again.
+        self.assertEqual(4, manifest.reserve_index(1))
+        self.assertEqual(5, manifest.reserve_index(3))
+        self.assertEqual(2, manifest.reserve_index(2))
+
+    def test_match(self):
+        manifest = RunManifest(self.path)
+        manifest.record([{'i': 0, 'hash': 'same', 'uuid': 'u0', 'state': 'PENDING'},
+                         {'i': 1, 'hash': 'other', 'uuid': 'u1', 'state': 'PENDING'},
+                         {'i': 2, 'hash': 'same', 'uuid': 'u2', 'state': 'PENDING'}])
+
+        matched = manifest.match(['other', 'same', 'same', 'same', 'new'])
+        self.assertEqual('u1', matched[0]['uuid'])
+        self.assertEqual('u0', matched[1]['uuid'])
+        self.assertEqual('u2', matched[2]['uuid'])
+        self.assertIsNone(matched[3])
+        self.assertIsNone(matched[4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+from adam.adam_objects import AdamObject
+from adam.adam_objects import AdamObjectRunnableState
+from adam.batch import Batch
+from adam.batch import StateSummary
+from adam.opm_params import OpmParams
+from adam.propagation_params import PropagationParams
+from adam.run_scheduler import RunScheduler
+
+import threading
+import unittest
+
+
+class FakeBatchesServer:
+    """Completes each batch on the second poll of its project, counting polls."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.polls = {}
+        self.seen = {}
+        self.projects = {}
+
+    def new_batches(self, batch_params):
+        summaries = []
+        with self.lock:
+            for pair in batch_params:
+                uuid = 'b%s' % len(self.seen)
+                self.seen[uuid] = 0
+                self.projects[uuid] = pair[0].get_project_uuid()
+                summaries.append(StateSummary({'uuid': uuid, 'calc_state': 'PENDING'}))
+        return summaries
+
+    def get_summaries(self, project):
+        self.polls[project] = self.polls.get(project, 0) + 1
+        summaries = {}
+        for uuid in self.seen:
+            if self.projects[uuid] != project:
+                continue
+            self.seen[uuid] += 1
+            state = 'COMPLETED' if self.seen[uuid] >= 2 else 'RUNNING'
+            summaries[uuid] = StateSummary({'uuid': uuid, 'calc_state': state})
+        return summaries
+
+    def get_propagation_results(self, state_summary):
+        return state_summary.get_uuid() + ' results'
+
+
+class FakeRunnablesServer:
+    def __init__(self):
+        self.inserted = []
+
+    def insert(self, runnable, project):
+        runnable.set_uuid('r%s' % len(self.inserted))
+        self.inserted.append(project)
+
+    def get_runnable_states(self, project):
+        return [AdamObjectRunnableState({'uuid': 'r%s' % i, 'calculationState': 'COMPLETED'})
+                for i in range(len(self.inserted))]
+
+    def update_with_results(self, runnable):
+        pass
+
+    def get_children(self, uuid):
+        return [uuid + ' child']
+
+
+def get_batch(project, x):
+    return Batch(PropagationParams({
+        'start_time': 'today',
+        'end_time': 'tomorrow',
+        'project_uuid': project
+    }), OpmParams({
+        'epoch': 'today',
+        'state_vector': [x, 0, 0, 0, 0, 0]
+    }))
+
+
+class RunSchedulerTest(unittest.TestCase):
+    """Unit tests for run scheduler.
+
+    """
+
+    def test_run(self):
+        batches = FakeBatchesServer()
+        runnables = FakeRunnablesServer()
+        scheduler = RunScheduler(batches, runnables, max_workers=3, poll_interval_sec=0,
+                                 do_timing=False)
+
+        runs = [get_batch(p, i) for i, p in enumerate(['p1', 'p2', 'p1', 'p3'])]
+        managers = scheduler.add_batches(runs)
+        self.assertEqual(3, len(managers))
+        self.assertEqual(['p1', 'p2', 'p3'], [m.project for m in managers])
+
+        r = AdamObject()
+        scheduler.add_runnables([r], 'p4')
+        self.assertEqual(4, len(scheduler.get_managers()))
+
+        scheduler.run()
+
+        # Each project was polled once per tick until its runs completed.
+        self.assertEqual({'p1': 2, 'p2': 2, 'p3': 2}, batches.polls)
+        self.assertEqual(['COMPLETED'] * 4, [b.get_calc_state() for b in runs])
+        self.assertEqual([b.get_uuid() + ' results' for b in runs],
+                         [b.get_results() for b in runs])
+        self.assertEqual(['p4'], runnables.inserted)
+        self.assertEqual(['r0 child'], r.get_children())
+
+    def test_requires_modules(self):
+        scheduler = RunScheduler(do_timing=False)
+        with self.assertRaises(ValueError):
+            scheduler.add_batches([get_batch('p1', 0)])
+        with self.assertRaises(ValueError):
+            scheduler.add_runnables([AdamObject()], 'p1')
+
+
+if __name__ == '__main__':
+    unittest.main()
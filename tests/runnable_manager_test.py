@@ -0,0 +1,107 @@
+from adam.adam_objects import AdamObject
+from adam.adam_objects import AdamObjectRunnableState
+from adam.runnable_manager import RunnableManager
+
+import threading
+import time
+import unittest
+
+
+class FakeRunnablesModule:
+    """Completes runnables immediately, tracking concurrent insertion calls."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.count = 0
+
+    def _start_call(self, size):
+        with self.lock:
+            self.calls.append(size)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _end_call(self):
+        time.sleep(0.01)
+        with self.lock:
+            self.in_flight -= 1
+
+    def _new_uuid(self):
+        with self.lock:
+            self.count += 1
+            return 'r%s' % (self.count - 1)
+
+    def insert(self, runnable, project_uuid):
+        self._start_call(1)
+        runnable.set_uuid(self._new_uuid())
+        self._end_call()
+
+    def get_runnable_states(self, project_uuid):
+        return [AdamObjectRunnableState({'uuid': 'r%s' % i, 'calculationState': 'COMPLETED'})
+                for i in range(self.count)]
+
+    def update_with_results(self, runnable):
+        pass
+
+    def get_children(self, uuid):
+        return []
+
+
+class BulkRunnablesModule(FakeRunnablesModule):
+    def insert_many(self, runnables, project_uuid):
+        self._start_call(len(runnables))
+        for r in runnables:
+            r.set_uuid(self._new_uuid())
+        self._end_call()
+
+
+class RunnableManagerTest(unittest.TestCase):
+    """Unit tests for runnable manager.
+
+    """
+
+    def test_concurrent_submission(self):
+        module = FakeRunnablesModule()
+        runnables = [AdamObject() for _ in range(20)]
+        manager = RunnableManager(module, runnables, 'p1', do_timing=False,
+                                  requests_per_sec=None, max_concurrent_submissions=4)
+        manager.run()
+
+        self.assertEqual([1] * 20, module.calls)
+        self.assertLessEqual(module.max_in_flight, 4)
+        self.assertGreater(module.max_in_flight, 1)
+        self.assertEqual(20, len(set(r.get_uuid() for r in runnables)))
+        self.assertEqual([[]] * 20, [r.get_children() for r in runnables])
+
+    def test_bulk_submission(self):
+        module = BulkRunnablesModule()
+        runnables = [AdamObject() for _ in range(25)]
+        manager = RunnableManager(module, runnables, 'p1', do_timing=False, bulk_size=10)
+        manager.run()
+
+        self.assertEqual([10, 10, 5], sorted(module.calls, reverse=True))
+        self.assertEqual(['COMPLETED'] * 25,
+                         [r.get_runnable_state().get_calc_state() for r in runnables])
+
+    def test_child_rate_limiter(self):
+        class LimitedChildrenModule(FakeRunnablesModule):
+            def get_children(self, uuid, rate_limiter=None):
+                self.rate_limiters.append(rate_limiter)
+                return []
+
+        module = LimitedChildrenModule()
+        module.rate_limiters = []
+        manager = RunnableManager(module, [AdamObject() for _ in range(3)], 'p1',
+                                  do_timing=False, child_requests_per_sec=100.0)
+        manager.run()
+
+        # All child requests share one rate limiter.
+        self.assertEqual(3, len(module.rate_limiters))
+        self.assertEqual(1, len(set(id(limiter) for limiter in module.rate_limiters)))
+        self.assertEqual(100.0, module.rate_limiters[0].get_rate_per_sec())
+
+
+if __name__ == '__main__':
+    unittest.main()
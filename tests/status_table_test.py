@@ -0,0 +1,55 @@
+from adam.status_table import StatusTable
+
+import unittest
+
+
+class StatusTableTest(unittest.TestCase):
+    """Unit tests for the status table.
+
+    """
+
+    def test_counts_and_uuids(self):
+        table = StatusTable(3)
+        snapshot = table.get_snapshot()
+        self.assertEqual({'PENDING': 0, 'RUNNING': 0, 'COMPLETED': 0, 'FAILED': 0},
+                         snapshot.get_counts())
+        self.assertEqual([None, None, None], snapshot.get_states())
+
+        table.update([0, 2], ['a', 'c'], ['PENDING', 'RUNNING'])
+        table.update([0], ['a'], ['COMPLETED'])
+        snapshot = table.get_snapshot()
+        self.assertEqual(1, snapshot.get_count('COMPLETED'))
+        self.assertEqual(1, snapshot.get_count('RUNNING'))
+        self.assertEqual(0, snapshot.get_count('PENDING'))
+        self.assertEqual({'PENDING': [], 'RUNNING': ['c'], 'COMPLETED': ['a'], 'FAILED': []},
+                         snapshot.as_dict())
+
+        with self.assertRaises(KeyError):
+            table.update([1], ['b'], ['UNKNOWN'])
+
+    def test_snapshots_are_immutable_and_versioned(self):
+        table = StatusTable()
+        start = table.append(2)
+        self.assertEqual(0, start)
+        table.update([0, 1], ['a', 'b'], ['PENDING', 'PENDING'])
+
+        first = table.get_snapshot()
+        self.assertIs(first, table.get_snapshot())
+
+        # Writes after a snapshot do not show through it.
+        table.update([1], ['b'], ['FAILED'])
+        self.assertEqual(2, table.append(20))
+        second = table.get_snapshot()
+        self.assertGreater(second.get_version(), first.get_version())
+        self.assertEqual(['PENDING', 'PENDING'], first.get_states())
+        self.assertEqual(2, len(first))
+        self.assertEqual(['a'], second.get_uuids('PENDING'))
+        self.assertEqual(['b'], second.get_uuids('FAILED'))
+        self.assertEqual(22, len(second))
+
+        with self.assertRaises(ValueError):
+            second._states[0] = 3
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+from adam.batch import StateSummary
+from adam.opm_params import OpmParams
+from adam.opm_parser import parse_opm
+from adam.propagation_params import PropagationParams
+from adam.stm_propagation_module import DifferenceScheme
+from adam.stm_propagation_module import StmPropagationModule
+from adam.stm_propagation_module import count_propagations
+
+import numpy as np
+import numpy.testing as npt
+
+import unittest
+
+
+class _EndState(object):
+    def __init__(self, end_state):
+        self._end_state = end_state
+
+    def get_end_state_vector(self):
+        return self._end_state
+
+
+class QuadraticPropagationServer(object):
+    """Propagates each state x to A x + x * x, completing every batch immediately."""
+
+    A = np.arange(36, dtype=np.float64).reshape(6, 6) / 10.0
+
+    def __init__(self):
+        self.submitted = []
+        self.end_states = {}
+
+    def new_batches(self, batch_params):
+        summaries = []
+        for pair in batch_params:
+            uuid = 'b%s' % len(self.submitted)
+            x = np.array(parse_opm(pair[1].generate_opm()).get_state_vector())
+            self.submitted.append(x)
+            self.end_states[uuid] = (self.A.dot(x) + x * x).tolist()
+            summaries.append(StateSummary({'uuid': uuid, 'calc_state': 'PENDING'}))
+        return summaries
+
+    def get_summaries(self, project):
+        return {uuid: StateSummary({'uuid': uuid, 'calc_state': 'COMPLETED'})
+                for uuid in self.end_states}
+
+    def get_propagation_results(self, state_summary, **kwargs):
+        return _EndState(self.end_states[state_summary.get_uuid()])
+
+
+class StmPropagationModuleTest(unittest.TestCase):
+    """Unit tests for the STM propagation module
+
+    """
+
+    propagation_params = PropagationParams({'start_time': 'a', 'end_time': 'b',
+                                            'project_uuid': 'p'})
+
+    state = [1.5, -2.0, 3.0, 0.5, 0.25, -0.75]
+
+    def expected_stm(self):
+        return QuadraticPropagationServer.A + np.diag(2.0 * np.array(self.state))
+
+    def test_count_propagations(self):
+        self.assertEqual(7, count_propagations(6, DifferenceScheme.FORWARD))
+        self.assertEqual(13, count_propagations(6))
+        self.assertEqual(25, count_propagations(6, DifferenceScheme.RICHARDSON))
+        self.assertEqual(7, count_propagations(3))
+
+    def test_schemes(self):
+        opm_params = OpmParams({'epoch': 'e', 'state_vector': self.state})
+        x = np.array(self.state)
+        # Central differences are exact for quadratics; forward ones are off by h.
+        for scheme, rtol in [(DifferenceScheme.FORWARD, 1e-4),
+                             (DifferenceScheme.CENTRAL, 1e-6),
+                             (DifferenceScheme.RICHARDSON, 1e-6)]:
+            server = QuadraticPropagationServer()
+            stm_module = StmPropagationModule(server, scheme=scheme, relative_step=1e-4)
+
+            end_state, stm = stm_module.run_stm_propagation(self.propagation_params,
+                                                            opm_params)
+
+            self.assertEqual(count_propagations(6, scheme), len(server.submitted))
+            self.assertIsInstance(stm, np.ndarray)
+            self.assertEqual((6, 6), stm.shape)
+            npt.assert_allclose(QuadraticPropagationServer.A.dot(x) + x * x, end_state)
+            npt.assert_allclose(self.expected_stm(), stm, rtol=rtol, atol=1e-9)
+
+    def test_only_dV(self):
+        opm_params = OpmParams({'epoch': 'e', 'state_vector': self.state})
+        server = QuadraticPropagationServer()
+        stm_module = StmPropagationModule(server)
+
+        end_state, stm = stm_module.run_stm_propagation(
+            self.propagation_params, opm_params, only_dV=True,
+            scheme=DifferenceScheme.FORWARD)
+
+        self.assertEqual(4, len(server.submitted))
+        # Positions are never varied.
+        for x in server.submitted:
+            npt.assert_array_equal(self.state[0:3], x[0:3])
+        self.assertEqual((6, 3), stm.shape)
+        npt.assert_allclose(self.expected_stm()[:, 3:], stm, rtol=1e-5, atol=1e-9)
+
+    def test_run_stm_propagations(self):
+        states = [self.state, [7.0, 0.5, -1.0, 0.1, -0.3, 0.2], [-3.0, 4.0, 2.5, 0.0, 1.0, 2.0]]
+        opm_params = [OpmParams({'epoch': 'e%s' % i, 'state_vector': state})
+                      for i, state in enumerate(states)]
+        # Trajectories may belong to different projects; all still run as one sweep.
+        propagation_params = [self.propagation_params, self.propagation_params,
+                              self.propagation_params.replace(project_uuid='q')]
+        server = QuadraticPropagationServer()
+        stm_module = StmPropagationModule(server)
+
+        end_states, stms = stm_module.run_stm_propagations(propagation_params, opm_params)
+
+        self.assertEqual(3 * count_propagations(6), len(server.submitted))
+        self.assertEqual((3, 6), end_states.shape)
+        self.assertEqual((3, 6, 6), stms.shape)
+        for i, state in enumerate(states):
+            x = np.array(state)
+            npt.assert_allclose(QuadraticPropagationServer.A.dot(x) + x * x, end_states[i])
+            npt.assert_allclose(QuadraticPropagationServer.A + np.diag(2.0 * x), stms[i],
+                                rtol=1e-6, atol=1e-9)
+
+        # Each STM matches the one computed on its own.
+        single_end_state, single_stm = StmPropagationModule(
+            QuadraticPropagationServer()).run_stm_propagation(propagation_params[1],
+                                                              opm_params[1])
+        npt.assert_allclose(single_end_state, end_states[1])
+        npt.assert_allclose(single_stm, stms[1])
+
+    def test_run_stm_propagations_only_dV(self):
+        opm_params = [OpmParams({'epoch': 'e', 'state_vector': self.state})] * 2
+        server = QuadraticPropagationServer()
+        stm_module = StmPropagationModule(server, scheme=DifferenceScheme.RICHARDSON)
+
+        end_states, stms = stm_module.run_stm_propagations(
+            self.propagation_params, opm_params, only_dV=True)
+
+        self.assertEqual(2 * count_propagations(3, DifferenceScheme.RICHARDSON),
+                         len(server.submitted))
+        self.assertEqual((2, 6, 3), stms.shape)
+        for stm in stms:
+            npt.assert_allclose(self.expected_stm()[:, 3:], stm, rtol=1e-6, atol=1e-9)
+
+        with self.assertRaises(ValueError):
+            stm_module.run_stm_propagations([self.propagation_params], opm_params)
+
+    def test_richardson_accuracy(self):
+        # On a non-polynomial function, Richardson extrapolation beats central
+        # differences at the same step.
+        stm_module = StmPropagationModule(None, relative_step=1e-2)
+        x = np.array([0.3, 0.7])
+
+        def func(xs):
+            return np.sin(xs) * np.exp(xs)
+
+        expected = np.diag(np.exp(x) * (np.sin(x) + np.cos(x)))
+        errors = {}
+        for scheme in DifferenceScheme:
+            _, derivative = stm_module._evaluate_func_with_derivative(
+                x, func, scheme=scheme)
+            errors[scheme] = np.max(np.abs(derivative - expected))
+
+        self.assertLess(errors[DifferenceScheme.CENTRAL], errors[DifferenceScheme.FORWARD])
+        self.assertLess(errors[DifferenceScheme.RICHARDSON], errors[DifferenceScheme.CENTRAL])
+
+
+if __name__ == '__main__':
+    unittest.main()
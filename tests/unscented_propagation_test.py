@@ -0,0 +1,146 @@
+from adam.astro_utils import keplerian_to_cartesian
+from adam.linear_covariance import covariance_from_lower_triangle
+from adam.linear_covariance import lower_triangle_from_covariance
+from adam.opm_params import OpmParams
+from adam.propagation_params import PropagationParams
+from adam.stm_propagation_module import StmPropagationModule
+from adam.unscented_propagation import UnscentedPropagation
+from tests.stm_propagation_module_test import QuadraticPropagationServer
+
+import numpy as np
+import numpy.testing as npt
+
+import unittest
+
+
+class UnscentedPropagationTest(unittest.TestCase):
+    """Unit tests for unscented transform uncertainty propagation
+
+    """
+
+    propagation_params = PropagationParams({'start_time': 'a', 'end_time': 'b',
+                                            'project_uuid': 'p'})
+
+    states = [[1.5, -2.0, 3.0, 0.5, 0.25, -0.75], [7.0, 0.5, -1.0, 0.1, -0.3, 0.2]]
+
+    covariance = [1e-2, 0, 2e-2, 0, 0, 3e-2, 1e-3, 0, 0, 1e-3, 0, 0, 0, 0, 2e-3,
+                  0, 0, 0, 0, 0, 3e-3]
+
+    def test_sigma_points(self):
+        ut = UnscentedPropagation(None, alpha=0.5, kappa=1.0)
+        p = covariance_from_lower_triangle(self.covariance)
+        points = ut.get_sigma_points(self.states, [p, p])
+        self.assertEqual((2, 13, 6), points.shape)
+
+        # The weighted sigma points reproduce the mean and covariance they came from.
+        mean_weights, covariance_weights = ut.get_weights()
+        self.assertAlmostEqual(1.0, np.sum(mean_weights))
+        for i, state in enumerate(self.states):
+            npt.assert_allclose(state, mean_weights.dot(points[i]), atol=1e-12)
+            deviations = points[i] - state
+            npt.assert_allclose(p, np.einsum('i,ij,il->jl', mean_weights, deviations,
+                                             deviations), atol=1e-12)
+
+    def test_run(self):
+        opm_params = [OpmParams({'epoch': 'e', 'state_vector': state,
+                                 'covariance': self.covariance, 'perturbation': 3,
+                                 'hypercube': 'FACES'})
+                      for state in self.states]
+        server = QuadraticPropagationServer()
+        ut = UnscentedPropagation(StmPropagationModule(server))
+
+        results = ut.run(self.propagation_params, opm_params)
+
+        # All the sigma points are run together.
+        self.assertEqual(2 * 13, len(server.submitted))
+        self.assertEqual((2, 13, 6), results.get_end_states().shape)
+        self.assertEqual((2, 21), results.get_covariance_lower_triangles().shape)
+
+        # For x -> A x + x * x, the mean picks up the variances, which the unscented
+        # transform captures exactly, and the covariance J P J^T + 2 P * P.
+        p = covariance_from_lower_triangle(self.covariance)
+        for i, state in enumerate(self.states):
+            x = np.array(state)
+            npt.assert_allclose(QuadraticPropagationServer.A.dot(x) + x * x + np.diag(p),
+                                results.get_means()[i], atol=1e-12)
+            jacobian = QuadraticPropagationServer.A + np.diag(2.0 * x)
+            npt.assert_allclose(jacobian.dot(p).dot(jacobian.T) + 2.0 * p * p,
+                                results.get_covariances()[i], atol=5e-3)
+
+        with self.assertRaises(ValueError):
+            ut.run(self.propagation_params,
+                   [OpmParams({'epoch': 'e', 'state_vector': self.states[0]})])
+
+    def test_run_covariances(self):
+        opm_params = [OpmParams({'epoch': 'e', 'state_vector': self.states[0]})]
+        server = QuadraticPropagationServer()
+        ut = UnscentedPropagation(StmPropagationModule(server))
+
+        results = ut.run(self.propagation_params, opm_params,
+                         covariances=[np.array(self.covariance) * 0.0])
+
+        # Without any uncertainty every sigma point is the nominal state.
+        x = np.array(self.states[0])
+        npt.assert_allclose(QuadraticPropagationServer.A.dot(x) + x * x,
+                            results.get_means()[0])
+        npt.assert_allclose(np.zeros((6, 6)), results.get_covariances()[0], atol=1e-12)
+
+    def test_run_keplerian(self):
+        elements = {'semi_major_axis_km': 7000.0, 'eccentricity': 0.1,
+                    'inclination_deg': 30.0, 'ra_of_asc_node_deg': 10.0,
+                    'arg_of_pericenter_deg': 20.0, 'mean_anomaly_deg': 45.0,
+                    'gm': 398600.4418}
+        keplerian_covariance = lower_triangle_from_covariance(
+            np.diag([1.0, 1e-6, 1e-4, 1e-4, 1e-4, 1e-4]))
+        opm_params = [OpmParams({'epoch': 'e', 'keplerian_elements': elements,
+                                 'keplerian_covariance': keplerian_covariance.tolist()})]
+        server = QuadraticPropagationServer()
+        ut = UnscentedPropagation(StmPropagationModule(server))
+
+        results = ut.run(self.propagation_params, opm_params)
+
+        # The sigma points are converted to cartesian states, nominal one first.
+        self.assertEqual(13, len(server.submitted))
+        nominal = keplerian_to_cartesian([7000.0, 0.1, 30.0, 10.0, 20.0, 45.0],
+                                         398600.4418, mean_anomaly=True)
+        npt.assert_allclose(nominal, server.submitted[0], rtol=1e-12)
+        spread = np.std(np.array(server.submitted), axis=0)
+        self.assertTrue(np.all(spread > 0))
+        self.assertEqual((1, 6, 6), results.get_covariances().shape)
+
+    def test_keplerian_anomaly_precedence(self):
+        # The sigma points are of the anomaly the OPM renders, with its covariance.
+        elements = {'semi_major_axis_km': 7000.0, 'eccentricity': 0.1,
+                    'inclination_deg': 30.0, 'ra_of_asc_node_deg': 10.0,
+                    'arg_of_pericenter_deg': 20.0, 'true_anomaly_deg': 45.0,
+                    'gm': 398600.4418}
+        keplerian_covariance = lower_triangle_from_covariance(
+            np.diag([1.0, 1e-6, 1e-4, 1e-4, 1e-4, 1e-4]))
+        opm = OpmParams({'epoch': 'e', 'keplerian_elements': elements,
+                         'keplerian_covariance': keplerian_covariance.tolist()})
+        self.assertIn('USER_DEFINED_CT_T', opm.generate_opm_content())
+
+        points, _ = UnscentedPropagation(None)._get_initial_sigma_points([opm], None)
+
+        nominal = keplerian_to_cartesian([7000.0, 0.1, 30.0, 10.0, 20.0, 45.0], 398600.4418)
+        npt.assert_allclose(nominal, points[0][0], rtol=1e-12)
+
+    def test_keplerian_invalid_sigma_points(self):
+        # A spread of the eccentricity this wide gives sigma points with e < 0.
+        elements = {'semi_major_axis_km': 7000.0, 'eccentricity': 0.01,
+                    'inclination_deg': 30.0, 'ra_of_asc_node_deg': 10.0,
+                    'arg_of_pericenter_deg': 20.0, 'true_anomaly_deg': 45.0,
+                    'gm': 398600.4418}
+        keplerian_covariance = lower_triangle_from_covariance(
+            np.diag([1.0, 1e-4, 1e-4, 1e-4, 1e-4, 1e-4]))
+        opm = OpmParams({'epoch': 'e', 'keplerian_elements': elements,
+                         'keplerian_covariance': keplerian_covariance.tolist()})
+
+        with self.assertRaises(ValueError):
+            UnscentedPropagation(None)._get_initial_sigma_points([opm], None)
+        # A smaller alpha keeps them closer to the nominal elements.
+        UnscentedPropagation(None, alpha=0.01)._get_initial_sigma_points([opm], None)
+
+
+if __name__ == '__main__':
+    unittest.main()